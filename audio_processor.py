@@ -1,10 +1,12 @@
 """
 Audio processing module for handling voice messages and transcription
 """
-import os
+import io
+import asyncio
 import logging
-import tempfile
+import re
 import requests
+import httpx
 from typing import Optional, Tuple
 import config
 
@@ -17,11 +19,22 @@ except ImportError:
 
 logger = logging.getLogger(__name__)
 
+# Voice files are streamed from Telegram in chunks of this size
+DOWNLOAD_CHUNK_SIZE = 10 * 1024
+
 class AudioProcessor:
     """Handle audio transcription using Eleven Labs API"""
     
     def __init__(self):
         """Initialize Eleven Labs client"""
+        # Long-lived HTTP sessions so TCP/TLS connections are reused across voice messages
+        self.session = requests.Session()
+        self.session.mount('https://', requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=16))
+        self.http_client = httpx.Client(
+            timeout=httpx.Timeout(60.0, connect=10.0),
+            limits=httpx.Limits(max_connections=16, max_keepalive_connections=16, keepalive_expiry=300)
+        )
+        
         if not ELEVENLABS_AVAILABLE:
             logger.warning("⚠️ ElevenLabs not available. Voice transcription disabled.")
             self.client = None
@@ -33,61 +46,59 @@ class AudioProcessor:
             return
         
         try:
-            self.client = ElevenLabs(api_key=config.ELEVEN_LABS_API_KEY)
+            self.client = ElevenLabs(api_key=config.ELEVEN_LABS_API_KEY, httpx_client=self.http_client)
             logger.info("✅ Eleven Labs client initialized successfully")
         except Exception as e:
             logger.error(f"🔥 Failed to initialize Eleven Labs client: {e}")
             self.client = None
     
-    async def download_voice_file(self, file_url: str, file_path: str) -> bool:
-        """Download voice file from Telegram servers"""
+    def download_voice_file(self, file_url: str) -> Optional[bytes]:
+        """Download voice file from Telegram servers into memory"""
         try:
-            response = requests.get(file_url, timeout=30)
-            response.raise_for_status()
+            buffer = io.BytesIO()
+            with self.session.get(file_url, timeout=30, stream=True) as response:
+                response.raise_for_status()
+                for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                    buffer.write(chunk)
             
-            with open(file_path, 'wb') as f:
-                f.write(response.content)
-            
-            file_size = os.path.getsize(file_path)
-            logger.info(f"✅ Voice file downloaded successfully. Size: {file_size} bytes")
-            return True
+            logger.info(f"✅ Voice file downloaded successfully. Size: {buffer.tell()} bytes")
+            return buffer.getvalue()
             
         except requests.RequestException as e:
             logger.error(f"🔥 Failed to download voice file: {e}")
-            return False
+            return None
         except Exception as e:
             logger.error(f"🔥 Unexpected error downloading voice file: {e}")
-            return False
+            return None
+    
+    @staticmethod
+    def _audio_upload(audio_data: bytes) -> io.BytesIO:
+        """Wrap audio bytes in a named in-memory file for the STT upload"""
+        audio_file = io.BytesIO(audio_data)
+        audio_file.name = "voice.ogg"
+        return audio_file
     
-    def transcribe_audio(self, audio_file_path: str) -> Optional[str]:
-        """Transcribe audio file using Eleven Labs Speech-to-Text"""
+    def transcribe_audio(self, audio_data: bytes) -> Optional[str]:
+        """Transcribe audio bytes using Eleven Labs Speech-to-Text"""
         if not self.client:
             logger.error("🔥 Eleven Labs client not available for transcription")
             return None
             
         try:
-            logger.info(f"🎤 Starting transcription for file: {audio_file_path}")
-            
-            # Check if file exists and has content
-            if not os.path.exists(audio_file_path):
-                logger.error(f"🔥 Audio file not found: {audio_file_path}")
-                return None
-            
-            file_size = os.path.getsize(audio_file_path)
-            if file_size == 0:
-                logger.error(f"🔥 Audio file is empty: {audio_file_path}")
+            # Check that the audio has content
+            if not audio_data:
+                logger.error("🔥 Audio data is empty")
                 return None
             
-            logger.info(f"📁 File size: {file_size} bytes")
+            logger.info(f"🎤 Starting transcription, size: {len(audio_data)} bytes")
             
             # Use Eleven Labs Speech-to-Text with correct API format
             try:
                 # Correct ElevenLabs API format from documentation
-                with open(audio_file_path, 'rb') as audio_file:
-                    result = self.client.speech_to_text.convert(
-                        model_id='scribe_v1',
-                        file=audio_file
-                    )
+                result = self.client.speech_to_text.convert(
+                    model_id='scribe_v1',
+                    file=self._audio_upload(audio_data)
+                )
                 
                 # Log the raw response for debugging
                 logger.info(f"🔍 Raw ElevenLabs response type: {type(result)}")
@@ -110,7 +121,6 @@ class AudioProcessor:
                     # Try to access as string representation
                     result_str = str(result)
                     # Look for text=" pattern in the string
-                    import re
                     text_match = re.search(r'text="([^"]*)"', result_str)
                     if text_match:
                         transcription = text_match.group(1)
@@ -127,11 +137,10 @@ class AudioProcessor:
                 logger.warning(f"⚠️ scribe_v1 model failed: {e1}, trying alternative models...")
                 try:
                     # Try alternative model
-                    with open(audio_file_path, 'rb') as audio_file:
-                        result = self.client.speech_to_text.convert(
-                            model_id='eleven_english_sts_v2',
-                            file=audio_file
-                        )
+                    result = self.client.speech_to_text.convert(
+                        model_id='eleven_english_sts_v2',
+                        file=self._audio_upload(audio_data)
+                    )
                     
                     # Log the fallback response for debugging
                     logger.info(f"🔍 Fallback response type: {type(result)}")
@@ -174,20 +183,15 @@ class AudioProcessor:
             logger.error("🔥 Eleven Labs client not available for voice processing")
             return None
             
-        temp_file = None
         try:
-            # Create temporary file for audio
-            with tempfile.NamedTemporaryFile(suffix='.ogg', delete=False) as temp_file:
-                temp_file_path = temp_file.name
-            
             logger.info(f"📥 Processing voice message from URL: {file_url}")
             
-            # Download voice file
-            if not await self.download_voice_file(file_url, temp_file_path):
+            # Download and transcribe in memory, off the event loop
+            audio_data = await asyncio.to_thread(self.download_voice_file, file_url)
+            if not audio_data:
                 return None
             
-            # Transcribe audio
-            transcription = self.transcribe_audio(temp_file_path)
+            transcription = await asyncio.to_thread(self.transcribe_audio, audio_data)
             
             if transcription:
                 logger.info(f"✅ Voice message processed successfully")
@@ -199,14 +203,12 @@ class AudioProcessor:
         except Exception as e:
             logger.error(f"🔥 Voice message processing failed: {e}")
             return None
-        finally:
-            # Clean up temporary file
-            if temp_file and os.path.exists(temp_file_path):
-                try:
-                    os.unlink(temp_file_path)
-                    logger.info("🧹 Temporary audio file cleaned up")
-                except Exception as e:
-                    logger.warning(f"⚠️ Failed to clean up temporary file: {e}")
+
+    def close(self) -> None:
+        """Close pooled HTTP connections"""
+        self.session.close()
+        self.http_client.close()
+        logger.info("✅ Audio processor HTTP sessions closed")
 
 # Global instance
 audio_processor = AudioProcessor()
@@ -1,11 +1,23 @@
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram import BotCommand, Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import CallbackContext, ConversationHandler, CommandHandler, MessageHandler, CallbackQueryHandler, filters
+import asyncio
+from bisect import bisect_right
+import html
 import logging
+import random
 import re
-import sqlite3
+import threading
+import time
+from collections import OrderedDict, defaultdict, deque
+from functools import lru_cache, partial
 import config
-from datetime import datetime
+from datetime import datetime, timedelta
+from enum import IntFlag
 from database import db
+from db_cache import (
+    cached, cached_user_info, cached_user_vocabulary_count, cached_word_exists, cached_user_blocked,
+    cached_user_speaking_stats, cached_user_writing_stats, cached_user_profile, cached_user_stats, invalidate_user
+)
 
 from gemini_api import (
     get_random_word_details, generate_ielts_writing_task, evaluate_writing,
@@ -22,6 +34,30 @@ FULL_SIM_PART_1 = 1
 FULL_SIM_PART_2 = 2
 FULL_SIM_PART_3 = 3
 
+# Pending free-text input, stored as a single bit mask in user_data['wait']
+class WaitState(IntFlag):
+    NONE = 0
+    VOCAB_TOPIC = 1
+    WRITING_TOPIC = 2
+    GRAMMAR_TOPIC = 4
+    WRITING_CHECK_ESSAY = 8
+    VOICE_RESPONSE = 16
+    WRITING_CHECK_TASK = 32
+    SPEAKING_CONFIRMATION = 64
+    ADMIN_SEARCH = 128
+
+def set_waiting(context: CallbackContext, state: WaitState) -> None:
+    """Mark that the user is expected to send the given input next"""
+    context.user_data['wait'] = context.user_data.get('wait', WaitState.NONE) | state
+
+def clear_waiting(context: CallbackContext, state: WaitState) -> None:
+    """Clear a pending input flag"""
+    context.user_data['wait'] = context.user_data.get('wait', WaitState.NONE) & ~state
+
+def is_waiting(context: CallbackContext, state: WaitState) -> bool:
+    """Check whether the user is expected to send the given input"""
+    return bool(context.user_data.get('wait', WaitState.NONE) & state)
+
 # Flashcard conversation states
 FLASHCARD_DECK_NAME = 10
 FLASHCARD_DECK_DESCRIPTION = 11
@@ -45,33 +81,39 @@ def get_group_info(update: Update) -> dict:
         'group_type': chat.type
     }
 
+# Labels of a generated word card, matched anywhere in a line and case-insensitively;
+# the label's last word doubles as the parsed field name
+_WORD_FIELD_RE = re.compile(r'(📝 Word|📖 Definition|🇷🇺 Translation|💡 Example): (.+)', re.IGNORECASE)
+
+def _parse_word_details_fast(word_details: str) -> dict:
+    """Single scan over a word card; the first match of each label wins"""
+    found = {}
+    for match in _WORD_FIELD_RE.finditer(word_details):
+        found.setdefault(match.group(1).split()[-1].lower(), match.group(2).strip())
+    return {
+        'word': found.get('word', 'Unknown'),
+        'definition': found.get('definition', ''),
+        'translation': found.get('translation', ''),
+        'example': found.get('example', ''),
+    }
+
 def extract_word_components(word_details: str) -> tuple:
     """Extract word, definition, translation, example from formatted text"""
-    import re
-    
     try:
-        word_match = re.search(r'📝 Word: (.+)', word_details)
-        definition_match = re.search(r'📖 Definition: (.+)', word_details)
-        translation_match = re.search(r'🇷🇺 Translation: (.+)', word_details)
-        example_match = re.search(r'💡 Example: (.+)', word_details)
-        
-        word = word_match.group(1).strip() if word_match else "Unknown"
-        definition = definition_match.group(1).strip() if definition_match else ""
-        translation = translation_match.group(1).strip() if translation_match else ""
-        example = example_match.group(1).strip() if example_match else ""
-        
-        return (word, definition, translation, example)
+        parsed = _parse_word_details_fast(word_details)
+        return (parsed['word'], parsed['definition'], parsed['translation'], parsed['example'])
     except Exception as e:
         logger.error(f"🔥 Failed to extract word components: {e}")
         return ("Unknown", "", "", "")
 
 def get_random_word_for_group(group_id: int, max_attempts: int = 20) -> str:
     """Generate a random word that hasn't been sent to this group yet"""
+    sent_words = db.get_sent_words_for_group(group_id)
     for attempt in range(max_attempts):
         word_details = get_random_word_details()
-        word, _, _, _ = extract_word_components(word_details)
+        word = _parse_word_details_fast(word_details)['word']
         
-        if not db.is_word_sent_to_group(group_id, word):
+        if word.strip().lower() not in sent_words:
             logger.info(f"✅ Generated unique word '{word}' for group {group_id} (attempt {attempt + 1})")
             return word_details
     
@@ -80,14 +122,40 @@ def get_random_word_for_group(group_id: int, max_attempts: int = 20) -> str:
     return get_random_word_details()
 
 # --- Admin Utility Functions ---
+# Set mirrors of the config whitelists for O(1) membership; kept in lockstep with the lists
+_ADMIN_IDS = frozenset(config.ADMIN_USER_IDS)
+_authorized_ids = set(config.AUTHORIZED_USER_IDS)
+
+def _load_authorized_usernames() -> dict:
+    """Map lowercase -> username as listed in config, dropping case-duplicates from the config list"""
+    usernames = {}
+    for username in config.AUTHORIZED_USERNAMES:
+        usernames.setdefault(username.lower(), username)
+    if len(usernames) != len(config.AUTHORIZED_USERNAMES):
+        # Otherwise removing one spelling would leave the other in the list but not in the map
+        logger.warning("⚠️ AUTHORIZED_USERNAMES has case-insensitive duplicates; keeping the first spelling of each")
+        config.AUTHORIZED_USERNAMES[:] = usernames.values()
+    return usernames
+
+_authorized_usernames = _load_authorized_usernames()
+# Bumped on every whitelist change; /whitelist re-renders only when it moves
+_whitelist_version = 0
+_whitelist_status_cache = (-1, "")
+
+def _whitelist_changed() -> None:
+    """Invalidate the rendered /whitelist status"""
+    global _whitelist_version
+    _whitelist_version += 1
+
+@lru_cache(maxsize=1024)
 def is_admin(user_id: int) -> bool:
-    """Check if user is an admin"""
-    return user_id in config.ADMIN_USER_IDS and config.ENABLE_ADMIN_PANEL
+    """Check if user is an admin (admin list is static config; call is_admin.cache_clear() if it changes)"""
+    return user_id in _ADMIN_IDS and config.ENABLE_ADMIN_PANEL
 
 def check_user_access(user_id: int) -> bool:
     """Check if user has access to the bot"""
     # If user is blocked, deny access
-    if db.is_user_blocked(user_id):
+    if cached_user_blocked(user_id):
         return False
     
     # Admins always have access (even if not in whitelist)
@@ -96,22 +164,35 @@ def check_user_access(user_id: int) -> bool:
     
     # If whitelist is enabled, check if user is authorized
     if config.ENABLE_WHITELIST:
-        return user_id in config.AUTHORIZED_USER_IDS
+        return user_id in _authorized_ids
     
     # If whitelist is disabled, allow all non-blocked users
     return True
 
-def check_username_access(username: str) -> bool:
-    """Check if username has access to the bot"""
-    if not username or not config.ENABLE_WHITELIST:
-        return False
-    return username.lower() in [u.lower() for u in config.AUTHORIZED_USERNAMES]
+class Access(IntFlag):
+    NONE = 0
+    BLOCKED = 1
+    ADMIN = 2
+    WHITELISTED = 4
+
+def resolve_access(user) -> Access:
+    """Resolve a user's blocked/admin/whitelist status in one pass"""
+    if cached_user_blocked(user.id):
+        return Access.BLOCKED
+    access = Access.NONE
+    if is_admin(user.id):
+        access |= Access.ADMIN
+    if (not config.ENABLE_WHITELIST or user.id in _authorized_ids
+            or (user.username and user.username.lower() in _authorized_usernames)):
+        access |= Access.WHITELISTED
+    return access
 
-async def send_access_denied_message(update: Update, context: CallbackContext) -> None:
+async def send_access_denied_message(update: Update, context: CallbackContext, access: Access = None) -> None:
     """Send access denied message to blocked users"""
     user = update.effective_user
+    blocked = access & Access.BLOCKED if access is not None else cached_user_blocked(user.id)
     
-    if db.is_user_blocked(user.id):
+    if blocked:
         await update.message.reply_text(
             "🚫 <b>Доступ заблокирован</b>\n\n"
             "Ваш доступ к боту был ограничен администратором.\n"
@@ -131,12 +212,9 @@ def require_access(func):
     async def wrapper(update: Update, context: CallbackContext, *args, **kwargs):
         user = update.effective_user
         
-        # Check user access (ID or username)
-        has_id_access = check_user_access(user.id)
-        has_username_access = check_username_access(user.username) if user.username else False
-        
-        if not (has_id_access or has_username_access):
-            await send_access_denied_message(update, context)
+        access = resolve_access(user)
+        if not access & (Access.ADMIN | Access.WHITELISTED):
+            await send_access_denied_message(update, context, access)
             return
         return await func(update, context, *args, **kwargs)
     return wrapper
@@ -158,19 +236,7 @@ def require_admin(func):
 # --- Utility Functions for Word Parsing ---
 def parse_word_details(word_details: str) -> dict:
     """Parse word details from Gemini API response"""
-    import re
-    
-    word_match = re.search(r'📝 Word: (.+)', word_details, re.IGNORECASE)
-    definition_match = re.search(r'📖 Definition: (.+)', word_details, re.IGNORECASE)
-    translation_match = re.search(r'🇷🇺 Translation: (.+)', word_details, re.IGNORECASE)
-    example_match = re.search(r'💡 Example: (.+)', word_details, re.IGNORECASE)
-    
-    return {
-        'word': word_match.group(1).strip() if word_match else 'Unknown',
-        'definition': definition_match.group(1).strip() if definition_match else '',
-        'translation': translation_match.group(1).strip() if translation_match else '',
-        'example': example_match.group(1).strip() if example_match else ''
-    }
+    return _parse_word_details_fast(word_details)
 
 # --- Conversation States ---
 GET_WRITING_TOPIC = 1
@@ -185,142 +251,781 @@ GET_CUSTOM_WORD_TRANSLATION = 9
 GET_CUSTOM_WORD_EXAMPLE = 10
 GET_CUSTOM_WORD_TOPIC = 11
 
+# --- Callback answer cache times (seconds) ---
+# Telegram clients reuse a cached answerCallbackQuery for repeated taps on the same button
+CALLBACK_CACHE_TIME = 2
+STATIC_CALLBACK_CACHE_TIME = 60
+
+# --- Bot menu commands ---
+_BOT_COMMANDS = (
+    BotCommand("start", "Start the bot and get welcome message"),
+    BotCommand("menu", "Open the interactive main menu"),
+    BotCommand("help", "Show help information"),
+    BotCommand("flashcards", "Study with spaced repetition flashcards"),
+    BotCommand("vocabulary", "Get vocabulary words"),
+    BotCommand("writing", "Get IELTS writing tasks"),
+    BotCommand("speaking", "Get IELTS speaking questions"),
+    BotCommand("info", "Get IELTS strategies and tips"),
+    BotCommand("grammar", "Get grammar explanations"),
+)
+
+# --- Static user-facing texts ---
+_HELP_TEXT = """Вот команды, которые вы можете использовать:
+
+📋 /menu - Открыть интерактивное главное меню
+🧠 /vocabulary - Получить словарные слова (случайные или по теме).
+➕ /customword - Добавить свое слово в словарь.
+🤖 /aicustomword - Добавить слово с AI-помощью.
+✍️ /writing - Получить задание IELTS по письму.
+🗣️ /speaking - Получить карточку IELTS для говорения.
+ℹ️ /info - Получить советы и стратегии для конкретных типов заданий.
+📖 /grammar - Получить объяснение грамматической темы."""
+
+_WELCOME_BODY = "\n\nЯ ваш помощник по подготовке к IELTS..."
+
+_WORD_ADDED_TEXT = """✅ <b>СЛОВО УСПЕШНО ДОБАВЛЕНО В СЛОВАРЬ{suffix}</b>
+
+📝 <b>Слово:</b> {word}
+📖 <b>Определение:</b> {definition}
+🇷🇺 <b>Перевод:</b> {translation}
+💡 <b>Пример:</b> {example}
+🏷️ <b>Тема:</b> {topic}
+
+🎯 Слово сохранено в ваш личный словарь!
+📚 Всего слов в словаре: {vocabulary_count}"""
+
+_MAIN_MENU_TEXT = "📋 <b>Главное меню</b>\n\nВыберите раздел для начала:"
+_VOCAB_PROMPT = "📖 Какой тип словаря вы хотите?"
+_INFO_PROMPT = "ℹ️ Choose the specific IELTS task type you want strategies for:"
+
+_GRAMMAR_PROMPT = """📖 Какую грамматическую тему вы хотите объяснить?
+
+Например: 'Present Perfect', 'использование артиклей' или 'фразовые глаголы'."""
+
+_WRITING_CHECK_PROMPT = """📝 Для проверки вашего письма мне нужна информация о задании.
+
+Пожалуйста, опишите задание IELTS Writing Task, которое вы выполняли.
+Например: 'Напишите эссе о преимуществах и недостатках социальных сетей'"""
+
+_SPEAKING_PROMPT = """🗣️ <b>IELTS Speaking Practice</b>
+
+Выберите режим практики:
+
+🎯 <b>Полная симуляция</b> - пройдите все три части экзамена подряд
+📋 <b>Отдельные части</b> - практикуйте конкретную часть
+📊 <b>Аналитика</b> - отслеживайте свой прогресс"""
+
+_VOICE_INSTRUCTIONS = """🎤 <b>ГОЛОСОВОЙ ОТВЕТ АКТИВИРОВАН</b>
+
+✅ Теперь запишите голосовое сообщение с вашим ответом на английском языке.
+🔊 Бот автоматически транскрибирует речь и оценит ваш ответ по шкале IELTS (1-9)!
+
+💡 <i>Говорите четко и уверенно, как на настоящем экзамене IELTS.</i>
+
+⏱️ <b>Рекомендуемое время:</b>
+• Part 1: 30-60 секунд на вопрос
+• Part 2: 1-2 минуты
+• Part 3: 30-90 секунд на вопрос"""
+
+_ADMIN_HELP_TEXT = """📖 <b>ПОЛНАЯ ИНСТРУКЦИЯ ДЛЯ АДМИНИСТРАТОРА</b>
+
+══════════════════════════
+🚀 <b>ОСНОВНЫЕ КОМАНДЫ</b>
+══════════════════════════
+
+<b>🔧 Панель управления:</b>
+• <code>/admin</code> - Открыть админ-панель
+• <code>/testdb</code> - Проверить подключение к базе данных
+• <code>/whitelist</code> - Показать статус whitelist
+
+══════════════════════════
+👥 <b>УПРАВЛЕНИЕ ПОЛЬЗОВАТЕЛЯМИ</b>
+══════════════════════════
+
+<b>🔍 Поиск пользователей:</b>
+• В админ-панели → "🔍 Поиск пользователя"
+• Поиск по: ID, username, имени
+• Пример: <code>@username</code>, <code>John</code>, <code>123456789</code>
+
+<b>🚫 Блокировка/разблокировка:</b>
+• <code>/block_123456</code> - Заблокировать пользователя по ID
+• <code>/unblock_123456</code> - Разблокировать пользователя по ID
+
+<b>🗑️ Удаление пользователей:</b>
+• <code>/delete_123456</code> - Удалить пользователя и все его данные
+• ⚠️ <b>Осторожно!</b> Действие необратимо!
+
+══════════════════════════
+🔐 <b>УПРАВЛЕНИЕ WHITELIST</b>
+══════════════════════════
+
+<b>➕ Добавление доступа:</b>
+• <code>/adduser_123456</code> - Добавить пользователя по Telegram ID
+• <code>/addusername_username</code> - Добавить пользователя по username (без @)
+
+<b>➖ Удаление доступа:</b>
+• <code>/removeuser_123456</code> - Удалить пользователя по ID
+• <code>/removeusername_username</code> - Удалить пользователя по username
+
+<b>📋 Примеры:</b>
+• <code>/adduser_546321644</code>
+• <code>/addusername_johnsmith</code>
+• <code>/removeuser_546321644</code>
+• <code>/removeusername_johnsmith</code>
+
+══════════════════════════
+📊 <b>МОНИТОРИНГ И СТАТИСТИКА</b>
+══════════════════════════
+
+<b>📈 Доступная статистика:</b>
+• Общее количество пользователей
+• Активные/заблокированные пользователи
+• Пользователи с сохраненными словами
+• Активность за 24ч/7д/30д
+• Топ пользователей по словарному запасу
+• Популярные сохраненные слова
+
+<b>🔄 Обновление данных:</b>
+• Все статистики обновляются в реальном времени
+• Кнопка "Обновить" для принудительного обновления
+
+══════════════════════════
+🛡️ <b>БЕЗОПАСНОСТЬ И ЛУЧШИЕ ПРАКТИКИ</b>
+══════════════════════════
+
+<b>⚠️ Важные правила:</b>
+• Никогда не удаляйте пользователей без крайней необходимости
+• Блокировка - более безопасная альтернатива удалению
+• Регулярно проверяйте статистику на подозрительную активность
+• Осторожно с командами удаления - они необратимы
+
+<b>🔍 Поиск проблемных пользователей:</b>
+• Используйте поиск для быстрого доступа к конкретным пользователям
+• Проверяйте дату регистрации и последней активности
+• Обращайте внимание на пользователей без имени
+
+<b>📝 Логирование:</b>
+• Все административные действия логируются
+• Проверяйте логи для отслеживания изменений
+• Время блокировки и ID администратора сохраняются
+
+"""
+
+_ADMIN_HELP_SHORT_TEXT = """📖 <b>ИНСТРУКЦИЯ АДМИНИСТРАТОРА</b>
+
+🚀 <b>Основные команды:</b>
+• <code>/admin</code> - Админ-панель
+• <code>/adminhelp</code> - Быстрая справка
+
+👥 <b>Управление пользователями:</b>
+• <code>/block_ID</code> - Блокировка
+• <code>/unblock_ID</code> - Разблокировка
+• <code>/delete_ID</code> - Удаление (необратимо!)
+
+🔐 <b>Управление доступом:</b>
+• <code>/adduser_ID</code> - Добавить по ID
+• <code>/addusername_name</code> - Добавить по username
+• <code>/removeuser_ID</code> - Удалить по ID
+• <code>/removeusername_name</code> - Удалить по username
+
+🔍 <b>Поиск:</b> Админ-панель → "Поиск пользователя"
+📊 <b>Статистика:</b> Админ-панель → "Подробная статистика"
+
+⚠️ <b>Важно:</b> Удаление пользователей необратимо!"""
+
+_ADMIN_QUICK_HELP_TEXT = """📖 <b>БЫСТРАЯ СПРАВКА ДЛЯ АДМИНИСТРАТОРА</b>
+
+🚀 <b>Основные команды:</b>
+• <code>/admin</code> - Админ-панель
+• <code>/adminhelp</code> - Эта справка
+• <code>/testdb</code> - Проверка БД
+• <code>/whitelist</code> - Статус whitelist
+
+👥 <b>Управление пользователями:</b>
+• <code>/block_ID</code> - Заблокировать
+• <code>/unblock_ID</code> - Разблокировать  
+• <code>/delete_ID</code> - Удалить (необратимо!)
+
+🔐 <b>Управление доступом:</b>
+• <code>/adduser_ID</code> - Добавить по ID
+• <code>/addusername_name</code> - Добавить по username
+• <code>/removeuser_ID</code> - Удалить по ID
+• <code>/removeusername_name</code> - Удалить по username
+
+💡 <b>Полная инструкция:</b> /admin → "📖 Инструкция для админа"
+
+⚠️ <b>Помните:</b> Команды удаления необратимы! Используйте блокировку вместо удаления когда это возможно."""
+
+_WHITELIST_HELP_TEXT = (
+    "\n💡 <b>Управление:</b>\n"
+    "• /adduser_123456 - Добавить по ID\n"
+    "• /removeuser_123456 - Удалить по ID\n"
+    "• /addusername_username - Добавить по username\n"
+    "• /removeusername_username - Удалить по username\n"
+)
+
+# --- Static keyboards ---
+_MAIN_MENU_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🧠 Словарь", callback_data="menu_vocabulary")],
+    [InlineKeyboardButton("🎓 Flashcards", callback_data="flashcard_menu")],
+    [InlineKeyboardButton("✍️ Письмо", callback_data="menu_writing")],
+    [InlineKeyboardButton("🗣️ Говорение", callback_data="menu_speaking")],
+    [InlineKeyboardButton("ℹ️ Информация", callback_data="menu_info")],
+    [InlineKeyboardButton("📖 Грамматика", callback_data="menu_grammar")],
+    [InlineKeyboardButton("👤 Мой профиль", callback_data="menu_profile")],
+])
+_SPEAKING_START_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🗣️ Говорение", callback_data="menu_speaking")],
+    [InlineKeyboardButton("📋 Главное меню", callback_data="back_to_main_menu")],
+])
+_MAIN_MENU_ONLY_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("📋 Главное меню", callback_data="back_to_main_menu")],
+])
+_SPEAKING_RETRY_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🔄 Попробовать снова", callback_data="menu_speaking")],
+    [InlineKeyboardButton("📋 Главное меню", callback_data="back_to_main_menu")],
+])
+_SPEAKING_FINAL_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🔄 Попробовать еще раз", callback_data="menu_speaking")],
+    [InlineKeyboardButton("📋 Главное меню", callback_data="back_to_main_menu")],
+])
+_WORD_SAVED_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("📖 Мой словарь", callback_data="profile_vocabulary")],
+    [InlineKeyboardButton("🎲 Новое слово", callback_data="vocabulary_random")],
+    [InlineKeyboardButton("🔙 Назад в меню", callback_data="back_to_main_menu")],
+])
+_BACK_TO_MENU_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🔙 Назад в меню", callback_data="back_to_main_menu")],
+])
+_VOCAB_EMPTY_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🎲 Случайное слово", callback_data="vocabulary_random")],
+    [InlineKeyboardButton("🔙 Назад к профилю", callback_data="menu_profile")],
+])
+_VOCAB_LIST_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🗑️ Очистить словарь", callback_data="clear_vocabulary")],
+    [InlineKeyboardButton("🔙 Назад к профилю", callback_data="menu_profile")],
+])
+_PROFILE_BACK_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🔙 Назад к профилю", callback_data="menu_profile")],
+])
+_CLEAR_CONFIRM_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("✅ Да, очистить", callback_data="confirm_clear_vocabulary")],
+    [InlineKeyboardButton("❌ Отмена", callback_data="profile_vocabulary")],
+])
+_VOCAB_CLEARED_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🎲 Добавить новые слова", callback_data="vocabulary_random")],
+    [InlineKeyboardButton("🔙 Назад к профилю", callback_data="menu_profile")],
+])
+_ADMIN_PANEL_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("👥 Управление пользователями", callback_data="admin_users")],
+    [InlineKeyboardButton("🔍 Поиск пользователя", callback_data="admin_search")],
+    [InlineKeyboardButton("📊 Подробная статистика", callback_data="admin_stats")],
+    [InlineKeyboardButton("📖 Инструкция для админа", callback_data="admin_help")],
+    [InlineKeyboardButton("🔙 Назад в меню", callback_data="back_to_main_menu")],
+])
+_ADMIN_SEARCH_CANCEL_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("❌ Отмена", callback_data="admin_users")],
+])
+_ADMIN_SEARCH_RESULTS_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🔍 Новый поиск", callback_data="admin_search")],
+    [InlineKeyboardButton("🔙 Назад", callback_data="admin_users")],
+])
+_BACK_TO_ADMIN_PANEL_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🔙 Назад к админ-панели", callback_data="admin_panel")],
+])
+# Fixed rows appended under the pagination row of the users page
+_ADMIN_USERS_ACTION_ROWS = (
+    (InlineKeyboardButton("🔍 Поиск пользователя", callback_data="admin_search"),),
+    (InlineKeyboardButton("🔙 Назад к админ-панели", callback_data="admin_panel"),),
+)
+_ADMIN_STATS_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🔄 Обновить", callback_data="admin_stats")],
+    [InlineKeyboardButton("🔙 Назад к админ-панели", callback_data="admin_panel")],
+])
+_BACK_TO_VOCABULARY_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🔙 Назад к словарю", callback_data="menu_vocabulary")],
+])
+_ABANDON_SIM_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("❌ Отменить", callback_data="abandon_full_sim")],
+])
+_BACK_TO_SPEAKING_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🔙 Назад", callback_data="menu_speaking")],
+])
+_BACK_TO_WRITING_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🔙 Назад к письму", callback_data="menu_writing")],
+])
+_START_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("📋 Меню", callback_data="menu_help")],
+    [InlineKeyboardButton("❓ Помощь", callback_data="help_button")],
+])
+_START_ADMIN_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("📋 Меню", callback_data="menu_help")],
+    [InlineKeyboardButton("❓ Помощь", callback_data="help_button")],
+    [InlineKeyboardButton("⚙️ Админ-панель", callback_data="admin_panel")],
+])
+_VOCABULARY_MENU_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🎲 Случайное слово", callback_data="vocabulary_random")],
+    [InlineKeyboardButton("📚 Слова по теме", callback_data="vocabulary_topic")],
+    [InlineKeyboardButton("➕ Добавить свое слово", callback_data="custom_word_add")],
+    [InlineKeyboardButton("🤖 AI-помощь для слова", callback_data="ai_enhanced_custom_word")],
+    [InlineKeyboardButton("🔙 Назад в меню", callback_data="back_to_main_menu")],
+])
+_SPEAKING_MENU_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🎯 Полная симуляция экзамена", callback_data="full_speaking_sim")],
+    [InlineKeyboardButton("Part 1: Короткие вопросы", callback_data="speaking_part_1")],
+    [InlineKeyboardButton("Part 2: Карточка-монолог", callback_data="speaking_part_2")],
+    [InlineKeyboardButton("Part 3: Дискуссия", callback_data="speaking_part_3")],
+    [InlineKeyboardButton("📈 Статистика прогресса", callback_data="speaking_stats")],
+    [InlineKeyboardButton("🔙 Назад в меню", callback_data="back_to_main_menu")],
+])
+_INFO_MENU_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🎧 Listening - True/False", callback_data="info_listening_truefalse")],
+    [InlineKeyboardButton("🎧 Listening - Multiple Choice", callback_data="info_listening_multiplechoice")],
+    [InlineKeyboardButton("🎧 Listening - Note Completion", callback_data="info_listening_notes")],
+    [InlineKeyboardButton("📖 Reading - Short Answer", callback_data="info_reading_shortanswer")],
+    [InlineKeyboardButton("📖 Reading - True/False/NG", callback_data="info_reading_truefalse")],
+    [InlineKeyboardButton("📖 Reading - Multiple Choice", callback_data="info_reading_multiplechoice")],
+    [InlineKeyboardButton("📖 Reading - Matching Headings", callback_data="info_reading_headings")],
+    [InlineKeyboardButton("📖 Reading - Summary Completion", callback_data="info_reading_summary")],
+    [InlineKeyboardButton("🔙 Назад в меню", callback_data="back_to_main_menu")],
+])
+_PROFILE_MENU_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("📖 Мой словарь", callback_data="profile_vocabulary")],
+    [InlineKeyboardButton("📊 Статистика говорения", callback_data="speaking_stats")],
+    [InlineKeyboardButton("✍️ Статистика письма", callback_data="writing_stats")],
+    [InlineKeyboardButton("🔙 Назад в меню", callback_data="back_to_main_menu")],
+])
+_SAVE_WORD_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("➕ Добавить в мой словарь", callback_data="save_word_to_vocabulary")],
+    [InlineKeyboardButton("🔙 Назад в меню", callback_data="back_to_main_menu")],
+])
+_AI_WORD_ADDED_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("📖 Мой словарь", callback_data="profile_vocabulary")],
+    [InlineKeyboardButton("🤖 Добавить еще слово с AI", callback_data="ai_enhanced_custom_word")],
+    [InlineKeyboardButton("🔙 Назад к словарю", callback_data="menu_vocabulary")],
+])
+_CUSTOM_WORD_ADDED_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("📖 Мой словарь", callback_data="profile_vocabulary")],
+    [InlineKeyboardButton("➕ Добавить еще слово", callback_data="custom_word_add")],
+    [InlineKeyboardButton("🔙 Назад к словарю", callback_data="menu_vocabulary")],
+])
+_WRITING_MENU_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("Задание 2 (Эссе)", callback_data="writing_task_type_2")],
+    [InlineKeyboardButton("📝 Проверить письмо", callback_data="writing_check")],
+    [InlineKeyboardButton("📊 Статистика письма", callback_data="writing_stats")],
+    [InlineKeyboardButton("🔙 Назад в меню", callback_data="back_to_main_menu")],
+])
+_SPEAKING_COMMAND_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🎯 Полная симуляция экзамена", callback_data="full_speaking_sim")],
+    [InlineKeyboardButton("Part 1: Короткие вопросы", callback_data="speaking_part_1")],
+    [InlineKeyboardButton("Part 2: Карточка-монолог", callback_data="speaking_part_2")],
+    [InlineKeyboardButton("Part 3: Дискуссия", callback_data="speaking_part_3")],
+    [InlineKeyboardButton("📊 История симуляций", callback_data="speaking_history")],
+    [InlineKeyboardButton("📈 Статистика прогресса", callback_data="speaking_stats")],
+    [InlineKeyboardButton("🔙 Назад в меню", callback_data="back_to_main_menu")],
+])
+_INFO_SECTIONS_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🎧 Listening - True/False", callback_data="info_listening_truefalse")],
+    [InlineKeyboardButton("🎧 Listening - Multiple Choice", callback_data="info_listening_multiplechoice")],
+    [InlineKeyboardButton("🎧 Listening - Note Completion", callback_data="info_listening_notes")],
+    [InlineKeyboardButton("📖 Reading - Short Answer", callback_data="info_reading_shortanswer")],
+    [InlineKeyboardButton("📖 Reading - True/False/NG", callback_data="info_reading_truefalse")],
+    [InlineKeyboardButton("📖 Reading - Multiple Choice", callback_data="info_reading_multiplechoice")],
+    [InlineKeyboardButton("📖 Reading - Matching Headings", callback_data="info_reading_headings")],
+    [InlineKeyboardButton("📖 Reading - Summary Completion", callback_data="info_reading_summary")],
+])
+_SIM_QUESTION_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("⏭ Пропустить вопрос", callback_data="skip_question")],
+    [InlineKeyboardButton("❌ Выйти из симуляции", callback_data="abandon_full_sim")],
+])
+_PROCESSING_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("⏳ Обрабатываю...", callback_data="processing")],
+])
+_SIM_RESULTS_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🔄 Новая симуляция", callback_data="restart_full_sim")],
+    [InlineKeyboardButton("📈 Статистика", callback_data="speaking_stats")],
+    [InlineKeyboardButton("📋 Главное меню", callback_data="back_to_main_menu")],
+])
+_SPEAKING_STATS_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🎯 Новая симуляция", callback_data="full_speaking_sim")],
+    [InlineKeyboardButton("🔙 Назад к профилю", callback_data="menu_profile")],
+    [InlineKeyboardButton("🔙 Назад к говорению", callback_data="menu_speaking")],
+])
+_WRITING_STATS_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("📝 Проверить письмо", callback_data="writing_check")],
+    [InlineKeyboardButton("🔙 Назад к профилю", callback_data="menu_profile")],
+    [InlineKeyboardButton("🔙 Назад к письму", callback_data="menu_writing")],
+])
+_WORD_EXISTS_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("📖 Мой словарь", callback_data="profile_vocabulary")],
+    [InlineKeyboardButton("➕ Добавить другое слово", callback_data="custom_word_add")],
+    [InlineKeyboardButton("🔙 Назад к словарю", callback_data="menu_vocabulary")],
+])
+_WRITING_RESTART_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("✍️ Новое задание", callback_data="menu_writing")],
+    [InlineKeyboardButton("🔙 Главное меню", callback_data="back_to_main_menu")],
+])
+_SIM_VOICE_REQUIRED_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("⏭ Пропустить вопрос", callback_data="skip_question")],
+    [InlineKeyboardButton("❌ Выйти из симуляции", callback_data="abandon_full_sim")],
+])
+_SIM_VOICE_FAILED_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🔄 Повторить", callback_data="retry_current_question")],
+    [InlineKeyboardButton("⏭ Пропустить", callback_data="skip_question")],
+    [InlineKeyboardButton("❌ Выйти", callback_data="abandon_full_sim")],
+])
+_SIM_RESPONSE_ERROR_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🔄 Повторить", callback_data="retry_current_question")],
+    [InlineKeyboardButton("❌ Выйти", callback_data="abandon_full_sim")],
+])
+_SIM_ABANDONED_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🔄 Новая симуляция", callback_data="full_speaking_sim")],
+    [InlineKeyboardButton("📋 Главное меню", callback_data="back_to_main_menu")],
+])
+_WRITING_STATS_ERROR_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🔙 Назад", callback_data="menu_writing")],
+])
+_WRITING_TASK_DONE_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("📊 Посмотреть статистику", callback_data="writing_stats")],
+    [InlineKeyboardButton("✍️ Новое задание", callback_data="menu_writing")],
+    [InlineKeyboardButton("🔙 Главное меню", callback_data="back_to_main_menu")],
+])
+_WRITING_CHECK_DONE_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("📊 Посмотреть статистику", callback_data="writing_stats")],
+    [InlineKeyboardButton("📝 Проверить еще одно письмо", callback_data="writing_check")],
+    [InlineKeyboardButton("🔙 Главное меню", callback_data="back_to_main_menu")],
+])
+
+# Per-user locks for vocabulary writes; a second tap while one is running is dropped
+_user_locks: defaultdict = defaultdict(asyncio.Lock)
+# Saving and clearing share the lock, so the toast doesn't name the running operation
+_VOCAB_BUSY_TOAST = "⏳ Операция со словарём уже выполняется..."
+
+# Personal vocabulary is paged by (saved_at, id) cursor (callback_data stays under 64 bytes)
+VOCAB_PAGE_SIZE = 10
+_VOCAB_PAGE_RE = re.compile(r'^vocab_page_(before|after)_(.+)_(\d+)$')
+# A page stops short of Telegram's 4096-char limit; long user-entered fields are clipped
+_VOCAB_PAGE_MAX_CHARS = 3800
+_VOCAB_FIELD_MAX_CHARS = 400
+
+# user_data keys filled in by the manual custom word steps
+_CUSTOM_WORD_KEYS = ('custom_word', 'custom_word_definition', 'custom_word_translation', 'custom_word_example')
+
+# Fields of an AI-generated custom word card (add_custom_word_to_dictionary), found in one scan
+_AI_FIELDS_RE = re.compile(r'(📖 <b>Определение:</b>|🇷🇺 <b>Перевод:</b>|💡 <b>Пример:</b>|🏷️ <b>Тема:</b>) (.+)')
+
+# Voice messages are handled concurrently (block=False); cap parallel transcriptions
+MAX_CONCURRENT_TRANSCRIPTIONS = 4
+_transcription_semaphore = asyncio.Semaphore(MAX_CONCURRENT_TRANSCRIPTIONS)
+
+# Loose admin searches (e.g. "a") are capped; most recently active users first
+ADMIN_SEARCH_LIMIT = 50
+
+# Admins refresh the stats panel repeatedly; the rendered stats are rebuilt at most every 45s
+ADMIN_STATS_CACHE_TTL = 45
+
+# --- Precompiled formatting patterns ---
+_BOLD_MD_RE = re.compile(r'\*\*(.*?)\*\*')
+_ITALIC_MD_RE = re.compile(r'\*([^*\n]+?)\*')
+# Long box-drawing dashes render poorly on mobile; grammar text also drops stray asterisks
+_INFO_CHAR_TABLE = str.maketrans({'─': '-', '━': '-', '═': '='})
+_GRAMMAR_CHAR_TABLE = str.maketrans({'─': '-', '━': '-', '═': '=', '*': None})
+_ALLOWED_TAG_RE = re.compile(r'<(/?)(b|i|u|s|code|pre)>')
+_HTML_TAG_RE = re.compile(r'<[^>]+>')
+
+# MarkdownV2 escaping tables (one str.translate pass instead of chained replaces)
+_MDV2_TABLE = str.maketrans({c: '\\' + c for c in '\\_[]()~`>#+-=|{}.!*'})
+_GRAMMAR_MDV2_TABLE = str.maketrans({c: '\\' + c for c in '\\[]()~`>#+_*'})
+_ESCAPED_DOUBLE_UNDERSCORE_RE = re.compile(r'\\_\\_(.*?)\\_\\_')
+_ESCAPED_UNDERSCORE_RE = re.compile(r'\\_(.*?)\\_')
+
+# Fast-path probes: most generated text needs no escaping or markdown conversion at all
+_MDV2_NEEDS_RE = re.compile(r'[\\_\[\]()~`>#+\-=|{}.!*]')
+_GRAMMAR_MDV2_NEEDS_RE = re.compile(r'[\\\[\]()~`>#+_*]')
+_MD_FORMAT_NEEDS_RE = re.compile(r'[*─━═]')
+_HTML_NEEDS_RE = re.compile(r'[<>&]')
+
+# --- Generated content cache (info strategies and grammar explanations) ---
+CONTENT_CACHE_TTL = 6 * 60 * 60  # seconds
+# Grammar keys are free-form user topics, so the cache is bounded (least recently used evicted)
+CONTENT_CACHE_MAXSIZE = 200
+_content_cache = OrderedDict()  # key -> (created_at, text)
+_content_cache_lock = threading.Lock()  # filled from worker threads
+
+# Info buttons form a closed set, popular grammar topics are warmed up on startup
+_INFO_TASKS = (
+    ("listening", "truefalse"), ("listening", "multiplechoice"), ("listening", "notes"),
+    ("reading", "shortanswer"), ("reading", "truefalse"), ("reading", "multiplechoice"),
+    ("reading", "headings"), ("reading", "summary"),
+)
+_WARMUP_GRAMMAR_TOPICS = ("Present Perfect", "Past Simple", "Conditionals", "использование артиклей", "фразовые глаголы")
+
+def _get_cached_content(key: tuple, func, *args, **kwargs) -> str:
+    """Returns cached generated text for key, generating and caching it on a miss."""
+    with _content_cache_lock:
+        cached = _content_cache.get(key)
+        if cached:
+            if time.monotonic() - cached[0] < CONTENT_CACHE_TTL:
+                _content_cache.move_to_end(key)
+                return cached[1]
+            del _content_cache[key]
+    text = func(*args, **kwargs)
+    # Error replies from gemini_api are not cached so the next request retries
+    if text and not text.startswith(("Sorry,", "Error:")):
+        with _content_cache_lock:
+            _content_cache[key] = (time.monotonic(), text)
+            _content_cache.move_to_end(key)
+            while len(_content_cache) > CONTENT_CACHE_MAXSIZE:
+                _content_cache.popitem(last=False)
+    return text
+
+def get_ielts_strategies_cached(section: str, task_type: str) -> str:
+    """Cached wrapper around generate_ielts_strategies."""
+    return _get_cached_content(("info", section, task_type), generate_ielts_strategies, section=section, task_type=task_type)
+
+def explain_grammar_structure_cached(grammar_topic: str) -> str:
+    """Cached wrapper around explain_grammar_structure."""
+    key = ("grammar", grammar_topic.strip().lower())
+    return _get_cached_content(key, explain_grammar_structure, grammar_topic=grammar_topic)
+
+async def warm_content_cache() -> None:
+    """Pre-generates info strategies and popular grammar explanations in the background."""
+    try:
+        await asyncio.gather(*[
+            asyncio.to_thread(explain_grammar_structure_cached, topic) for topic in _WARMUP_GRAMMAR_TOPICS
+        ])
+        for section, task_type in _INFO_TASKS:
+            await asyncio.to_thread(get_ielts_strategies_cached, section, task_type)
+        logger.info(f"✅ Content cache warmed up: {len(_content_cache)} entries")
+    except Exception as e:
+        logger.error(f"🔥 Content cache warm-up failed: {e}")
+
+# --- Random word pool ---
+# A few word cards are generated ahead of time so "random word" replies don't wait on Gemini;
+# each card is served once and the pool is topped up in the background
+_WORD_POOL_SIZE = 5
+_word_pool = deque(maxlen=_WORD_POOL_SIZE)
+_word_pool_task: asyncio.Task = None
+
+async def _refill_word_pool() -> None:
+    try:
+        while len(_word_pool) < _WORD_POOL_SIZE:
+            word_details = await asyncio.to_thread(get_random_word_details)
+            if _parse_word_details_fast(word_details)['word'] == 'Unknown':
+                # Error text or a malformed card; try again on the next request
+                logger.warning("⚠️ Word pool refill got no usable word card, stopping for now")
+                return
+            _word_pool.append(word_details)
+    except Exception as e:
+        logger.error(f"🔥 Word pool refill failed: {e}")
+
+def refill_word_pool(application) -> None:
+    """Top the random word pool up in the background unless a refill is already running.
+
+    Runs as an application task, so shutdown waits for a refill in progress.
+    """
+    global _word_pool_task
+    if _word_pool_task is None or _word_pool_task.done():
+        _word_pool_task = application.create_task(_refill_word_pool())
+
+async def get_pooled_word_details(context: CallbackContext, chat_id: int) -> str:
+    """A random word card from the pool, generated on the spot if the pool is empty"""
+    if _word_pool:
+        word_details = _word_pool.popleft()
+    else:
+        word_details = await run_with_typing(context, chat_id, get_random_word_details)
+    refill_word_pool(context.application)
+    return word_details
+
 # --- Utility Functions ---
+def sanitize_telegram_html(text: str) -> str:
+    """Escapes stray markup and balances supported tags so Telegram HTML parsing succeeds first time."""
+    if not _HTML_NEEDS_RE.search(text):
+        return text
+    parts = []
+    open_tags = []
+    pos = 0
+    for match in _ALLOWED_TAG_RE.finditer(text):
+        parts.append(html.escape(text[pos:match.start()], quote=False))
+        closing, tag = match.groups()
+        if not closing:
+            open_tags.append(tag)
+            parts.append(match.group(0))
+        elif tag in open_tags:
+            # Close anything opened inside this tag first; unmatched closing tags are dropped
+            while open_tags:
+                open_tag = open_tags.pop()
+                parts.append(f'</{open_tag}>')
+                if open_tag == tag:
+                    break
+        pos = match.end()
+    parts.append(html.escape(text[pos:], quote=False))
+    parts.extend(f'</{tag}>' for tag in reversed(open_tags))
+    return ''.join(parts)
+
+def _ack(update: Update, context: CallbackContext, cache_time: int = None):
+    """Answer the callback query without waiting for the round-trip.
+
+    Runs as an application task, so failures still reach the error handler.
+    """
+    return context.application.create_task(update.callback_query.answer(cache_time=cache_time), update=update)
+
+# --- Background user writes ---
+# add_user/update_user_activity are fire-and-forget, so handlers queue them and a
+# single writer task flushes them in batches instead of hitting SQLite per update
+_USER_WRITE_BATCH = 64
+_user_writes: asyncio.Queue = asyncio.Queue()
+_user_writer_task: asyncio.Task = None
+
+def queue_add_user(user) -> None:
+    """Queue db.add_user for a Telegram user"""
+    _user_writes.put_nowait(('add_user', (user.id, user.username, user.first_name, user.last_name)))
+
+def queue_user_activity(user_id: int) -> None:
+    """Queue db.update_user_activity"""
+    _user_writes.put_nowait(('activity', user_id))
+
+def _flush_user_writes(batch: list) -> None:
+    """Write a batch of queued user writes with one executemany per kind"""
+    new_users = {}
+    active = set()
+    for kind, payload in batch:
+        if kind == 'add_user':
+            new_users[payload[0]] = payload
+        else:
+            active.add(payload)
+    # add_user already stamps last_activity
+    active.difference_update(new_users)
+    if new_users:
+        db.add_users(list(new_users.values()))
+    if active:
+        db.update_users_activity(active)
+
+async def _user_writer_loop() -> None:
+    while True:
+        batch = [await _user_writes.get()]
+        while len(batch) < _USER_WRITE_BATCH and not _user_writes.empty():
+            batch.append(_user_writes.get_nowait())
+        try:
+            await asyncio.to_thread(_flush_user_writes, batch)
+        except Exception as e:
+            logger.error(f"🔥 Failed to flush {len(batch)} queued user write(s): {e}")
+
+def start_user_writer() -> None:
+    """Start the background user writer (call from post_init)"""
+    global _user_writer_task
+    if _user_writer_task is None:
+        _user_writer_task = asyncio.create_task(_user_writer_loop())
+
+async def stop_user_writer() -> None:
+    """Stop the background user writer and flush whatever is still queued"""
+    global _user_writer_task
+    if _user_writer_task is not None:
+        _user_writer_task.cancel()
+        try:
+            await _user_writer_task
+        except asyncio.CancelledError:
+            pass
+        _user_writer_task = None
+    batch = []
+    while not _user_writes.empty():
+        batch.append(_user_writes.get_nowait())
+    if batch:
+        _flush_user_writes(batch)
+
+def _save_writing_evaluation(user_id: int, **evaluation) -> None:
+    if db.save_writing_evaluation(user_id=user_id, **evaluation):
+        invalidate_user(user_id)
+        logger.info(f"✅ Writing evaluation saved to database for user {user_id}")
+    else:
+        logger.warning(f"⚠️ Failed to save writing evaluation to database for user {user_id}")
+
+def save_writing_evaluation_in_background(update: Update, context: CallbackContext, user_id: int, **evaluation):
+    """Save a writing evaluation in a worker thread without holding up the reply.
+
+    Runs as an application task, so failures still reach the error handler.
+    """
+    return context.application.create_task(
+        asyncio.to_thread(_save_writing_evaluation, user_id, **evaluation), update=update
+    )
+
+async def run_with_typing(context: CallbackContext, chat_id: int, func, *args, **kwargs):
+    """Runs a blocking call in a worker thread while the typing action is sent."""
+    _, result = await asyncio.gather(
+        context.bot.send_chat_action(chat_id=chat_id, action="typing"),
+        asyncio.to_thread(func, *args, **kwargs),
+    )
+    return result
+
 def format_info_text(text: str) -> str:
     """Formats info/strategies text for better mobile display."""
     if not text: return ""
+    if not _MD_FORMAT_NEEDS_RE.search(text):
+        return sanitize_telegram_html(text)
     
     # Convert common Markdown patterns to HTML
     formatted_text = text
     
     # Convert **bold** to <b>bold</b>
-    formatted_text = re.sub(r'\*\*(.*?)\*\*', r'<b>\1</b>', formatted_text)
+    formatted_text = _BOLD_MD_RE.sub(r'<b>\1</b>', formatted_text)
     
     # Convert *italic* to <i>italic</i>
-    formatted_text = re.sub(r'\*([^*\n]+?)\*', r'<i>\1</i>', formatted_text)
+    formatted_text = _ITALIC_MD_RE.sub(r'<i>\1</i>', formatted_text)
     
-    # Replace problematic characters for mobile display
     # Replace long dashes with shorter ones for better mobile compatibility
-    formatted_text = formatted_text.replace('─', '-')
-    formatted_text = formatted_text.replace('━', '-')
-    formatted_text = formatted_text.replace('═', '=')
-    
-    # Convert bullet points to HTML bullets
-    formatted_text = formatted_text.replace('•', '•')
+    formatted_text = formatted_text.translate(_INFO_CHAR_TABLE)
     
     # Keep line breaks as \n (Telegram HTML mode doesn't support <br>)
     # Don't convert \n to <br> - Telegram will handle line breaks automatically
     
+    # Make sure the result is valid Telegram HTML so sending never needs a plain-text retry
+    formatted_text = sanitize_telegram_html(formatted_text)
+    
     return formatted_text
 
 def format_grammar_text(text: str) -> str:
     """Formats grammar text for Telegram HTML parse mode - simplified approach."""
     if not text: return ""
+    if not _MD_FORMAT_NEEDS_RE.search(text):
+        return sanitize_telegram_html(text)
     
     formatted_text = text
     
     # Step 1: Convert all **text** to <b>text</b>
-    formatted_text = re.sub(r'\*\*(.*?)\*\*', r'<b>\1</b>', formatted_text)
+    formatted_text = _BOLD_MD_RE.sub(r'<b>\1</b>', formatted_text)
     
     # Step 2: Convert all remaining *text* to <i>text</i>
-    formatted_text = re.sub(r'\*([^*\n]+?)\*', r'<i>\1</i>', formatted_text)
-    
-    # Step 3: Remove any remaining asterisks
-    formatted_text = formatted_text.replace('*', '')
-    
-    # Step 4: Clean up character replacements
-    formatted_text = formatted_text.replace('─', '-')
-    formatted_text = formatted_text.replace('━', '-')
-    formatted_text = formatted_text.replace('═', '=')
+    formatted_text = _ITALIC_MD_RE.sub(r'<i>\1</i>', formatted_text)
     
-    # Step 5: Preserve bullet points and structure
-    formatted_text = formatted_text.replace('•', '•')
+    # Step 3: Remove any remaining asterisks and shorten long dashes in one pass
+    formatted_text = formatted_text.translate(_GRAMMAR_CHAR_TABLE)
     
-    # Step 6: Fix spacing issues around bullet points and examples
-    formatted_text = re.sub(r'\n\s*\*\s+', '\n• ', formatted_text)
+    # Make sure the result is valid Telegram HTML so sending never needs a plain-text retry
+    formatted_text = sanitize_telegram_html(formatted_text)
     
     return formatted_text
 
 # Add these utility functions for scoring and simulation
+# IELTS part weights: Part 1 25%, Part 2 35% (long turn), Part 3 40%
+_PART_WEIGHTS = ((1, 0.25), (2, 0.35), (3, 0.40))
+
 def calculate_weighted_overall_score(part_scores: dict) -> float:
     """Calculate weighted overall score based on IELTS importance"""
-    PART_WEIGHTS = {
-        1: 0.25,  # Part 1: 25% of total score
-        2: 0.35,  # Part 2: 35% of total score (most important)
-        3: 0.40   # Part 3: 40% of total score
-    }
-    
     total_score = 0
     total_weight = 0
     
-    for part, score in part_scores.items():
-        if score is not None and score > 0:
-            total_score += score * PART_WEIGHTS[part]
-            total_weight += PART_WEIGHTS[part]
+    # Unanswered parts (missing, None or 0) don't count towards the weight
+    for part, weight in _PART_WEIGHTS:
+        score = part_scores.get(part) or 0
+        if score > 0:
+            total_score += score * weight
+            total_weight += weight
     
     if total_weight == 0:
         return 0.0
     
     return round(total_score / total_weight, 1)
 
-def determine_ielts_band(score: float) -> float:
-    """Convert numerical score to IELTS band score"""
-    if score >= 8.5:
-        return 9.0
-    elif score >= 7.5:
-        return 8.0
-    elif score >= 6.5:
-        return 7.0
-    elif score >= 5.5:
-        return 6.0
-    elif score >= 4.5:
-        return 5.0
-    elif score >= 3.5:
-        return 4.0
-    else:
-        return 3.5
-
-def generate_comprehensive_feedback(part_scores: dict, overall_band: float) -> str:
-    """Generate comprehensive feedback based on part scores"""
-    feedback_parts = []
-    
-    # Overall assessment
-    if overall_band >= 8.0:
-        feedback_parts.append("🎯 <b>Отличный результат!</b> Ваш уровень соответствует высоким требованиям IELTS.")
-    elif overall_band >= 6.5:
-        feedback_parts.append("✅ <b>Хороший результат!</b> Вы готовы к большинству университетских программ.")
-    elif overall_band >= 5.5:
-        feedback_parts.append("⚠️ <b>Удовлетворительный результат.</b> Рекомендуется дополнительная практика.")
-    else:
-        feedback_parts.append("📚 <b>Требуется улучшение.</b> Рекомендуется интенсивная подготовка.")
-    
-    # Part-specific feedback
-    for part, score in part_scores.items():
-        if score >= 7.0:
-            feedback_parts.append(f"• <b>Часть {part}:</b> Сильная сторона")
-        elif score >= 5.5:
-            feedback_parts.append(f"• <b>Часть {part}:</b> Стабильная работа")
-        else:
-            feedback_parts.append(f"• <b>Часть {part}:</b> Требует внимания")
-    
-    return "\n".join(feedback_parts)
-
-def calculate_simulation_time(context: CallbackContext) -> str:
-    """Calculate total simulation time"""
-    start_time = context.user_data.get('simulation_start_time', 0)
-    if start_time == 0:
-        return "Неизвестно"
-    
-    import time
-    elapsed = int(time.time() - start_time)
-    minutes = elapsed // 60
-    seconds = elapsed % 60
-    
-    if minutes > 0:
-        return f"{minutes} мин {seconds} сек"
-    else:
-        return f"{seconds} сек"
-
 def calculate_overall_criteria_scores(part_scores: dict, part_evaluations: dict) -> dict:
     """Calculate overall scores for each IELTS criterion across all parts"""
     criteria_scores = {
@@ -336,9 +1041,11 @@ def calculate_overall_criteria_scores(part_scores: dict, part_evaluations: dict)
             # Try to extract scores from evaluation text
             scores = extract_scores_from_evaluation(evaluation)
             if scores:
-                for criterion in criteria_scores.keys():
-                    if criterion in scores:
-                        criteria_scores[criterion].append(scores[criterion])
+                # scores also carries 'overall' and 'summary'; keep only the four criteria
+                for criterion, score in scores.items():
+                    criterion_list = criteria_scores.get(criterion)
+                    if criterion_list is not None:
+                        criterion_list.append(score)
     
     # Calculate averages for each criterion
     overall_criteria = {}
@@ -354,201 +1061,139 @@ def generate_detailed_analysis(part_scores: dict, part_transcriptions: dict,
                               part_evaluations: dict, overall_criteria: dict) -> str:
     """Generate detailed analysis with official IELTS criteria"""
     
-    analysis = "📊 <b>ДЕТАЛЬНЫЙ АНАЛИЗ ПО КРИТЕРИЯМ IELTS</b>\n\n"
-    
     # Overall performance summary
     total_score = sum(part_scores.values())
     avg_score = total_score / len(part_scores) if part_scores else 0
     
-    analysis += f"🏆 <b>ОБЩАЯ ПРОИЗВОДИТЕЛЬНОСТЬ</b>\n"
-    analysis += f"• Средний балл: {avg_score:.1f}/9\n"
-    analysis += f"• Общий балл: {total_score}/27\n\n"
-    
-    # Official IELTS criteria analysis
-    analysis += "📋 <b>ОФИЦИАЛЬНЫЕ КРИТЕРИИ IELTS SPEAKING</b>\n\n"
-    
-    # 1. Fluency and Coherence
-    fluency_score = overall_criteria.get('fluency', 0)
-    analysis += f"🎯 <b>1. Fluency and Coherence (Беглость и связность): {fluency_score}/9</b>\n"
-    analysis += get_fluency_feedback(fluency_score)
-    analysis += "\n"
-    
-    # 2. Lexical Resource
-    vocab_score = overall_criteria.get('vocabulary', 0)
-    analysis += f"📚 <b>2. Lexical Resource (Лексический запас): {vocab_score}/9</b>\n"
-    analysis += get_vocabulary_feedback(vocab_score)
-    analysis += "\n"
-    
-    # 3. Grammatical Range and Accuracy
-    grammar_score = overall_criteria.get('grammar', 0)
-    analysis += f"🔤 <b>3. Grammatical Range and Accuracy (Грамматика): {grammar_score}/9</b>\n"
-    analysis += get_grammar_feedback(grammar_score)
-    analysis += "\n"
-    
-    # 4. Pronunciation
-    pron_score = overall_criteria.get('pronunciation', 0)
-    analysis += f"🎤 <b>4. Pronunciation (Произношение): {pron_score}/9</b>\n"
-    analysis += get_pronunciation_feedback(pron_score)
-    analysis += "\n"
-    
-    # Part-by-part analysis
-    analysis += "📊 <b>АНАЛИЗ ПО ЧАСТЯМ</b>\n\n"
+    parts = [
+        "📊 <b>ДЕТАЛЬНЫЙ АНАЛИЗ ПО КРИТЕРИЯМ IELTS</b>\n\n",
+        "🏆 <b>ОБЩАЯ ПРОИЗВОДИТЕЛЬНОСТЬ</b>\n",
+        f"• Средний балл: {avg_score:.1f}/9\n",
+        f"• Общий балл: {total_score}/27\n\n",
+        # Official IELTS criteria analysis
+        "📋 <b>ОФИЦИАЛЬНЫЕ КРИТЕРИИ IELTS SPEAKING</b>\n\n",
+        format_criteria_section(overall_criteria),
+        # Part-by-part analysis
+        "📊 <b>АНАЛИЗ ПО ЧАСТЯМ</b>\n\n",
+    ]
     for part_num in sorted(part_scores.keys()):
         score = part_scores[part_num]
         transcription = part_transcriptions.get(part_num, "Недоступно")
         evaluation = part_evaluations.get(part_num, "Недоступно")
         
-        analysis += f"<b>Часть {part_num}:</b> {score}/9\n"
-        analysis += f"<i>Ответ: {transcription[:100]}{'...' if len(transcription) > 100 else ''}</i>\n"
-        analysis += f"<i>Оценка: {evaluation[:200]}{'...' if len(evaluation) > 200 else ''}</i>\n\n"
+        parts.append(
+            f"<b>Часть {part_num}:</b> {score}/9\n"
+            f"<i>Ответ: {transcription[:100]}{'...' if len(transcription) > 100 else ''}</i>\n"
+            f"<i>Оценка: {evaluation[:200]}{'...' if len(evaluation) > 200 else ''}</i>\n\n"
+        )
     
-    return analysis
+    return "".join(parts)
 
 def generate_detailed_analysis_with_questions(part_scores: dict, question_transcriptions: dict, 
                                             question_evaluations: dict, overall_criteria: dict, user_data: dict) -> str:
     """Generate detailed analysis with question-by-question breakdown"""
     
-    analysis = "📊 <b>ДЕТАЛЬНЫЙ АНАЛИЗ ПО КРИТЕРИЯМ IELTS</b>\n\n"
-    
     # Overall performance summary
     total_score = sum(part_scores.values())
     avg_score = total_score / len(part_scores) if part_scores else 0
     
-    analysis += f"🏆 <b>ОБЩАЯ ПРОИЗВОДИТЕЛЬНОСТЬ</b>\n"
-    analysis += f"• Средний балл: {avg_score:.1f}/9\n"
-    analysis += f"• Общий балл: {total_score:.1f}/27\n\n"
-    
-    # Official IELTS criteria analysis
-    analysis += "📋 <b>ОФИЦИАЛЬНЫЕ КРИТЕРИИ IELTS SPEAKING</b>\n\n"
-    
-    # 1. Fluency and Coherence
-    fluency_score = overall_criteria.get('fluency', 0)
-    analysis += f"🎯 <b>1. Fluency and Coherence (Беглость и связность): {fluency_score:.1f}/9</b>\n"
-    analysis += get_fluency_feedback(fluency_score)
-    analysis += "\n"
-    
-    # 2. Lexical Resource
-    vocab_score = overall_criteria.get('vocabulary', 0)
-    analysis += f"📚 <b>2. Lexical Resource (Лексический запас): {vocab_score:.1f}/9</b>\n"
-    analysis += get_vocabulary_feedback(vocab_score)
-    analysis += "\n"
-    
-    # 3. Grammatical Range and Accuracy
-    grammar_score = overall_criteria.get('grammar', 0)
-    analysis += f"🔤 <b>3. Grammatical Range and Accuracy (Грамматика): {grammar_score:.1f}/9</b>\n"
-    analysis += get_grammar_feedback(grammar_score)
-    analysis += "\n"
-    
-    # 4. Pronunciation
-    pron_score = overall_criteria.get('pronunciation', 0)
-    analysis += f"🎤 <b>4. Pronunciation (Произношение): {pron_score:.1f}/9</b>\n"
-    analysis += get_pronunciation_feedback(pron_score)
-    analysis += "\n"
-    
-    # Part-by-part analysis with question breakdown
-    analysis += "📝 <b>ПОДРОБНЫЙ АНАЛИЗ ПО ЧАСТЯМ</b>\n\n"
+    parts = [
+        "📊 <b>ДЕТАЛЬНЫЙ АНАЛИЗ ПО КРИТЕРИЯМ IELTS</b>\n\n",
+        "🏆 <b>ОБЩАЯ ПРОИЗВОДИТЕЛЬНОСТЬ</b>\n",
+        f"• Средний балл: {avg_score:.1f}/9\n",
+        f"• Общий балл: {total_score:.1f}/27\n\n",
+        # Official IELTS criteria analysis
+        "📋 <b>ОФИЦИАЛЬНЫЕ КРИТЕРИИ IELTS SPEAKING</b>\n\n",
+        format_criteria_section(overall_criteria, '.1f'),
+        # Part-by-part analysis with question breakdown
+        "📝 <b>ПОДРОБНЫЙ АНАЛИЗ ПО ЧАСТЯМ</b>\n\n",
+    ]
     
     part_names = {1: "Короткие вопросы", 2: "Карточка-монолог", 3: "Дискуссия"}
-    total_questions_per_part = user_data.get('total_questions_per_part', {1: 3, 2: 1, 3: 5})
-    question_scores = user_data.get('question_scores', {})
     
     for part_num in sorted(part_scores.keys()):
-        part_score = part_scores[part_num]
         part_name = part_names.get(part_num, f"Часть {part_num}")
-        total_questions = total_questions_per_part.get(part_num, 1)
-        
-        analysis += f"🎯 <b>Часть {part_num}: {part_name}</b>\n"
-        analysis += f"<b>Средний результат части:</b> {part_score:.1f}/9\n\n"
-            
-        analysis += "─────────────────\n\n"
+        parts.append(
+            f"🎯 <b>Часть {part_num}: {part_name}</b>\n"
+            f"<b>Средний результат части:</b> {part_scores[part_num]:.1f}/9\n\n"
+            "─────────────────\n\n"
+        )
     
-    return analysis
+    return "".join(parts)
+
+# Feedback per criterion from weakest to strongest, indexed by bisect over _FEEDBACK_THRESHOLDS
+_FEEDBACK_THRESHOLDS = (5.5, 6.5, 8.0)
+
+_FLUENCY_FEEDBACK = (
+    "Требуется работа над беглостью и связностью речи",
+    "Удовлетворительная беглость, заметны паузы и повторения",
+    "Хорошая беглость, иногда есть паузы, но в целом связно",
+    "Отличная беглость речи, логичная структура ответов",
+)
+
+_VOCABULARY_FEEDBACK = (
+    "Требуется расширение словарного запаса",
+    "Достаточный словарный запас для базовой коммуникации",
+    "Хороший словарный запас, иногда есть неточности",
+    "Богатый словарный запас, точное использование слов",
+)
+
+_GRAMMAR_FEEDBACK = (
+    "Требуется работа над грамматическими правилами",
+    "Удовлетворительное владение грамматикой, есть ошибки",
+    "Хорошее владение грамматикой, редкие ошибки",
+    "Отличное владение грамматикой, разнообразные конструкции",
+)
+
+_PRONUNCIATION_FEEDBACK = (
+    "Требуется работа над произношением и интонацией",
+    "Удовлетворительное произношение, иногда неясно",
+    "Хорошее произношение, понятно для слушателя",
+    "Отличное произношение, четкая артикуляция",
+)
 
 def get_fluency_feedback(score: float) -> str:
     """Get feedback for fluency and coherence"""
-    if score >= 8.0:
-        return "Отличная беглость речи, логичная структура ответов"
-    elif score >= 6.5:
-        return "Хорошая беглость, иногда есть паузы, но в целом связно"
-    elif score >= 5.5:
-        return "Удовлетворительная беглость, заметны паузы и повторения"
-    else:
-        return "Требуется работа над беглостью и связностью речи"
+    return _FLUENCY_FEEDBACK[bisect_right(_FEEDBACK_THRESHOLDS, score)]
 
 def get_vocabulary_feedback(score: float) -> str:
     """Get feedback for lexical resource"""
-    if score >= 8.0:
-        return "Богатый словарный запас, точное использование слов"
-    elif score >= 6.5:
-        return "Хороший словарный запас, иногда есть неточности"
-    elif score >= 5.5:
-        return "Достаточный словарный запас для базовой коммуникации"
-    else:
-        return "Требуется расширение словарного запаса"
+    return _VOCABULARY_FEEDBACK[bisect_right(_FEEDBACK_THRESHOLDS, score)]
 
 def get_grammar_feedback(score: float) -> str:
     """Get feedback for grammatical range and accuracy"""
-    if score >= 8.0:
-        return "Отличное владение грамматикой, разнообразные конструкции"
-    elif score >= 6.5:
-        return "Хорошее владение грамматикой, редкие ошибки"
-    elif score >= 5.5:
-        return "Удовлетворительное владение грамматикой, есть ошибки"
-    else:
-        return "Требуется работа над грамматическими правилами"
+    return _GRAMMAR_FEEDBACK[bisect_right(_FEEDBACK_THRESHOLDS, score)]
 
 def get_pronunciation_feedback(score: float) -> str:
     """Get feedback for pronunciation"""
-    if score >= 8.0:
-        return "Отличное произношение, четкая артикуляция"
-    elif score >= 6.5:
-        return "Хорошее произношение, понятно для слушателя"
-    elif score >= 5.5:
-        return "Удовлетворительное произношение, иногда неясно"
-    else:
-        return "Требуется работа над произношением и интонацией"
-
-
-
-    
-
-    
-    # General recommendations
-    if score < 6.5:
-        recommendations.append("• Увеличьте время практики speaking")
-        recommendations.append("• Работайте с преподавателем или репетитором")
-        recommendations.append("• Используйте приложения для изучения языка")
-    
-
+    return _PRONUNCIATION_FEEDBACK[bisect_right(_FEEDBACK_THRESHOLDS, score)]
+
+# (emoji, label, overall_criteria key, feedback function) in official IELTS order
+_IELTS_CRITERIA = (
+    ('🎯', '1. Fluency and Coherence (Беглость и связность)', 'fluency', get_fluency_feedback),
+    ('📚', '2. Lexical Resource (Лексический запас)', 'vocabulary', get_vocabulary_feedback),
+    ('🔤', '3. Grammatical Range and Accuracy (Грамматика)', 'grammar', get_grammar_feedback),
+    ('🎤', '4. Pronunciation (Произношение)', 'pronunciation', get_pronunciation_feedback),
+)
 
+def format_criteria_section(overall_criteria: dict, score_format: str = '') -> str:
+    """Renders the four IELTS criteria with their scores and feedback lines"""
+    parts = []
+    for emoji, label, key, feedback in _IELTS_CRITERIA:
+        score = overall_criteria.get(key, 0)
+        parts.append(f"{emoji} <b>{label}: {score:{score_format}}/9</b>\n{feedback(score)}\n")
+    return "".join(parts)
 
+# Lower bound of each band step; bisect_right over these indexes _BAND_VALUES
+_BAND_THRESHOLDS = (4.5, 5.0, 5.5, 6.0, 6.5, 7.0, 7.5, 8.0, 8.5)
+_BAND_VALUES = (4.0, 5.0, 5.5, 6.0, 6.5, 7.0, 7.5, 8.0, 8.5, 9.0)
 
 def determine_ielts_band(score: float) -> float:
     """Convert numerical score to IELTS band score"""
-    if score >= 8.5:
-        return 9.0
-    elif score >= 8.0:
-        return 8.5
-    elif score >= 7.5:
-        return 8.0
-    elif score >= 7.0:
-        return 7.5
-    elif score >= 6.5:
-        return 7.0
-    elif score >= 6.0:
-        return 6.5
-    elif score >= 5.5:
-        return 6.0
-    elif score >= 5.0:
-        return 5.5
-    elif score >= 4.5:
-        return 5.0
-    else:
-        return 4.0
+    return _BAND_VALUES[bisect_right(_BAND_THRESHOLDS, score)]
 
 def calculate_simulation_time(context: CallbackContext) -> str:
     """Calculate and format simulation time"""
-    import time
     start_time = context.user_data.get('simulation_start_time', time.time())
     elapsed = int(time.time() - start_time)
     minutes = elapsed // 60
@@ -586,239 +1231,119 @@ def generate_comprehensive_feedback(part_scores: dict, overall_band: float) -> s
         feedback += "📚 <b>Требуется дополнительная практика.</b> Рекомендуем больше тренироваться.\n"
     
     return feedback
-    
-    # Step 7: Ensure proper line breaks for readability
-    formatted_text = re.sub(r'\n{3,}', '\n\n', formatted_text)
-    
-    return formatted_text
 
 def escape_grammar_markdown_v2(text: str) -> str:
     """Escapes text for MarkdownV2 format while preserving formatting for grammar explanations."""
     if not text: return ""
+    if not _GRAMMAR_MDV2_NEEDS_RE.search(text):
+        return text
     
-    # Escape special characters for MarkdownV2, but be very careful with formatting
-    escaped_text = text
-    
-    # First, escape backslashes
-    escaped_text = escaped_text.replace('\\', '\\\\')
-    
-    # Escape special characters that are not part of our formatting
-    escaped_text = escaped_text.replace('[', '\\[')
-    escaped_text = escaped_text.replace(']', '\\]')
-    escaped_text = escaped_text.replace('(', '\\(')
-    escaped_text = escaped_text.replace(')', '\\)')
-    escaped_text = escaped_text.replace('~', '\\~')
-    escaped_text = escaped_text.replace('`', '\\`')
-    escaped_text = escaped_text.replace('>', '\\>')
-    escaped_text = escaped_text.replace('#', '\\#')
-    escaped_text = escaped_text.replace('+', '\\+')
-    
-    # Don't escape dashes, dots, equals, pipes, braces, or exclamation marks
-    # These often cause more problems than they solve
+    # Escape backslashes and special characters that are not part of our formatting.
+    # Dashes, dots, equals, pipes, braces and exclamation marks are left alone:
+    # these often cause more problems than they solve.
+    # Underscores and asterisks are escaped too; the underscore formatting is restored below.
+    escaped_text = text.translate(_GRAMMAR_MDV2_TABLE)
     
-    # Handle underscores and asterisks very carefully
-    # Only escape underscores and asterisks that are not part of formatting
-    # This is tricky, so we'll use a more conservative approach
-    
-    # Escape all underscores and asterisks, then restore the ones we want for formatting
-    escaped_text = escaped_text.replace('_', '\\_')
-    escaped_text = escaped_text.replace('*', '\\*')
-    
-    # Now restore the formatting we want
     # Restore __bold__ formatting (double underscores)
-    escaped_text = re.sub(r'\\_\\_(.*?)\\_\\_', r'__\1__', escaped_text)
+    escaped_text = _ESCAPED_DOUBLE_UNDERSCORE_RE.sub(r'__\1__', escaped_text)
     # Restore _italic_ formatting (single underscores)
-    escaped_text = re.sub(r'\\_(.*?)\\_', r'_\1_', escaped_text)
+    escaped_text = _ESCAPED_UNDERSCORE_RE.sub(r'_\1_', escaped_text)
     
     return escaped_text
 
+@lru_cache(maxsize=256)
 def escape_markdown_v2(text: str) -> str:
-    """Escapes text for MarkdownV2 format to prevent parsing errors."""
-    # Escape special characters for MarkdownV2
-    escaped_text = text.replace('\\', '\\\\')
-    escaped_text = escaped_text.replace('_', '\\_')
-    escaped_text = escaped_text.replace('[', '\\[')
-    escaped_text = escaped_text.replace(']', '\\]')
-    escaped_text = escaped_text.replace('(', '\\(')
-    escaped_text = escaped_text.replace(')', '\\)')
-    escaped_text = escaped_text.replace('~', '\\~')
-    escaped_text = escaped_text.replace('`', '\\`')
-    escaped_text = escaped_text.replace('>', '\\>')
-    escaped_text = escaped_text.replace('#', '\\#')
-    escaped_text = escaped_text.replace('+', '\\+')
-    escaped_text = escaped_text.replace('-', '\\-')
-    escaped_text = escaped_text.replace('=', '\\=')
-    escaped_text = escaped_text.replace('|', '\\|')
-    escaped_text = escaped_text.replace('{', '\\{')
-    escaped_text = escaped_text.replace('}', '\\}')
-    escaped_text = escaped_text.replace('.', '\\.')
-    escaped_text = escaped_text.replace('!', '\\!')
-    
-    # Handle bold formatting - preserve ** for bold in MarkdownV2
-    # First, temporarily replace ** with a placeholder
-    escaped_text = escaped_text.replace('**', 'BOLD_PLACEHOLDER')
-    
-    # Escape all remaining single asterisks
-    escaped_text = escaped_text.replace('*', '\\*')
-    
-    # Restore bold formatting
-    escaped_text = escaped_text.replace('BOLD_PLACEHOLDER', '*')
-    
-    return escaped_text
+    """Escapes text for MarkdownV2 format to prevent parsing errors (memoized: static texts repeat constantly)."""
+    if not _MDV2_NEEDS_RE.search(text):
+        return text
+    # Preserve ** as MarkdownV2 bold (*); every other special character, including
+    # single asterisks, is escaped in one translate pass per chunk
+    return '*'.join(chunk.translate(_MDV2_TABLE) for chunk in text.split('**'))
+
+def _split_message_parts(text: str, max_length: int) -> list:
+    """Slices text into stripped parts of at most max_length, breaking at the last newline that fits."""
+    parts = []
+    start = 0
+    text_length = len(text)
+    while text_length - start > max_length:
+        end = text.rfind('\n', start, start + max_length + 1)
+        if end <= start:
+            # A single line longer than max_length: hard cut it
+            end = next_start = start + max_length
+        else:
+            next_start = end + 1
+        part = text[start:end].strip()
+        if part:
+            parts.append(part)
+        start = next_start
+    part = text[start:].strip()
+    if part:
+        parts.append(part)
+    return parts
 
 async def send_long_message(update: Update, context: CallbackContext, text: str, reply_markup: InlineKeyboardMarkup = None, parse_mode: str = None):
     """Sends a long message by splitting it into multiple parts if needed."""
     max_length = 4000  # Leave some buffer for safety
     
-    if len(text) <= max_length:
-        # Message is short enough, send normally
+    parts = [text] if len(text) <= max_length else _split_message_parts(text, max_length)
+    
+    # First part edits/replies to the original message, the rest follow as new messages
+    send_first = update.callback_query.edit_message_text if update.callback_query else update.message.reply_text
+    send_followup = partial(context.bot.send_message, chat_id=update.effective_chat.id)
+    
+    last_index = len(parts) - 1
+    for i, part in enumerate(parts):
+        send = send_first if i == 0 else send_followup
+        # Buttons go on the last part so they stay below the whole text
+        part_markup = reply_markup if i == last_index else None
         try:
-            if update.callback_query:
-                await update.callback_query.edit_message_text(text=text, parse_mode=parse_mode, reply_markup=reply_markup)
-            else:
-                await update.message.reply_text(text=text, parse_mode=parse_mode, reply_markup=reply_markup)
+            await send(text=part, parse_mode=parse_mode, reply_markup=part_markup)
         except Exception as e:
-            logger.warning(f"Parse mode failed ({parse_mode}), falling back to plain text: {e}")
+            logger.warning(f"Parse mode failed ({parse_mode}) for part {i}, falling back to plain text: {e}")
             # Remove all HTML tags for fallback
-            plain_text = re.sub(r'<[^>]+>', '', text)
-            if update.callback_query:
-                await update.callback_query.edit_message_text(text=plain_text, reply_markup=reply_markup)
-            else:
-                await update.message.reply_text(text=plain_text, reply_markup=reply_markup)
-    else:
-        # Split the message logic with better error handling
-        parts = []
-        current_part = ""
-        
-        lines = text.split('\n')
-        
-        for line in lines:
-            if len(current_part + line + '\n') > max_length:
-                if current_part:
-                    parts.append(current_part.strip())
-                    current_part = line + '\n'
-                else:
-                    parts.append(line[:max_length])
-                    current_part = line[max_length:] + '\n'
-            else:
-                current_part += line + '\n'
-        
-        if current_part.strip():
-            parts.append(current_part.strip())
-        
-        # Send parts with improved error handling
-        for i, part in enumerate(parts):
-            try:
-                if i == 0:  # First part with reply markup
-                    if update.callback_query:
-                        await update.callback_query.edit_message_text(text=part, parse_mode=parse_mode, reply_markup=reply_markup)
-                    else:
-                        await update.message.reply_text(text=part, parse_mode=parse_mode, reply_markup=reply_markup)
-                else:  # Subsequent parts
-                    await context.bot.send_message(
-                        chat_id=update.effective_chat.id,
-                        text=part,
-                        parse_mode=parse_mode
-                    )
-            except Exception as e:
-                logger.warning(f"Parse mode failed for part {i}, falling back to plain text: {e}")
-                plain_part = re.sub(r'<[^>]+>', '', part)
-                if i == 0:
-                    if update.callback_query:
-                        await update.callback_query.edit_message_text(text=plain_part, reply_markup=reply_markup)
-                    else:
-                        await update.message.reply_text(text=plain_part, reply_markup=reply_markup)
-                else:
-                    await context.bot.send_message(
-                        chat_id=update.effective_chat.id,
-                        text=plain_part
-                    )
+            await send(text=_HTML_TAG_RE.sub('', part), reply_markup=part_markup)
+
+async def send_or_edit_safe_text(update: Update, context: CallbackContext, text: str, reply_markup: InlineKeyboardMarkup = None,
+                                 use_markdown: bool = True):
+    """A helper to send text with MarkdownV2, falling back to plain text on error, and splitting long messages.
 
-async def send_or_edit_safe_text(update: Update, context: CallbackContext, text: str, reply_markup: InlineKeyboardMarkup = None):
-    """A helper to send text with MarkdownV2, falling back to plain text on error, and splitting long messages."""
+    Pass use_markdown=False for text known to carry no markup; it is sent as plain text directly,
+    as is any text without MarkdownV2 metacharacters.
+    """
     max_length = 4000  # Leave some buffer for safety
     
-    if len(text) <= max_length:
-        # Message is short enough, send normally with markdown formatting
+    parts = [text] if len(text) <= max_length else _split_message_parts(text, max_length)
+    
+    # First part edits/replies to the original message, the rest follow as new messages
+    send_first = update.callback_query.edit_message_text if update.callback_query else update.message.reply_text
+    send_followup = partial(context.bot.send_message, chat_id=update.effective_chat.id)
+    
+    last_index = len(parts) - 1
+    # Without MarkdownV2 metacharacters escaping is a no-op and plain text renders the same
+    if not use_markdown or not _MDV2_NEEDS_RE.search(text):
+        for i, part in enumerate(parts):
+            send = send_first if i == 0 else send_followup
+            await send(text=part, reply_markup=reply_markup if i == last_index else None)
+        return
+    
+    # Parts are sent strictly in order (Telegram shows them in arrival order);
+    # escaping is done up front so the send loop only waits on the network
+    safe_parts = [escape_markdown_v2(part) for part in parts]
+    
+    for i, part in enumerate(parts):
+        send = send_first if i == 0 else send_followup
+        # Buttons go on the last part so they stay below the whole text
+        part_markup = reply_markup if i == last_index else None
         try:
-            safe_text = escape_markdown_v2(text)
-            if update.callback_query:
-                await update.callback_query.edit_message_text(text=safe_text, parse_mode='MarkdownV2', reply_markup=reply_markup)
-            else:
-                await update.message.reply_text(text=safe_text, parse_mode='MarkdownV2', reply_markup=reply_markup)
+            await send(text=safe_parts[i], parse_mode='MarkdownV2', reply_markup=part_markup)
         except Exception as e:
-            logger.warning(f"MarkdownV2 parsing failed, falling back to plain text: {e}")
-            if update.callback_query:
-                await update.callback_query.edit_message_text(text=text, reply_markup=reply_markup)
-            else:
-                await update.message.reply_text(text=text, reply_markup=reply_markup)
-    else:
-        # Split the message and send with markdown formatting
-        parts = []
-        current_part = ""
-        
-        lines = text.split('\n')
-        
-        for line in lines:
-            if len(current_part + line + '\n') > max_length:
-                if current_part:
-                    parts.append(current_part.strip())
-                    current_part = line + '\n'
-                else:
-                    parts.append(line[:max_length])
-                    current_part = line[max_length:] + '\n'
-            else:
-                current_part += line + '\n'
-        
-        if current_part.strip():
-            parts.append(current_part.strip())
-        
-        # Send parts with markdown formatting
-        for i, part in enumerate(parts):
-            try:
-                safe_part = escape_markdown_v2(part)
-                if i == 0:  # First part with reply markup
-                    if update.callback_query:
-                        await update.callback_query.edit_message_text(text=safe_part, parse_mode='MarkdownV2', reply_markup=reply_markup)
-                    else:
-                        await update.message.reply_text(text=safe_part, parse_mode='MarkdownV2', reply_markup=reply_markup)
-                else:  # Subsequent parts
-                    await context.bot.send_message(
-                        chat_id=update.effective_chat.id,
-                        text=safe_part,
-                        parse_mode='MarkdownV2'
-                    )
-            except Exception as e:
-                logger.warning(f"MarkdownV2 parsing failed for part {i}, falling back to plain text: {e}")
-                if i == 0:
-                    if update.callback_query:
-                        await update.callback_query.edit_message_text(text=part, reply_markup=reply_markup)
-                    else:
-                        await update.message.reply_text(text=part, reply_markup=reply_markup)
-                else:
-                    await context.bot.send_message(
-                        chat_id=update.effective_chat.id,
-                        text=part
-                    )
+            logger.warning(f"MarkdownV2 parsing failed for part {i}, falling back to plain text: {e}")
+            await send(text=part, reply_markup=part_markup)
 
 async def setup_bot_menu_button(context: CallbackContext) -> None:
     """Sets up the bot menu button with main commands"""
     try:
-        from telegram import BotCommand
-        
-        commands = [
-            BotCommand("start", "Start the bot and get welcome message"),
-            BotCommand("menu", "Open the interactive main menu"),
-            BotCommand("help", "Show help information"),
-            BotCommand("flashcards", "Study with spaced repetition flashcards"),
-            BotCommand("vocabulary", "Get vocabulary words"),
-            BotCommand("writing", "Get IELTS writing tasks"),
-            BotCommand("speaking", "Get IELTS speaking questions"),
-            BotCommand("info", "Get IELTS strategies and tips"),
-            BotCommand("grammar", "Get grammar explanations"),
-        ]
-        
-        await context.bot.set_my_commands(commands)
+        await context.bot.set_my_commands(_BOT_COMMANDS)
         logger.info("✅ Bot menu button commands set successfully.")
     except Exception as e:
         logger.error(f"🔥 Failed to set bot menu button: {e}")
@@ -827,283 +1352,201 @@ async def start_command(update: Update, context: CallbackContext) -> None:
     user = update.effective_user
     
     # Add user to database (always add, access control happens later)
-    db.add_user(
-        user_id=user.id,
-        username=user.username,
-        first_name=user.first_name,
-        last_name=user.last_name
-    )
+    queue_add_user(user)
     
     # Check user access (ID or username)
-    has_id_access = check_user_access(user.id)
-    has_username_access = check_username_access(user.username) if user.username else False
-    
-    if not (has_id_access or has_username_access):
-        await send_access_denied_message(update, context)
+    access = resolve_access(user)
+    if not access & (Access.ADMIN | Access.WHITELISTED):
+        await send_access_denied_message(update, context, access)
         return
     
-    welcome_message = (f"👋 Привет, {user.first_name}!\n\nЯ ваш помощник по подготовке к IELTS...")
-    
-    keyboard = [
-        [InlineKeyboardButton("📋 Меню", callback_data="menu_help")],
-        [InlineKeyboardButton("❓ Помощь", callback_data="help_button")],
-    ]
-    
-    # Add admin panel button for admins
-    if is_admin(user.id):
-        keyboard.append([InlineKeyboardButton("⚙️ Админ-панель", callback_data="admin_panel")])
+    welcome_message = f"👋 Привет, {user.first_name}!{_WELCOME_BODY}"
     
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    # Admins get an extra admin panel button
+    reply_markup = _START_ADMIN_MARKUP if is_admin(user.id) else _START_MARKUP
     
     await update.message.reply_text(welcome_message, reply_markup=reply_markup)
 
 @require_access
 async def help_command(update: Update, context: CallbackContext) -> None:
-    help_text = ("Вот команды, которые вы можете использовать:\n\n"
-                 "📋 /menu - Открыть интерактивное главное меню\n"
-                 "🧠 /vocabulary - Получить словарные слова (случайные или по теме).\n"
-                 "➕ /customword - Добавить свое слово в словарь.\n"
-                 "🤖 /aicustomword - Добавить слово с AI-помощью.\n"
-                 "✍️ /writing - Получить задание IELTS по письму.\n"
-                 "🗣️ /speaking - Получить карточку IELTS для говорения.\n"
-                 "ℹ️ /info - Получить советы и стратегии для конкретных типов заданий.\n"
-                 "📖 /grammar - Получить объяснение грамматической темы.")
-    await update.message.reply_text(help_text)
+    await update.message.reply_text(_HELP_TEXT)
 
 @require_access
 async def menu_command(update: Update, context: CallbackContext, force_new_message=False) -> None:
     """Sends an interactive main menu with buttons for all main features."""
     user = update.effective_user
     if user:
-        db.update_user_activity(user.id)
+        queue_user_activity(user.id)
     
-    keyboard = [
-        [InlineKeyboardButton("🧠 Словарь", callback_data="menu_vocabulary")],
-        [InlineKeyboardButton("🎓 Flashcards", callback_data="flashcard_menu")],
-        [InlineKeyboardButton("✍️ Письмо", callback_data="menu_writing")],
-        [InlineKeyboardButton("🗣️ Говорение", callback_data="menu_speaking")],
-        [InlineKeyboardButton("ℹ️ Информация", callback_data="menu_info")],
-        [InlineKeyboardButton("📖 Грамматика", callback_data="menu_grammar")],
-        [InlineKeyboardButton("👤 Мой профиль", callback_data="menu_profile")],
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    reply_markup = _MAIN_MENU_MARKUP
     if force_new_message:
         chat_id = update.effective_chat.id if update.effective_chat else update.callback_query.message.chat_id
         await context.bot.send_message(
             chat_id=chat_id,
-            text="📋 <b>Главное меню</b>\n\nВыберите раздел для начала:",
+            text=_MAIN_MENU_TEXT,
             reply_markup=reply_markup,
             parse_mode='HTML'
         )
     else:
         await update.message.reply_text(
-            "📋 <b>Главное меню</b>\n\nВыберите раздел для начала:",
+            _MAIN_MENU_TEXT,
             reply_markup=reply_markup,
             parse_mode='HTML'
         )
 
-@require_access
-async def menu_button_callback(update: Update, context: CallbackContext) -> None:
-    """Handle main menu button presses"""
-    user = update.effective_user
-    
+async def _show_vocabulary_menu(update: Update, context: CallbackContext) -> None:
+    """Vocabulary submenu"""
     query = update.callback_query
-    await query.answer()
-    data = query.data
-    
-    # Add logging to debug the callback data
-    logger.info(f"🔍 Menu button callback received data: '{data}' from user {user.id}")
-    
-    if data == "menu_vocabulary":
-        # Handle vocabulary menu selection - direct approach to avoid conversation handler conflicts
-        keyboard = [
-            [InlineKeyboardButton("🎲 Случайное слово", callback_data="vocabulary_random")],
-            [InlineKeyboardButton("📚 Слова по теме", callback_data="vocabulary_topic")],
-            [InlineKeyboardButton("➕ Добавить свое слово", callback_data="custom_word_add")],
-            [InlineKeyboardButton("🤖 AI-помощь для слова", callback_data="ai_enhanced_custom_word")],
-            [InlineKeyboardButton("🔙 Назад в меню", callback_data="back_to_main_menu")],
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.edit_message_text("📖 Какой тип словаря вы хотите?", reply_markup=reply_markup)
-        
-    elif data == "menu_writing":
-        # Handle writing menu selection - start writing conversation
-        await start_writing_task(update, context)
-        
-    elif data == "menu_grammar":
-        # Handle grammar menu selection
-        context.user_data['waiting_for_grammar_topic'] = True
-        keyboard = [
-            [InlineKeyboardButton("🔙 Назад в меню", callback_data="back_to_main_menu")],
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.edit_message_text(
-            "📖 Какую грамматическую тему вы хотите объяснить?\n\n"
-            "Например: 'Present Perfect', 'использование артиклей' или 'фразовые глаголы'.",
-            reply_markup=reply_markup
-        )
-        
-    elif data == "menu_speaking":
-        # Handle speaking menu selection
-        keyboard = [
-            [InlineKeyboardButton("🎯 Полная симуляция экзамена", callback_data="full_speaking_sim")],
-            [InlineKeyboardButton("Part 1: Короткие вопросы", callback_data="speaking_part_1")],
-            [InlineKeyboardButton("Part 2: Карточка-монолог", callback_data="speaking_part_2")],
-            [InlineKeyboardButton("Part 3: Дискуссия", callback_data="speaking_part_3")],
-            [InlineKeyboardButton("📈 Статистика прогресса", callback_data="speaking_stats")],
-            [InlineKeyboardButton("🔙 Назад в меню", callback_data="back_to_main_menu")],
+    reply_markup = _VOCABULARY_MENU_MARKUP
+    await query.edit_message_text(_VOCAB_PROMPT, reply_markup=reply_markup)
+
+async def _show_writing_menu(update: Update, context: CallbackContext) -> None:
+    """Writing: start the writing task flow"""
+    await start_writing_task(update, context)
+
+async def _show_grammar_menu(update: Update, context: CallbackContext) -> None:
+    """Grammar: wait for a topic to explain"""
+    query = update.callback_query
+    set_waiting(context, WaitState.GRAMMAR_TOPIC)
+    reply_markup = _BACK_TO_MENU_MARKUP
+    await query.edit_message_text(
+        _GRAMMAR_PROMPT,
+        reply_markup=reply_markup
+    )
+
+async def _show_speaking_menu(update: Update, context: CallbackContext) -> None:
+    """Speaking submenu"""
+    query = update.callback_query
+    reply_markup = _SPEAKING_MENU_MARKUP
+    await query.edit_message_text(
+        _SPEAKING_PROMPT,
+        parse_mode='HTML',
+        reply_markup=reply_markup
+    )
+
+async def _show_info_menu(update: Update, context: CallbackContext) -> None:
+    """IELTS info submenu"""
+    query = update.callback_query
+    reply_markup = _INFO_MENU_MARKUP
+    await query.edit_message_text(_INFO_PROMPT, reply_markup=reply_markup)
+
+async def _show_profile(update: Update, context: CallbackContext) -> None:
+    """Profile with vocabulary, speaking and writing stats"""
+    query = update.callback_query
+    user = update.effective_user
+    logger.debug("👤 Profile menu requested by user %s", user.id)
+
+    # Create the absolute minimum safe profile
+    try:
+        # Vocabulary count, speaking and writing stats come from one query, run off the event loop
+        profile = await asyncio.to_thread(cached_user_profile, user.id)
+        speaking_stats = profile['speaking']
+        writing_stats = profile['writing']
+
+        full_name = user.first_name or 'Не указано'
+        if user.last_name:
+            full_name += f" {user.last_name}"
+        lines = [
+            "👤 <b>Мой профиль</b>",
+            "",
+            f"🆔 ID: {user.id}",
+            f"👋 Имя: {full_name}",
         ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.edit_message_text(
-            "🗣️ <b>IELTS Speaking Practice</b>\n\n"
-            "Выберите режим практики:\n\n"
-            "🎯 <b>Полная симуляция</b> - пройдите все три части экзамена подряд\n"
-            "📋 <b>Отдельные части</b> - практикуйте конкретную часть\n"
-            "📊 <b>Аналитика</b> - отслеживайте свой прогресс",
-            parse_mode='HTML',
-            reply_markup=reply_markup
-        )
-        
-    elif data == "menu_info":
-        # Handle info menu selection
-        keyboard = [
-            [InlineKeyboardButton("🎧 Listening - True/False", callback_data="info_listening_truefalse")],
-            [InlineKeyboardButton("🎧 Listening - Multiple Choice", callback_data="info_listening_multiplechoice")],
-            [InlineKeyboardButton("🎧 Listening - Note Completion", callback_data="info_listening_notes")],
-            [InlineKeyboardButton("📖 Reading - Short Answer", callback_data="info_reading_shortanswer")],
-            [InlineKeyboardButton("📖 Reading - True/False/NG", callback_data="info_reading_truefalse")],
-            [InlineKeyboardButton("📖 Reading - Multiple Choice", callback_data="info_reading_multiplechoice")],
-            [InlineKeyboardButton("📖 Reading - Matching Headings", callback_data="info_reading_headings")],
-            [InlineKeyboardButton("📖 Reading - Summary Completion", callback_data="info_reading_summary")],
-            [InlineKeyboardButton("🔙 Назад в меню", callback_data="back_to_main_menu")],
+        if user.username:
+            lines.append(f"📧 Username: @{user.username}")
+        lines.append(f"📚 Слов в словаре: {profile['vocabulary_count']}")
+
+        lines += [
+            "",
+            "🗣️ <b>Статистика говорения:</b>",
+            f"📊 Всего симуляций: {speaking_stats['total_simulations']}",
+            f"✅ Завершено: {speaking_stats['completed_simulations']}",
         ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.edit_message_text("ℹ️ Choose the specific IELTS task type you want strategies for:", reply_markup=reply_markup)
-        
-    elif data == "menu_profile":
-        # Handle profile menu selection - ULTRA SAFE VERSION
-        logger.info(f"👤 Profile menu requested by user {user.id}")
-        
-        # Create the absolute minimum safe profile
-        try:
-            profile_text = f"👤 <b>Мой профиль</b>\n\n"
-            profile_text += f"🆔 ID: {user.id}\n"
-            profile_text += f"👋 Имя: {user.first_name or 'Не указано'}"
-            
-            # Add last name safely
-            try:
-                if user.last_name:
-                    profile_text += f" {user.last_name}"
-            except:
-                pass
-            
-            # Add username safely
-            try:
-                if user.username:
-                    profile_text += f"\n📧 Username: @{user.username}"
-            except:
-                pass
-            
-            # Add vocabulary count safely
-            try:
-                vocabulary_count = db.get_user_vocabulary_count(user.id)
-                profile_text += f"\n📚 Слов в словаре: {vocabulary_count}"
-                logger.info(f"✅ Vocabulary count for user {user.id}: {vocabulary_count}")
-            except Exception as e:
-                profile_text += f"\n📚 Слов в словаре: 0"
-                logger.error(f"🔥 Failed to get vocabulary count: {e}")
-            
-            # Add speaking statistics safely
-            try:
-                speaking_stats = db.get_user_speaking_stats(user.id)
-                profile_text += f"\n\n🗣️ <b>Статистика говорения:</b>"
-                profile_text += f"\n📊 Всего симуляций: {speaking_stats['total_simulations']}"
-                profile_text += f"\n✅ Завершено: {speaking_stats['completed_simulations']}"
-                if speaking_stats['average_overall_score'] > 0:
-                    profile_text += f"\n📈 Средний балл: {speaking_stats['average_overall_score']:.1f}/9.0"
-                if speaking_stats['best_overall_score'] > 0:
-                    profile_text += f"\n🏆 Лучший результат: {speaking_stats['best_overall_score']:.1f}/9.0"
-                if speaking_stats['total_practice_time_minutes'] > 0:
-                    profile_text += f"\n⏱️ Время практики: {speaking_stats['total_practice_time_minutes']} мин"
-                if speaking_stats['last_simulation_date']:
-                    profile_text += f"\n🕐 Последняя симуляция: {speaking_stats['last_simulation_date']}"
-                logger.info(f"✅ Speaking stats for user {user.id}: {speaking_stats}")
-            except Exception as e:
-                profile_text += f"\n\n🗣️ <b>Статистика говорения:</b>"
-                profile_text += f"\n📊 Всего симуляций: 0"
-                profile_text += f"\n✅ Завершено: 0"
-                logger.error(f"🔥 Failed to get speaking stats: {e}")
-            
-            # Add writing statistics safely
-            try:
-                writing_stats = db.get_user_writing_stats(user.id)
-                profile_text += f"\n\n✍️ <b>Статистика письма:</b>"
-                profile_text += f"\n📝 Всего проверок: {writing_stats['total_evaluations']}"
-                if writing_stats['average_overall_score'] > 0:
-                    profile_text += f"\n📈 Средний балл: {writing_stats['average_overall_score']:.1f}/9.0"
-                if writing_stats['best_overall_score'] > 0:
-                    profile_text += f"\n🏆 Лучший результат: {writing_stats['best_overall_score']:.1f}/9.0"
-                if writing_stats['last_evaluation_date']:
-                    profile_text += f"\n🕐 Последняя проверка: {writing_stats['last_evaluation_date']}"
-                logger.info(f"✅ Writing stats for user {user.id}: {writing_stats}")
-            except Exception as e:
-                profile_text += f"\n\n✍️ <b>Статистика письма:</b>"
-                profile_text += f"\n📝 Всего проверок: 0"
-                logger.error(f"🔥 Failed to get writing stats: {e}")
-            
-            logger.info(f"📝 Profile text created: {len(profile_text)} chars")
-            
-            keyboard = [
-                [InlineKeyboardButton("📖 Мой словарь", callback_data="profile_vocabulary")],
-                [InlineKeyboardButton("📊 Статистика говорения", callback_data="speaking_stats")],
-                [InlineKeyboardButton("✍️ Статистика письма", callback_data="writing_stats")],
-                [InlineKeyboardButton("🔙 Назад в меню", callback_data="back_to_main_menu")],
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            logger.info(f"📝 Attempting to send profile to user {user.id}")
-            await query.edit_message_text(profile_text, reply_markup=reply_markup, parse_mode='HTML')
-            logger.info(f"✅ Profile menu sent successfully to user {user.id}")
-            
-        except Exception as e:
-            logger.error(f"🔥 Critical error in profile menu for user {user.id}: {e}")
-            import traceback
-            logger.error(f"🔥 Full traceback: {traceback.format_exc()}")
-            
-            # Ultra-safe fallback - absolute minimum
-            try:
-                fallback_text = f"👤 Мой профиль\n\nID: {user.id}\nИмя: {user.first_name}\n\n⚠️ Профиль временно недоступен"
-                keyboard = [
-                    [InlineKeyboardButton("🔙 Назад в меню", callback_data="back_to_main_menu")],
-                ]
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                await query.edit_message_text(fallback_text, reply_markup=reply_markup)
-                logger.info(f"✅ Fallback profile sent to user {user.id}")
-            except Exception as fallback_error:
-                logger.error(f"🔥 Even fallback failed: {fallback_error}")
-                try:
-                    await query.answer("❌ Ошибка профиля. Попробуйте позже.")
-                except:
-                    logger.error(f"🔥 Could not even send error message to user {user.id}")
-        
-    elif data == "back_to_main_menu":
-        # Handle back to main menu
-        keyboard = [
-            [InlineKeyboardButton("🧠 Словарь", callback_data="menu_vocabulary")],
-            [InlineKeyboardButton("🎓 Flashcards", callback_data="flashcard_menu")],
-            [InlineKeyboardButton("✍️ Письмо", callback_data="menu_writing")],
-            [InlineKeyboardButton("🗣️ Говорение", callback_data="menu_speaking")],
-            [InlineKeyboardButton("ℹ️ Информация", callback_data="menu_info")],
-            [InlineKeyboardButton("📖 Грамматика", callback_data="menu_grammar")],
-            [InlineKeyboardButton("👤 Мой профиль", callback_data="menu_profile")],
+        if speaking_stats['average_overall_score'] > 0:
+            lines.append(f"📈 Средний балл: {speaking_stats['average_overall_score']:.1f}/9.0")
+        if speaking_stats['best_overall_score'] > 0:
+            lines.append(f"🏆 Лучший результат: {speaking_stats['best_overall_score']:.1f}/9.0")
+        if speaking_stats['total_practice_time_minutes'] > 0:
+            lines.append(f"⏱️ Время практики: {speaking_stats['total_practice_time_minutes']} мин")
+        if speaking_stats['last_simulation_date']:
+            lines.append(f"🕐 Последняя симуляция: {speaking_stats['last_simulation_date']}")
+
+        lines += [
+            "",
+            "✍️ <b>Статистика письма:</b>",
+            f"📝 Всего проверок: {writing_stats['total_evaluations']}",
         ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.edit_message_text(
-            "📋 <b>Главное меню</b>\n\nВыберите раздел для начала:",
-            reply_markup=reply_markup,
-            parse_mode='HTML'
-        )
-        
+        if writing_stats['average_overall_score'] > 0:
+            lines.append(f"📈 Средний балл: {writing_stats['average_overall_score']:.1f}/9.0")
+        if writing_stats['best_overall_score'] > 0:
+            lines.append(f"🏆 Лучший результат: {writing_stats['best_overall_score']:.1f}/9.0")
+        if writing_stats['last_evaluation_date']:
+            lines.append(f"🕐 Последняя проверка: {writing_stats['last_evaluation_date']}")
+
+        profile_text = "\n".join(lines)
+
+        logger.debug("📝 Profile text created: %d chars", len(profile_text))
+
+        reply_markup = _PROFILE_MENU_MARKUP
+
+        logger.debug("📝 Attempting to send profile to user %s", user.id)
+        await query.edit_message_text(profile_text, reply_markup=reply_markup, parse_mode='HTML')
+        logger.debug("✅ Profile menu sent successfully to user %s", user.id)
+
+    except Exception as e:
+        logger.error(f"🔥 Critical error in profile menu for user {user.id}: {e}")
+        import traceback
+        logger.error(f"🔥 Full traceback: {traceback.format_exc()}")
+
+        # Ultra-safe fallback - absolute minimum
+        try:
+            fallback_text = f"👤 Мой профиль\n\nID: {user.id}\nИмя: {user.first_name}\n\n⚠️ Профиль временно недоступен"
+            reply_markup = _BACK_TO_MENU_MARKUP
+            await query.edit_message_text(fallback_text, reply_markup=reply_markup)
+            logger.info(f"✅ Fallback profile sent to user {user.id}")
+        except Exception as fallback_error:
+            logger.error(f"🔥 Even fallback failed: {fallback_error}")
+            try:
+                await query.answer("❌ Ошибка профиля. Попробуйте позже.")
+            except:
+                logger.error(f"🔥 Could not even send error message to user {user.id}")
+
+async def _show_main_menu(update: Update, context: CallbackContext) -> None:
+    """Back to the main menu"""
+    query = update.callback_query
+    reply_markup = _MAIN_MENU_MARKUP
+    await query.edit_message_text(
+        _MAIN_MENU_TEXT,
+        reply_markup=reply_markup,
+        parse_mode='HTML'
+    )
+
+# Main menu buttons: callback data -> screen
+_MENU_DISPATCH = {
+    "menu_vocabulary": _show_vocabulary_menu,
+    "menu_writing": _show_writing_menu,
+    "menu_grammar": _show_grammar_menu,
+    "menu_speaking": _show_speaking_menu,
+    "menu_info": _show_info_menu,
+    "menu_profile": _show_profile,
+    "back_to_main_menu": _show_main_menu,
+}
+
+@require_access
+async def menu_button_callback(update: Update, context: CallbackContext) -> None:
+    """Handle main menu button presses"""
+    user = update.effective_user
+    
+    query = update.callback_query
+    _ack(update, context, cache_time=CALLBACK_CACHE_TIME)
+    data = query.data
+    
+    # Add logging to debug the callback data
+    logger.debug("🔍 Menu button callback received data: %r from user %s", data, user.id)
+    
+    handler = _MENU_DISPATCH.get(data)
+    if handler:
+        await handler(update, context)
     else:
         logger.warning(f"❌ Unknown menu option received: '{data}' from user {user.id}")
         await query.edit_message_text(f"Unknown menu option: {data}")
@@ -1114,159 +1557,104 @@ async def handle_start_buttons(update: Update, context: CallbackContext) -> None
     user = update.effective_user
     
     query = update.callback_query
-    await query.answer()
+    _ack(update, context)
     data = query.data
     
     if data == "menu_help":
         # Create and send the main menu directly
-        keyboard = [
-            [InlineKeyboardButton("🧠 Словарь", callback_data="menu_vocabulary")],
-            [InlineKeyboardButton("🎓 Flashcards", callback_data="flashcard_menu")],
-            [InlineKeyboardButton("✍️ Письмо", callback_data="menu_writing")],
-            [InlineKeyboardButton("🗣️ Говорение", callback_data="menu_speaking")],
-            [InlineKeyboardButton("ℹ️ Информация", callback_data="menu_info")],
-            [InlineKeyboardButton("📖 Грамматика", callback_data="menu_grammar")],
-            [InlineKeyboardButton("👤 Мой профиль", callback_data="menu_profile")],
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        reply_markup = _MAIN_MENU_MARKUP
         
         await query.edit_message_text(
-            "📋 <b>Главное меню</b>\n\nВыберите раздел для начала:",
+            _MAIN_MENU_TEXT,
             reply_markup=reply_markup,
             parse_mode='HTML'
         )
     elif data == "help_button":
-        help_text = ("Вот команды, которые вы можете использовать:\n\n"
-                     "📋 /menu - Открыть интерактивное главное меню\n"
-                     "🧠 /vocabulary - Получить словарные слова (случайные или по теме).\n"
-                     "➕ /customword - Добавить свое слово в словарь.\n"
-                     "🤖 /aicustomword - Добавить слово с AI-помощью.\n"
-                     "✍️ /writing - Получить задание IELTS по письму.\n"
-                     "🗣️ /speaking - Получить карточку IELTS для говорения.\n"
-                     "ℹ️ /info - Получить советы и стратегии для конкретных типов заданий.\n"
-                     "📖 /grammar - Получить объяснение грамматической темы.")
-        await query.edit_message_text(help_text)
+        await query.edit_message_text(_HELP_TEXT)
 
 # --- VOCABULARY (Conversation) ---
 @require_access
 async def start_vocabulary_selection(update: Update, context: CallbackContext, force_new_message=False) -> int:
-    keyboard = [
-        [InlineKeyboardButton("🎲 Случайное слово", callback_data="vocabulary_random")],
-        [InlineKeyboardButton("📚 Слова по теме", callback_data="vocabulary_topic")],
-        [InlineKeyboardButton("➕ Добавить свое слово", callback_data="custom_word_add")],
-        [InlineKeyboardButton("🤖 AI-помощь для слова", callback_data="ai_enhanced_custom_word")],
-        [InlineKeyboardButton("🔙 Назад в меню", callback_data="back_to_main_menu")],
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    reply_markup = _VOCABULARY_MENU_MARKUP
     if force_new_message:
         # Try to edit if possible, else send new message
         if hasattr(update, 'callback_query') and update.callback_query:
-            await update.callback_query.edit_message_text("📖 Какой тип словаря вы хотите?", reply_markup=reply_markup)
+            await update.callback_query.edit_message_text(_VOCAB_PROMPT, reply_markup=reply_markup)
         elif hasattr(update, 'message') and update.message:
-            await update.message.reply_text("📖 Какой тип словаря вы хотите?", reply_markup=reply_markup)
+            await update.message.reply_text(_VOCAB_PROMPT, reply_markup=reply_markup)
         else:
             chat_id = update.effective_chat.id if update.effective_chat else None
             if chat_id:
-                await context.bot.send_message(chat_id=chat_id, text="📖 Какой тип словаря вы хотите?", reply_markup=reply_markup)
+                await context.bot.send_message(chat_id=chat_id, text=_VOCAB_PROMPT, reply_markup=reply_markup)
         return GET_VOCABULARY_TOPIC
     if hasattr(update, 'callback_query') and update.callback_query:
-        await update.callback_query.edit_message_text("📖 Какой тип словаря вы хотите?", reply_markup=reply_markup)
+        await update.callback_query.edit_message_text(_VOCAB_PROMPT, reply_markup=reply_markup)
     elif hasattr(update, 'message') and update.message:
-        await update.message.reply_text("📖 Какой тип словаря вы хотите?", reply_markup=reply_markup)
+        await update.message.reply_text(_VOCAB_PROMPT, reply_markup=reply_markup)
+    return GET_VOCABULARY_TOPIC
+
+async def _vocab_choice_random(update: Update, context: CallbackContext, via: str) -> int:
+    query = update.callback_query
+    logger.info(f"🎯 User {update.effective_user.id} chose random vocabulary{via}")
+    word_details = await get_pooled_word_details(context, query.message.chat_id)
+    
+    # Store the word details for potential saving
+    context.user_data['last_random_word'] = word_details
+    
+    # Add button to save word to personal vocabulary
+    reply_markup = _SAVE_WORD_MARKUP
+    await send_or_edit_safe_text(update, context, word_details, reply_markup)
+    return ConversationHandler.END
+
+async def _vocab_choice_topic(update: Update, context: CallbackContext, via: str) -> int:
+    logger.info(f"🎯 User {update.effective_user.id} chose topic-specific vocabulary{via}")
+    set_waiting(context, WaitState.VOCAB_TOPIC)
+    reply_markup = _BACK_TO_VOCABULARY_MARKUP
+    await update.callback_query.edit_message_text(
+        "📚 Пожалуйста, введите тему для словарных слов (например, 'окружающая среда', 'технологии', 'образование'):",
+        reply_markup=reply_markup
+    )
     return GET_VOCABULARY_TOPIC
 
+async def _vocab_choice_custom(update: Update, context: CallbackContext, via: str) -> int:
+    logger.info(f"🎯 User {update.effective_user.id} chose custom word{via}")
+    await start_custom_word_input(update, context)
+    return GET_CUSTOM_WORD
+
+async def _vocab_choice_ai_enhanced(update: Update, context: CallbackContext, via: str) -> int:
+    logger.info(f"🎯 User {update.effective_user.id} chose AI-enhanced custom word{via}")
+    context.user_data['ai_enhanced_mode'] = True
+    await start_custom_word_input(update, context)
+    return GET_CUSTOM_WORD
+
+# callback data -> handler returning the next conversation state
+_VOCAB_CHOICE_DISPATCH = {
+    'vocabulary_random': _vocab_choice_random,
+    'vocabulary_topic': _vocab_choice_topic,
+    'vocabulary_custom': _vocab_choice_custom,
+    'vocabulary_ai_enhanced': _vocab_choice_ai_enhanced,
+}
+
+async def _do_vocab_choice(update: Update, context: CallbackContext, via: str = '') -> int:
+    """Shared body of the vocabulary choice handlers; returns the next conversation state"""
+    query = update.callback_query
+    # Progress is shown as a toast instead of a separate placeholder edit
+    await query.answer(
+        text="🎲 Генерирую случайное слово..." if query.data == 'vocabulary_random' else None,
+        cache_time=CALLBACK_CACHE_TIME
+    )
+    handler = _VOCAB_CHOICE_DISPATCH.get(query.data, _vocab_choice_ai_enhanced)
+    return await handler(update, context, via)
+
 @require_access
 async def handle_vocabulary_choice_callback(update: Update, context: CallbackContext) -> int:
     """Handle vocabulary choice - for conversation handler"""
-    user = update.effective_user
-    
-    query = update.callback_query
-    await query.answer()
-    choice = query.data.split('_')[1]  # random or topic
-    
-    if choice == "random":
-        logger.info(f"🎯 User {update.effective_user.id} chose random vocabulary")
-        await query.edit_message_text("🎲 Генерирую случайное слово...")
-        await context.bot.send_chat_action(chat_id=query.message.chat_id, action="typing")
-        word_details = get_random_word_details()
-        
-        # Store the word details for potential saving
-        context.user_data['last_random_word'] = word_details
-        
-        # Add button to save word to personal vocabulary
-        keyboard = [
-            [InlineKeyboardButton("➕ Добавить в мой словарь", callback_data="save_word_to_vocabulary")],
-            [InlineKeyboardButton("🔙 Назад в меню", callback_data="back_to_main_menu")],
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await send_or_edit_safe_text(update, context, word_details, reply_markup)
-        return ConversationHandler.END
-    elif choice == "topic":
-        logger.info(f"🎯 User {update.effective_user.id} chose topic-specific vocabulary")
-        context.user_data['waiting_for_vocabulary_topic'] = True
-        keyboard = [
-            [InlineKeyboardButton("🔙 Назад к словарю", callback_data="menu_vocabulary")],
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.answer()
-        await query.edit_message_text(
-            "📚 Пожалуйста, введите тему для словарных слов (например, 'окружающая среда', 'технологии', 'образование'):",
-            reply_markup=reply_markup
-        )
-        return GET_VOCABULARY_TOPIC
-    elif choice == "custom":
-        logger.info(f"🎯 User {update.effective_user.id} chose custom word (conversation)")
-        await start_custom_word_input(update, context)
-        return GET_CUSTOM_WORD
-    else:  # ai_enhanced
-        logger.info(f"🎯 User {update.effective_user.id} chose AI-enhanced custom word (conversation)")
-        context.user_data['ai_enhanced_mode'] = True
-        await start_custom_word_input(update, context)
-        return GET_CUSTOM_WORD
+    return await _do_vocab_choice(update, context)
 
 @require_access
 async def handle_vocabulary_choice_global(update: Update, context: CallbackContext) -> None:
     """Handle vocabulary choice - for global handler (menu-based access)"""
-    user = update.effective_user
-    
-    query = update.callback_query
-    await query.answer()
-    choice = query.data.split('_')[1]  # random or topic
-    
-    if choice == "random":
-        logger.info(f"🎯 User {update.effective_user.id} chose random vocabulary (global)")
-        await query.edit_message_text("🎲 Генерирую случайное слово...")
-        await context.bot.send_chat_action(chat_id=query.message.chat_id, action="typing")
-        word_details = get_random_word_details()
-        
-        # Store the word details for potential saving
-        context.user_data['last_random_word'] = word_details
-        
-        # Add button to save word to personal vocabulary
-        keyboard = [
-            [InlineKeyboardButton("➕ Добавить в мой словарь", callback_data="save_word_to_vocabulary")],
-            [InlineKeyboardButton("🔙 Назад в меню", callback_data="back_to_main_menu")],
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await send_or_edit_safe_text(update, context, word_details, reply_markup)
-    elif choice == "topic":
-        logger.info(f"🎯 User {update.effective_user.id} chose topic-specific vocabulary (global)")
-        context.user_data['waiting_for_vocabulary_topic'] = True
-        keyboard = [
-            [InlineKeyboardButton("🔙 Назад к словарю", callback_data="menu_vocabulary")],
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.edit_message_text(
-            "📚 Пожалуйста, введите тему для словарных слов (например, 'окружающая среда', 'технологии', 'образование'):",
-            reply_markup=reply_markup
-        )
-    elif choice == "custom":
-        logger.info(f"🎯 User {update.effective_user.id} chose custom word (global)")
-        await start_custom_word_input(update, context)
-    else:  # ai_enhanced
-        logger.info(f"🎯 User {update.effective_user.id} chose AI-enhanced custom word (global)")
-        context.user_data['ai_enhanced_mode'] = True
-        await start_custom_word_input(update, context)
+    await _do_vocab_choice(update, context, ' (global)')
 
 @require_access
 async def get_topic_and_generate_vocabulary(update: Update, context: CallbackContext) -> int:
@@ -1275,23 +1663,22 @@ async def get_topic_and_generate_vocabulary(update: Update, context: CallbackCon
     logger.info(f"🎯 Vocabulary: User {update.effective_user.id} requested topic-specific words for: '{topic}'")
     
     await update.message.reply_text(f"📚 Генерирую полезные словарные слова для '{topic}'...")
-    await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
-    
-    vocabulary_words = get_topic_specific_words(topic=topic, count=10)
-    reply_markup = None
-    await send_or_edit_safe_text(update, context, vocabulary_words, reply_markup)
+    vocabulary_words = await run_with_typing(context, update.effective_chat.id, get_topic_specific_words, topic=topic, count=10)
+    # Attach the main menu to the result instead of sending it as a separate message
+    reply_markup = _MAIN_MENU_MARKUP
+    await send_or_edit_safe_text(update, context, vocabulary_words, reply_markup, use_markdown=False)
     logger.info(f"✅ Topic-specific vocabulary generated for user {update.effective_user.id}, ending conversation")
-    await menu_command(update, context, force_new_message=True)
+    queue_user_activity(update.effective_user.id)
     return ConversationHandler.END
 
 # --- VOCABULARY (Legacy - keeping for backward compatibility) ---
 @require_access
 async def handle_vocabulary_command(update: Update, context: CallbackContext) -> None:
-    await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
-    word_details = get_random_word_details()
-    reply_markup = None
-    await send_or_edit_safe_text(update, context, word_details, reply_markup)
-    await menu_command(update, context, force_new_message=True)
+    word_details = await get_pooled_word_details(context, update.effective_chat.id)
+    # Attach the main menu to the result instead of sending it as a separate message
+    reply_markup = _MAIN_MENU_MARKUP
+    await send_or_edit_safe_text(update, context, word_details, reply_markup, use_markdown=False)
+    queue_user_activity(update.effective_user.id)
 
 @require_access
 async def handle_vocabulary_topic_input(update: Update, context: CallbackContext) -> None:
@@ -1301,22 +1688,18 @@ async def handle_vocabulary_topic_input(update: Update, context: CallbackContext
     logger.info(f"🎯 Vocabulary: User {update.effective_user.id} requested topic-specific words for: '{topic}'")
     
     await update.message.reply_text(f"📚 Генерирую полезные словарные слова для '{topic}'...")
-    await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
-    
-    vocabulary_words = get_topic_specific_words(topic=topic, count=10)
-    reply_markup = None
-    await send_or_edit_safe_text(update, context, vocabulary_words, reply_markup)
+    vocabulary_words = await run_with_typing(context, update.effective_chat.id, get_topic_specific_words, topic=topic, count=10)
+    # Attach the main menu to the result instead of sending it as a separate message
+    reply_markup = _MAIN_MENU_MARKUP
+    await send_or_edit_safe_text(update, context, vocabulary_words, reply_markup, use_markdown=False)
     logger.info(f"✅ Topic-specific vocabulary generated for user {update.effective_user.id}")
-    await menu_command(update, context, force_new_message=True)
+    queue_user_activity(update.effective_user.id)
 
 # --- CUSTOM WORD FUNCTIONS ---
 @require_access
 async def start_custom_word_input(update: Update, context: CallbackContext) -> int:
     """Start the custom word input process"""
-    keyboard = [
-        [InlineKeyboardButton("🔙 Назад к словарю", callback_data="menu_vocabulary")],
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    reply_markup = _BACK_TO_VOCABULARY_MARKUP
     
     await update.callback_query.edit_message_text(
         "📝 <b>Добавление собственного слова</b>\n\n"
@@ -1335,22 +1718,16 @@ async def handle_custom_word_input(update: Update, context: CallbackContext) ->
     if not word or len(word) < 2:
         await update.message.reply_text(
             "❌ Пожалуйста, введите корректное слово (минимум 2 символа).",
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("🔙 Назад к словарю", callback_data="menu_vocabulary")]
-            ])
+            reply_markup=_BACK_TO_VOCABULARY_MARKUP
         )
         return ConversationHandler.END
     
     # Check if word already exists
-    if db.word_exists_in_user_vocabulary(update.effective_user.id, word):
+    if await asyncio.to_thread(cached_word_exists, update.effective_user.id, word):
         await update.message.reply_text(
             f"⚠️ Слово '{word}' уже есть в вашем словаре!\n\n"
             f"Хотите добавить другое слово или перейти к существующему?",
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("📖 Мой словарь", callback_data="profile_vocabulary")],
-                [InlineKeyboardButton("➕ Добавить другое слово", callback_data="custom_word_add")],
-                [InlineKeyboardButton("🔙 Назад к словарю", callback_data="menu_vocabulary")]
-            ])
+            reply_markup=_WORD_EXISTS_MARKUP
         )
         return ConversationHandler.END
     
@@ -1358,26 +1735,22 @@ async def handle_custom_word_input(update: Update, context: CallbackContext) ->
     if context.user_data.get('ai_enhanced_mode'):
         # Use AI to generate word details
         await update.message.reply_text("🤖 Генерирую определение, перевод и пример для вашего слова...")
-        await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
-        
         # Generate AI-enhanced word details
-        ai_response = add_custom_word_to_dictionary(word)
+        ai_response = await run_with_typing(context, update.effective_chat.id, add_custom_word_to_dictionary, word)
         
-        # Parse the AI response to extract details
-        import re
+        # Parse the AI response to extract details; the first line with each label wins
+        fields = {}
+        for match in _AI_FIELDS_RE.finditer(ai_response):
+            fields.setdefault(match.group(1), match.group(2).strip())
         
-        definition_match = re.search(r'📖 <b>Определение:</b> (.+)', ai_response)
-        translation_match = re.search(r'🇷🇺 <b>Перевод:</b> (.+)', ai_response)
-        example_match = re.search(r'💡 <b>Пример:</b> (.+)', ai_response)
-        topic_match = re.search(r'🏷️ <b>Тема:</b> (.+)', ai_response)
-        
-        definition = definition_match.group(1).strip() if definition_match else "AI-generated definition"
-        translation = translation_match.group(1).strip() if translation_match else "AI-generated translation"
-        example = example_match.group(1).strip() if example_match else "AI-generated example"
-        topic = topic_match.group(1).strip() if topic_match else "AI-generated topic"
+        definition = fields.get('📖 <b>Определение:</b>', "AI-generated definition")
+        translation = fields.get('🇷🇺 <b>Перевод:</b>', "AI-generated translation")
+        example = fields.get('💡 <b>Пример:</b>', "AI-generated example")
+        topic = fields.get('🏷️ <b>Тема:</b>', "AI-generated topic")
         
         # Save word to database
-        success = db.save_word_to_user_vocabulary(
+        vocabulary_count = await asyncio.to_thread(
+            db.save_word_and_get_count,
             user_id=update.effective_user.id,
             word=word,
             definition=definition,
@@ -1385,31 +1758,16 @@ async def handle_custom_word_input(update: Update, context: CallbackContext) ->
             example=example,
             topic=topic
         )
+        invalidate_user(update.effective_user.id)
         
-        if success:
-            # Get updated vocabulary count
-            vocabulary_count = db.get_user_vocabulary_count(update.effective_user.id)
-            
+        if vocabulary_count is not None:
             # Create confirmation message
-            confirmation_text = f"""
-✅ <b>СЛОВО УСПЕШНО ДОБАВЛЕНО В СЛОВАРЬ (AI-улучшенное)</b>
-
-📝 <b>Слово:</b> {word}
-📖 <b>Определение:</b> {definition}
-🇷🇺 <b>Перевод:</b> {translation}
-💡 <b>Пример:</b> {example}
-🏷️ <b>Тема:</b> {topic}
-
-🎯 Слово сохранено в ваш личный словарь!
-📚 Всего слов в словаре: {vocabulary_count}
-            """.strip()
+            confirmation_text = _WORD_ADDED_TEXT.format(
+                suffix=' (AI-улучшенное)', word=word, definition=definition, translation=translation,
+                example=example, topic=topic, vocabulary_count=vocabulary_count
+            )
             
-            keyboard = [
-                [InlineKeyboardButton("📖 Мой словарь", callback_data="profile_vocabulary")],
-                [InlineKeyboardButton("🤖 Добавить еще слово с AI", callback_data="ai_enhanced_custom_word")],
-                [InlineKeyboardButton("🔙 Назад к словарю", callback_data="menu_vocabulary")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
+            reply_markup = _AI_WORD_ADDED_MARKUP
             
             await update.message.reply_text(
                 confirmation_text,
@@ -1424,9 +1782,7 @@ async def handle_custom_word_input(update: Update, context: CallbackContext) ->
         else:
             await update.message.reply_text(
                 "❌ Произошла ошибка при сохранении слова. Попробуйте позже.",
-                reply_markup=InlineKeyboardMarkup([
-                    [InlineKeyboardButton("🔙 Назад к словарю", callback_data="menu_vocabulary")]
-                ])
+                reply_markup=_BACK_TO_VOCABULARY_MARKUP
             )
         
         return ConversationHandler.END
@@ -1434,10 +1790,7 @@ async def handle_custom_word_input(update: Update, context: CallbackContext) ->
     # Store the word and ask for definition (manual mode)
     context.user_data['custom_word'] = word
     
-    keyboard = [
-        [InlineKeyboardButton("🔙 Назад к словарю", callback_data="menu_vocabulary")],
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    reply_markup = _BACK_TO_VOCABULARY_MARKUP
     
     await update.message.reply_text(
         f"📝 <b>Слово:</b> {word}\n\n"
@@ -1455,22 +1808,18 @@ async def handle_custom_word_definition(update: Update, context: CallbackContext
     if not definition or len(definition) < 5:
         await update.message.reply_text(
             "❌ Пожалуйста, введите корректное определение (минимум 5 символов).",
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("🔙 Назад к словарю", callback_data="menu_vocabulary")]
-            ])
+            reply_markup=_BACK_TO_VOCABULARY_MARKUP
         )
         return ConversationHandler.END
     
     # Store the definition and ask for translation
-    context.user_data['custom_word_definition'] = definition
+    user_data = context.user_data
+    user_data['custom_word_definition'] = definition
     
-    keyboard = [
-        [InlineKeyboardButton("🔙 Назад к словарю", callback_data="menu_vocabulary")],
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    reply_markup = _BACK_TO_VOCABULARY_MARKUP
     
     await update.message.reply_text(
-        f"📝 <b>Слово:</b> {context.user_data['custom_word']}\n"
+        f"📝 <b>Слово:</b> {user_data['custom_word']}\n"
         f"📖 <b>Определение:</b> {definition}\n\n"
         "Теперь введите перевод слова на русский язык:",
         reply_markup=reply_markup,
@@ -1486,23 +1835,19 @@ async def handle_custom_word_translation(update: Update, context: CallbackContex
     if not translation or len(translation) < 2:
         await update.message.reply_text(
             "❌ Пожалуйста, введите корректный перевод (минимум 2 символа).",
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("🔙 Назад к словарю", callback_data="menu_vocabulary")]
-            ])
+            reply_markup=_BACK_TO_VOCABULARY_MARKUP
         )
         return ConversationHandler.END
     
     # Store the translation and ask for example
-    context.user_data['custom_word_translation'] = translation
+    user_data = context.user_data
+    user_data['custom_word_translation'] = translation
     
-    keyboard = [
-        [InlineKeyboardButton("🔙 Назад к словарю", callback_data="menu_vocabulary")],
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    reply_markup = _BACK_TO_VOCABULARY_MARKUP
     
     await update.message.reply_text(
-        f"📝 <b>Слово:</b> {context.user_data['custom_word']}\n"
-        f"📖 <b>Определение:</b> {context.user_data['custom_word_definition']}\n"
+        f"📝 <b>Слово:</b> {user_data['custom_word']}\n"
+        f"📖 <b>Определение:</b> {user_data['custom_word_definition']}\n"
         f"🇷🇺 <b>Перевод:</b> {translation}\n\n"
         "Теперь введите пример предложения с этим словом:",
         reply_markup=reply_markup,
@@ -1518,24 +1863,20 @@ async def handle_custom_word_example(update: Update, context: CallbackContext) -
     if not example or len(example) < 10:
         await update.message.reply_text(
             "❌ Пожалуйста, введите корректный пример (минимум 10 символов).",
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("🔙 Назад к словарю", callback_data="menu_vocabulary")]
-            ])
+            reply_markup=_BACK_TO_VOCABULARY_MARKUP
         )
         return ConversationHandler.END
     
     # Store the example and ask for topic
-    context.user_data['custom_word_example'] = example
+    user_data = context.user_data
+    user_data['custom_word_example'] = example
     
-    keyboard = [
-        [InlineKeyboardButton("🔙 Назад к словарю", callback_data="menu_vocabulary")],
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    reply_markup = _BACK_TO_VOCABULARY_MARKUP
     
     await update.message.reply_text(
-        f"📝 <b>Слово:</b> {context.user_data['custom_word']}\n"
-        f"📖 <b>Определение:</b> {context.user_data['custom_word_definition']}\n"
-        f"🇷🇺 <b>Перевод:</b> {context.user_data['custom_word_translation']}\n"
+        f"📝 <b>Слово:</b> {user_data['custom_word']}\n"
+        f"📖 <b>Определение:</b> {user_data['custom_word_definition']}\n"
+        f"🇷🇺 <b>Перевод:</b> {user_data['custom_word_translation']}\n"
         f"💡 <b>Пример:</b> {example}\n\n"
         "Теперь введите тему для этого слова (например: 'окружающая среда', 'технологии', 'образование'):",
         reply_markup=reply_markup,
@@ -1551,20 +1892,20 @@ async def handle_custom_word_topic(update: Update, context: CallbackContext) ->
     if not topic or len(topic) < 2:
         await update.message.reply_text(
             "❌ Пожалуйста, введите корректную тему (минимум 2 символа).",
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("🔙 Назад к словарю", callback_data="menu_vocabulary")]
-            ])
+            reply_markup=_BACK_TO_VOCABULARY_MARKUP
         )
         return ConversationHandler.END
     
     # Get all the stored data
-    word = context.user_data['custom_word']
-    definition = context.user_data['custom_word_definition']
-    translation = context.user_data['custom_word_translation']
-    example = context.user_data['custom_word_example']
+    user_data = context.user_data
+    word = user_data['custom_word']
+    definition = user_data['custom_word_definition']
+    translation = user_data['custom_word_translation']
+    example = user_data['custom_word_example']
     
     # Save word to database
-    success = db.save_word_to_user_vocabulary(
+    vocabulary_count = await asyncio.to_thread(
+        db.save_word_and_get_count,
         user_id=update.effective_user.id,
         word=word,
         definition=definition,
@@ -1572,31 +1913,16 @@ async def handle_custom_word_topic(update: Update, context: CallbackContext) ->
         example=example,
         topic=topic
     )
+    invalidate_user(update.effective_user.id)
     
-    if success:
-        # Get updated vocabulary count
-        vocabulary_count = db.get_user_vocabulary_count(update.effective_user.id)
-        
+    if vocabulary_count is not None:
         # Create confirmation message
-        confirmation_text = f"""
-✅ <b>СЛОВО УСПЕШНО ДОБАВЛЕНО В СЛОВАРЬ</b>
-
-📝 <b>Слово:</b> {word}
-📖 <b>Определение:</b> {definition}
-🇷🇺 <b>Перевод:</b> {translation}
-💡 <b>Пример:</b> {example}
-🏷️ <b>Тема:</b> {topic}
-
-🎯 Слово сохранено в ваш личный словарь!
-📚 Всего слов в словаре: {vocabulary_count}
-        """.strip()
+        confirmation_text = _WORD_ADDED_TEXT.format(
+            suffix='', word=word, definition=definition, translation=translation,
+            example=example, topic=topic, vocabulary_count=vocabulary_count
+        )
         
-        keyboard = [
-            [InlineKeyboardButton("📖 Мой словарь", callback_data="profile_vocabulary")],
-            [InlineKeyboardButton("➕ Добавить еще слово", callback_data="custom_word_add")],
-            [InlineKeyboardButton("🔙 Назад к словарю", callback_data="menu_vocabulary")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        reply_markup = _CUSTOM_WORD_ADDED_MARKUP
         
         await update.message.reply_text(
             confirmation_text,
@@ -1605,18 +1931,14 @@ async def handle_custom_word_topic(update: Update, context: CallbackContext) ->
         )
         
         # Clear the stored data
-        context.user_data.pop('custom_word', None)
-        context.user_data.pop('custom_word_definition', None)
-        context.user_data.pop('custom_word_translation', None)
-        context.user_data.pop('custom_word_example', None)
+        for key in _CUSTOM_WORD_KEYS:
+            user_data.pop(key, None)
         
         logger.info(f"✅ Custom word '{word}' saved to user {update.effective_user.id}'s vocabulary")
     else:
         await update.message.reply_text(
             "❌ Произошла ошибка при сохранении слова. Попробуйте позже.",
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("🔙 Назад к словарю", callback_data="menu_vocabulary")]
-            ])
+            reply_markup=_BACK_TO_VOCABULARY_MARKUP
         )
     
     return ConversationHandler.END
@@ -1624,8 +1946,7 @@ async def handle_custom_word_topic(update: Update, context: CallbackContext) ->
 @require_access
 async def handle_custom_word_add_callback(update: Update, context: CallbackContext) -> None:
     """Handle the custom word add button callback"""
-    query = update.callback_query
-    await query.answer()
+    _ack(update, context)
     
     # Start the custom word input process
     await start_custom_word_input(update, context)
@@ -1633,8 +1954,7 @@ async def handle_custom_word_add_callback(update: Update, context: CallbackConte
 @require_access
 async def handle_custom_word_add_from_menu(update: Update, context: CallbackContext) -> None:
     """Handle custom word add from the vocabulary menu"""
-    query = update.callback_query
-    await query.answer()
+    _ack(update, context)
     
     # Start the custom word input process
     await start_custom_word_input(update, context)
@@ -1643,13 +1963,10 @@ async def handle_custom_word_add_from_menu(update: Update, context: CallbackCont
 async def handle_ai_enhanced_custom_word(update: Update, context: CallbackContext) -> int:
     """Handle AI-enhanced custom word where user provides just the word and AI fills details"""
     query = update.callback_query
-    await query.answer()
+    _ack(update, context)
     
     # Ask user to provide just the word
-    keyboard = [
-        [InlineKeyboardButton("🔙 Назад к словарю", callback_data="menu_vocabulary")],
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    reply_markup = _BACK_TO_VOCABULARY_MARKUP
     
     await query.edit_message_text(
         "🤖 <b>AI-улучшенное добавление слова</b>\n\n"
@@ -1682,10 +1999,7 @@ async def ai_custom_word_command(update: Update, context: CallbackContext) -> in
     context.user_data['ai_enhanced_mode'] = True
     
     # Ask user to provide just the word
-    keyboard = [
-        [InlineKeyboardButton("🔙 Назад в меню", callback_data="back_to_main_menu")],
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    reply_markup = _BACK_TO_MENU_MARKUP
     
     await update.message.reply_text(
         "🤖 <b>AI-улучшенное добавление слова</b>\n\n"
@@ -1702,7 +2016,7 @@ async def start_writing_task(update: Update, context: CallbackContext, force_new
     # Get writing stats for quick preview
     user = update.effective_user
     try:
-        writing_stats = db.get_user_writing_stats(user.id)
+        writing_stats = await asyncio.to_thread(cached_user_writing_stats, user.id)
         if writing_stats['total_evaluations'] > 0:
             stats_preview = f"\n\n📊 <b>Ваша статистика:</b>\n"
             stats_preview += f"• Проверок: {writing_stats['total_evaluations']}\n"
@@ -1714,13 +2028,7 @@ async def start_writing_task(update: Update, context: CallbackContext, force_new
         stats_preview = "\n\n📊 <b>Ваша статистика:</b>\n• Не удалось загрузить"
         logger.error(f"🔥 Failed to get writing stats preview: {e}")
     
-    keyboard = [
-        [InlineKeyboardButton("Задание 2 (Эссе)", callback_data="writing_task_type_2")],
-        [InlineKeyboardButton("📝 Проверить письмо", callback_data="writing_check")],
-        [InlineKeyboardButton("📊 Статистика письма", callback_data="writing_stats")],
-        [InlineKeyboardButton("🔙 Назад в меню", callback_data="back_to_main_menu")],
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    reply_markup = _WRITING_MENU_MARKUP
     
     message_text = f"✍️ <b>IELTS Writing Practice</b>{stats_preview}\n\nВыберите действие:"
     
@@ -1749,15 +2057,12 @@ async def handle_writing_task_type_callback(update: Update, context: CallbackCon
     user = update.effective_user
     
     query = update.callback_query
-    await query.answer()
+    _ack(update, context)
     task_type_choice = query.data.split('_')[-1]
     context.user_data['selected_writing_task_type'] = f"Task {task_type_choice}"
-    context.user_data['waiting_for_writing_topic'] = True
+    set_waiting(context, WaitState.WRITING_TOPIC)
     logger.info(f"🎯 User {update.effective_user.id} selected writing task type: {context.user_data['selected_writing_task_type']}")
-    keyboard = [
-        [InlineKeyboardButton("🔙 Назад к письму", callback_data="menu_writing")],
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    reply_markup = _BACK_TO_WRITING_MARKUP
     await query.edit_message_text(
         f"✅ Вы выбрали {context.user_data['selected_writing_task_type']}. Теперь, пожалуйста, расскажите мне тему для вашего письменного задания.",
         reply_markup=reply_markup
@@ -1774,9 +2079,7 @@ async def handle_writing_topic_input(update: Update, context: CallbackContext) -
     logger.info(f"🎯 Writing: User {update.effective_user.id} provided topic: '{user_topic}' for {selected_task_type}")
     
     await update.message.reply_text(f"✅ Отлично! Генерирую {selected_task_type} на тему: '{user_topic}'...")
-    await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
-    
-    writing_task = generate_ielts_writing_task(task_type=selected_task_type, topic=user_topic)
+    writing_task = await run_with_typing(context, update.effective_chat.id, generate_ielts_writing_task, task_type=selected_task_type, topic=user_topic)
     context.user_data['current_writing_task_description'] = writing_task
     
     reply_markup = None
@@ -1807,16 +2110,15 @@ async def handle_writing_submission(update: Update, context: CallbackContext) ->
     logger.info(f"🔍 Debug: Current conversation state: {context.user_data.get('_conversation_state', 'Unknown')}")
     
     await update.message.reply_text("📝 Проверяю ваше письмо, пожалуйста, подождите...")
-    await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
-    
-    feedback = evaluate_writing(writing_text=student_writing, task_description=task_description)
+    feedback = await run_with_typing(context, update.effective_chat.id, evaluate_writing, writing_text=student_writing, task_description=task_description)
     
     # Extract scores from the feedback for statistics
     scores = extract_writing_scores_from_evaluation(feedback)
     
-    # Save the evaluation to database
+    # Save the evaluation to database in the background; the feedback doesn't wait on it
     if scores['overall'] > 0:
-        success = db.save_writing_evaluation(
+        save_writing_evaluation_in_background(
+            update, context,
             user_id=update.effective_user.id,
             task_description=task_description,
             essay_text=student_writing,
@@ -1827,10 +2129,6 @@ async def handle_writing_submission(update: Update, context: CallbackContext) ->
             grammatical_range_score=scores['grammatical_range'],
             evaluation_feedback=feedback
         )
-        if success:
-            logger.info(f"✅ Writing evaluation saved to database for user {update.effective_user.id}")
-        else:
-            logger.warning(f"⚠️ Failed to save writing evaluation to database for user {update.effective_user.id}")
     
     # Display the feedback
     await send_or_edit_safe_text(update, context, feedback)
@@ -1841,16 +2139,11 @@ async def handle_writing_submission(update: Update, context: CallbackContext) ->
     context.user_data.pop('selected_writing_task_type', None)
     
     # Show completion message with options
-    completion_keyboard = [
-        [InlineKeyboardButton("📊 Посмотреть статистику", callback_data="writing_stats")],
-        [InlineKeyboardButton("✍️ Новое задание", callback_data="menu_writing")],
-        [InlineKeyboardButton("🔙 Главное меню", callback_data="back_to_main_menu")]
-    ]
-    completion_markup = InlineKeyboardMarkup(completion_keyboard)
+    completion_markup = _WRITING_TASK_DONE_MARKUP
     
     await update.message.reply_text(
         "✅ <b>Проверка письма завершена!</b>\n\n"
-        "Ваше письмо было оценено и сохранено в статистике. "
+        "Ваше письмо оценено. "
         "Вы можете посмотреть свой прогресс или начать новое задание.",
         reply_markup=completion_markup,
         parse_mode='HTML'
@@ -1872,10 +2165,7 @@ async def handle_writing_submission_fallback(update: Update, context: CallbackCo
         logger.warning(f"⚠️ Fallback: User has no writing task, ending conversation")
         await update.message.reply_text(
             "❌ Не удалось определить задание для письма. Пожалуйста, начните заново.",
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("✍️ Новое задание", callback_data="menu_writing")],
-                [InlineKeyboardButton("🔙 Главное меню", callback_data="back_to_main_menu")]
-            ])
+            reply_markup=_WRITING_RESTART_MARKUP
         )
         return ConversationHandler.END
 
@@ -1885,24 +2175,18 @@ async def handle_writing_check_callback(update: Update, context: CallbackContext
     user = update.effective_user
     
     query = update.callback_query
-    await query.answer()
+    _ack(update, context)
     
     # End any existing conversation
-    if context.user_data.get('waiting_for_writing_topic'):
-        context.user_data.pop('waiting_for_writing_topic', None)
+    clear_waiting(context, WaitState.WRITING_TOPIC)
     if context.user_data.get('selected_writing_task_type'):
         context.user_data.pop('selected_writing_task_type', None)
     if context.user_data.get('current_writing_topic'):
         context.user_data.pop('current_writing_topic', None)
     
-    keyboard = [
-        [InlineKeyboardButton("🔙 Назад к письму", callback_data="menu_writing")],
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    reply_markup = _BACK_TO_WRITING_MARKUP
     await query.edit_message_text(
-        "📝 Для проверки вашего письма мне нужна информация о задании.\n\n"
-        "Пожалуйста, опишите задание IELTS Writing Task, которое вы выполняли.\n"
-        "Например: 'Напишите эссе о преимуществах и недостатках социальных сетей'",
+        _WRITING_CHECK_PROMPT,
         reply_markup=reply_markup
     )
     
@@ -1913,23 +2197,10 @@ async def handle_writing_check_callback(update: Update, context: CallbackContext
 async def handle_speaking_command(update: Update, context: CallbackContext, force_new_message=False) -> None:
     if force_new_message:
         chat_id = update.effective_chat.id if update.effective_chat else update.callback_query.message.chat_id
-        keyboard = [
-            [InlineKeyboardButton("🎯 Полная симуляция экзамена", callback_data="full_speaking_sim")],
-            [InlineKeyboardButton("Part 1: Короткие вопросы", callback_data="speaking_part_1")],
-            [InlineKeyboardButton("Part 2: Карточка-монолог", callback_data="speaking_part_2")],
-            [InlineKeyboardButton("Part 3: Дискуссия", callback_data="speaking_part_3")],
-            [InlineKeyboardButton("📊 История симуляций", callback_data="speaking_history")],
-            [InlineKeyboardButton("📈 Статистика прогресса", callback_data="speaking_stats")],
-            [InlineKeyboardButton("🔙 Назад в меню", callback_data="back_to_main_menu")],
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        reply_markup = _SPEAKING_COMMAND_MARKUP
         await context.bot.send_message(
             chat_id=chat_id, 
-            text="🗣️ <b>IELTS Speaking Practice</b>\n\n"
-                 "Выберите режим практики:\n\n"
-                 "🎯 <b>Полная симуляция</b> - пройдите все три части экзамена подряд\n"
-                 "📋 <b>Отдельные части</b> - практикуйте конкретную часть\n"
-                 "📊 <b>Аналитика</b> - отслеживайте свой прогресс",
+            text=_SPEAKING_PROMPT,
             parse_mode='HTML',
             reply_markup=reply_markup
         )
@@ -1940,21 +2211,9 @@ async def handle_speaking_command(update: Update, context: CallbackContext, forc
         target = update.callback_query.message
     else:
         return
-    keyboard = [
-        [InlineKeyboardButton("🎯 Полная симуляция экзамена", callback_data="full_speaking_sim")],
-        [InlineKeyboardButton("Part 1: Короткие вопросы", callback_data="speaking_part_1")],
-        [InlineKeyboardButton("Part 2: Карточка-монолог", callback_data="speaking_part_2")],
-        [InlineKeyboardButton("Part 3: Дискуссия", callback_data="speaking_part_3")],
-        [InlineKeyboardButton("📈 Статистика прогресса", callback_data="speaking_stats")],
-        [InlineKeyboardButton("🔙 Назад в меню", callback_data="back_to_main_menu")],
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    reply_markup = _SPEAKING_MENU_MARKUP
     await target.reply_text(
-        "🗣️ <b>IELTS Speaking Practice</b>\n\n"
-        "Выберите режим практики:\n\n"
-        "🎯 <b>Полная симуляция</b> - пройдите все три части экзамена подряд\n"
-        "📋 <b>Отдельные части</b> - практикуйте конкретную часть\n"
-        "📊 <b>Аналитика</b> - отслеживайте свой прогресс",
+        _SPEAKING_PROMPT,
         parse_mode='HTML',
         reply_markup=reply_markup
     )
@@ -1965,15 +2224,14 @@ async def speaking_part_callback(update: Update, context: CallbackContext) -> No
     user = update.effective_user
     
     query = update.callback_query
-    await query.answer()
     part_data = query.data
     part_number_str = part_data.split('_')[-1]
     part_for_api = f"Part {part_number_str}"
     context.user_data['current_speaking_part'] = part_for_api
     
-    await query.edit_message_text(text=f"Отлично! 👍 Генерирую вопросы для {part_for_api}...")
-    await context.bot.send_chat_action(chat_id=query.message.chat_id, action="typing")
-    speaking_prompt = generate_speaking_question(part=part_for_api)
+    # Not cached for long: the "skip question" button re-sends the same callback data
+    await query.answer(text=f"👍 Генерирую вопросы для {part_for_api}...", cache_time=CALLBACK_CACHE_TIME)
+    speaking_prompt = await run_with_typing(context, query.message.chat_id, generate_speaking_question, part=part_for_api)
     
     # Store the speaking prompt for later evaluation
     context.user_data['current_speaking_prompt'] = speaking_prompt
@@ -2010,7 +2268,7 @@ async def speaking_part_callback(update: Update, context: CallbackContext) -> No
         )
     
     # Set user state to expect confirmation (NOT voice message yet)
-    context.user_data['waiting_for_speaking_confirmation'] = True
+    set_waiting(context, WaitState.SPEAKING_CONFIRMATION)
     logger.info(f"🎤 User {user.id} viewing speaking question for {part_for_api}, awaiting confirmation")
 
 @require_access
@@ -2018,7 +2276,7 @@ async def handle_voice_confirmation(update: Update, context: CallbackContext) ->
     """Handle voice recording confirmation"""
     user = update.effective_user
     query = update.callback_query
-    await query.answer()
+    _ack(update, context)
     
     # Extract part number from callback data
     part_number = query.data.split('_')[-1]
@@ -2028,17 +2286,7 @@ async def handle_voice_confirmation(update: Update, context: CallbackContext) ->
     speaking_prompt = context.user_data.get('current_speaking_prompt', 'No prompt available')
     
     # Voice response instructions
-    voice_instructions = (
-        f"{speaking_prompt}\n\n"
-        f"🎤 <b>ГОЛОСОВОЙ ОТВЕТ АКТИВИРОВАН</b>\n\n"
-        f"✅ Теперь запишите голосовое сообщение с вашим ответом на английском языке.\n"
-        f"🔊 Бот автоматически транскрибирует речь и оценит ваш ответ по шкале IELTS (1-9)!\n\n"
-        f"💡 <i>Говорите четко и уверенно, как на настоящем экзамене IELTS.</i>\n\n"
-        f"⏱️ <b>Рекомендуемое время:</b>\n"
-        f"• Part 1: 30-60 секунд на вопрос\n"
-        f"• Part 2: 1-2 минуты\n"
-        f"• Part 3: 30-90 секунд на вопрос"
-    )
+    voice_instructions = f"{speaking_prompt}\n\n{_VOICE_INSTRUCTIONS}"
     
     reply_markup = InlineKeyboardMarkup([
         [InlineKeyboardButton("❌ Отменить запись", callback_data=f"speaking_part_{part_number}")],
@@ -2061,8 +2309,8 @@ async def handle_voice_confirmation(update: Update, context: CallbackContext) ->
         )
     
     # NOW enable voice message recording
-    context.user_data['waiting_for_voice_response'] = True
-    context.user_data.pop('waiting_for_speaking_confirmation', None)
+    set_waiting(context, WaitState.VOICE_RESPONSE)
+    clear_waiting(context, WaitState.SPEAKING_CONFIRMATION)
     logger.info(f"🎤 User {user.id} confirmed voice recording for {part_for_api}")
 
 # --- IELTS INFO ---
@@ -2070,18 +2318,8 @@ async def handle_voice_confirmation(update: Update, context: CallbackContext) ->
 async def handle_info_command(update: Update, context: CallbackContext, force_new_message=False) -> None:
     if force_new_message:
         chat_id = update.effective_chat.id if update.effective_chat else update.callback_query.message.chat_id
-        keyboard = [
-            [InlineKeyboardButton("🎧 Listening - True/False", callback_data="info_listening_truefalse")],
-            [InlineKeyboardButton("🎧 Listening - Multiple Choice", callback_data="info_listening_multiplechoice")],
-            [InlineKeyboardButton("🎧 Listening - Note Completion", callback_data="info_listening_notes")],
-            [InlineKeyboardButton("📖 Reading - Short Answer", callback_data="info_reading_shortanswer")],
-            [InlineKeyboardButton("📖 Reading - True/False/NG", callback_data="info_reading_truefalse")],
-            [InlineKeyboardButton("📖 Reading - Multiple Choice", callback_data="info_reading_multiplechoice")],
-            [InlineKeyboardButton("📖 Reading - Matching Headings", callback_data="info_reading_headings")],
-            [InlineKeyboardButton("📖 Reading - Summary Completion", callback_data="info_reading_summary")],
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await context.bot.send_message(chat_id=chat_id, text="ℹ️ Choose the specific IELTS task type you want strategies for:", reply_markup=reply_markup)
+        reply_markup = _INFO_SECTIONS_MARKUP
+        await context.bot.send_message(chat_id=chat_id, text=_INFO_PROMPT, reply_markup=reply_markup)
         return
     if update.message:
         target = update.message
@@ -2089,18 +2327,8 @@ async def handle_info_command(update: Update, context: CallbackContext, force_ne
         target = update.callback_query.message
     else:
         return
-    keyboard = [
-        [InlineKeyboardButton("🎧 Listening - True/False", callback_data="info_listening_truefalse")],
-        [InlineKeyboardButton("🎧 Listening - Multiple Choice", callback_data="info_listening_multiplechoice")],
-        [InlineKeyboardButton("🎧 Listening - Note Completion", callback_data="info_listening_notes")],
-        [InlineKeyboardButton("📖 Reading - Short Answer", callback_data="info_reading_shortanswer")],
-        [InlineKeyboardButton("📖 Reading - True/False/NG", callback_data="info_reading_truefalse")],
-        [InlineKeyboardButton("📖 Reading - Multiple Choice", callback_data="info_reading_multiplechoice")],
-        [InlineKeyboardButton("📖 Reading - Matching Headings", callback_data="info_reading_headings")],
-        [InlineKeyboardButton("📖 Reading - Summary Completion", callback_data="info_reading_summary")],
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await target.reply_text("ℹ️ Choose the specific IELTS task type you want strategies for:", reply_markup=reply_markup)
+    reply_markup = _INFO_SECTIONS_MARKUP
+    await target.reply_text(_INFO_PROMPT, reply_markup=reply_markup)
 
 @require_access
 async def info_section_callback(update: Update, context: CallbackContext) -> None:
@@ -2108,7 +2336,7 @@ async def info_section_callback(update: Update, context: CallbackContext) -> Non
     user = update.effective_user
     
     query = update.callback_query
-    await query.answer()
+    _ack(update, context, cache_time=STATIC_CALLBACK_CACHE_TIME)
     
     # Extract section and task type from callback data
     # Format: info_listening_truefalse -> section: listening, task_type: truefalse
@@ -2133,30 +2361,29 @@ async def info_section_callback(update: Update, context: CallbackContext) -> Non
     section_name = section.capitalize()
     
     await query.edit_message_text(text=f"Great! Fetching strategies for {section_name} - {task_name}...")
-    await context.bot.send_chat_action(chat_id=query.message.chat_id, action="typing")
-
-    strategies_text = generate_ielts_strategies(section=section, task_type=task_type)
+    strategies_text = await run_with_typing(context, query.message.chat_id, get_ielts_strategies_cached, section, task_type)
     
     # Format the strategies text for better mobile display
     formatted_strategies = format_info_text(strategies_text)
-    reply_markup = None
+    # Attach the main menu to the result instead of sending it as a separate message
+    reply_markup = _MAIN_MENU_MARKUP
     
     await query.edit_message_text(
         text=formatted_strategies,
         parse_mode='HTML',
         reply_markup=reply_markup
     )
-    await menu_command(update, context, force_new_message=True)
+    queue_user_activity(update.effective_user.id)
 
 # --- GRAMMAR (Conversation) ---
 @require_access
 async def start_grammar_explanation(update: Update, context: CallbackContext, force_new_message=False) -> int:
     if force_new_message:
         chat_id = update.effective_chat.id if update.effective_chat else update.callback_query.message.chat_id
-        context.user_data['waiting_for_grammar_topic'] = True
+        set_waiting(context, WaitState.GRAMMAR_TOPIC)
         await context.bot.send_message(
             chat_id=chat_id,
-            text="📖 Какую грамматическую тему вы хотите объяснить?\n\nНапример: 'Present Perfect', 'использование артиклей' или 'фразовые глаголы'."
+            text=_GRAMMAR_PROMPT
         )
         return GET_GRAMMAR_TOPIC
     if update.message:
@@ -2166,10 +2393,9 @@ async def start_grammar_explanation(update: Update, context: CallbackContext, fo
     else:
         return
     logger.info(f"🎯 Grammar command triggered by user {update.effective_user.id}")
-    context.user_data['waiting_for_grammar_topic'] = True
+    set_waiting(context, WaitState.GRAMMAR_TOPIC)
     await target.reply_text(
-        "📖 Какую грамматическую тему вы хотите объяснить?\n\n"
-        "Например: 'Present Perfect', 'использование артиклей' или 'фразовые глаголы'."
+        _GRAMMAR_PROMPT
     )
     logger.info(f"✅ Grammar prompt sent to user {update.effective_user.id}, returning state {GET_GRAMMAR_TOPIC}")
     return GET_GRAMMAR_TOPIC
@@ -2179,26 +2405,26 @@ async def get_grammar_topic(update: Update, context: CallbackContext) -> int:
     grammar_topic = update.message.text
     context.user_data['current_grammar_topic'] = grammar_topic
     # Clear the waiting flag to prevent conflicts with global handler
-    context.user_data.pop('waiting_for_grammar_topic', None)
+    clear_waiting(context, WaitState.GRAMMAR_TOPIC)
     logger.info(f"🎯 Grammar (Conversation Handler): User {update.effective_user.id} requested explanation for: '{grammar_topic}'")
     
     await update.message.reply_text(f"Конечно! Генерирую объяснение для '{grammar_topic}'...")
-    await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
-    explanation = explain_grammar_structure(grammar_topic=grammar_topic)
+    explanation = await run_with_typing(context, update.effective_chat.id, explain_grammar_structure_cached, grammar_topic)
     
     # Format the explanation for HTML
     formatted_explanation = format_grammar_text(explanation)
     logger.info(f"🔍 Formatted explanation: {formatted_explanation[:200]}...")
     
-    reply_markup = None
+    # Attach the main menu to the result instead of sending it as a separate message
+    reply_markup = _MAIN_MENU_MARKUP
     # Check if the explanation is empty
     if not formatted_explanation.strip():
-        await update.message.reply_text("❌ Sorry, I couldn't generate an explanation for this grammar topic.")
+        await update.message.reply_text("❌ Sorry, I couldn't generate an explanation for this grammar topic.", reply_markup=reply_markup)
     else:
         # Use HTML parse mode for better formatting
         await send_long_message(update, context, formatted_explanation, reply_markup, parse_mode='HTML')
     logger.info(f"✅ Grammar explanation generated for user {update.effective_user.id}, ending conversation")
-    await menu_command(update, context, force_new_message=True)
+    queue_user_activity(update.effective_user.id)
     return ConversationHandler.END
 
 @require_access
@@ -2209,22 +2435,22 @@ async def handle_grammar_topic_input(update: Update, context: CallbackContext) -
     logger.info(f"🎯 Grammar (Global Handler): User {update.effective_user.id} requested explanation for: '{grammar_topic}'")
     
     await update.message.reply_text(f"Конечно! Генерирую объяснение для '{grammar_topic}'...")
-    await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
-    explanation = explain_grammar_structure(grammar_topic=grammar_topic)
+    explanation = await run_with_typing(context, update.effective_chat.id, explain_grammar_structure_cached, grammar_topic)
     
     # Format the explanation for HTML
     formatted_explanation = format_grammar_text(explanation)
     logger.info(f"🔍 Formatted explanation: {formatted_explanation[:200]}...")
     
-    reply_markup = None
+    # Attach the main menu to the result instead of sending it as a separate message
+    reply_markup = _MAIN_MENU_MARKUP
     # Check if the explanation is empty
     if not formatted_explanation.strip():
-        await update.message.reply_text("❌ Sorry, I couldn't generate an explanation for this grammar topic.")
+        await update.message.reply_text("❌ Sorry, I couldn't generate an explanation for this grammar topic.", reply_markup=reply_markup)
     else:
         # Use HTML parse mode for better formatting
         await send_long_message(update, context, formatted_explanation, reply_markup, parse_mode='HTML')
     logger.info(f"✅ Grammar explanation generated for user {update.effective_user.id}")
-    await menu_command(update, context, force_new_message=True)
+    queue_user_activity(update.effective_user.id)
 
 @require_access
 async def handle_writing_check_task_input(update: Update, context: CallbackContext) -> int:
@@ -2234,12 +2460,9 @@ async def handle_writing_check_task_input(update: Update, context: CallbackConte
     logger.info(f"🎯 Writing Check Task: User {update.effective_user.id} provided task: '{task_description}'")
     
     # Set the user in writing check essay mode for global handler
-    context.user_data['waiting_for_writing_check_essay'] = True
+    set_waiting(context, WaitState.WRITING_CHECK_ESSAY)
     
-    keyboard = [
-        [InlineKeyboardButton("🔙 Назад к письму", callback_data="menu_writing")],
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    reply_markup = _BACK_TO_WRITING_MARKUP
     await update.message.reply_text(
         f"✅ Задание получено: '{task_description}'\n\n"
         "Теперь пожалуйста, вставьте ваше эссе для проверки:",
@@ -2257,16 +2480,15 @@ async def handle_writing_check_essay_input(update: Update, context: CallbackCont
     logger.info(f"🎯 Writing Check Essay: User {user.id} submitted essay for evaluation")
     
     await update.message.reply_text("📝 Проверяю ваше письмо, пожалуйста, подождите...")
-    await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
-    
-    feedback = evaluate_writing(writing_text=essay_text, task_description=task_description)
+    feedback = await run_with_typing(context, update.effective_chat.id, evaluate_writing, writing_text=essay_text, task_description=task_description)
     
     # Extract scores from the feedback
     scores = extract_writing_scores_from_evaluation(feedback)
     
-    # Save the evaluation to database
+    # Save the evaluation to database in the background; the feedback doesn't wait on it
     if scores['overall'] > 0:
-        success = db.save_writing_evaluation(
+        save_writing_evaluation_in_background(
+            update, context,
             user_id=user.id,
             task_description=task_description,
             essay_text=essay_text,
@@ -2277,10 +2499,6 @@ async def handle_writing_check_essay_input(update: Update, context: CallbackCont
             grammatical_range_score=scores['grammatical_range'],
             evaluation_feedback=feedback
         )
-        if success:
-            logger.info(f"✅ Writing evaluation saved to database for user {user.id}")
-        else:
-            logger.warning(f"⚠️ Failed to save writing evaluation to database for user {user.id}")
     
     # Use send_or_edit_safe_text to ensure proper markdown formatting with fallback
     reply_markup = None
@@ -2291,16 +2509,11 @@ async def handle_writing_check_essay_input(update: Update, context: CallbackCont
     context.user_data.pop('current_writing_check_task', None)
     
     # Show completion message with options
-    completion_keyboard = [
-        [InlineKeyboardButton("📊 Посмотреть статистику", callback_data="writing_stats")],
-        [InlineKeyboardButton("📝 Проверить еще одно письмо", callback_data="writing_check")],
-        [InlineKeyboardButton("🔙 Главное меню", callback_data="back_to_main_menu")]
-    ]
-    completion_markup = InlineKeyboardMarkup(completion_keyboard)
+    completion_markup = _WRITING_CHECK_DONE_MARKUP
     
     await update.message.reply_text(
         "✅ <b>Проверка письма завершена!</b>\n\n"
-        "Ваше письмо было оценено и сохранено в статистике. "
+        "Ваше письмо оценено. "
         "Вы можете посмотреть свой прогресс или проверить другое письмо.",
         reply_markup=completion_markup,
         parse_mode='HTML'
@@ -2314,95 +2527,60 @@ async def handle_global_text_input(update: Update, context: CallbackContext) ->
     user = update.effective_user
     
     text = update.message.text
-    logger.info(f"🔍 Global text input handler called for user {user.id} with text: '{text[:50]}...'")
-    
-    # Check if user is in vocabulary topic selection mode
-    if context.user_data.get('waiting_for_vocabulary_topic'):
-        logger.info(f"📚 User {user.id} is in vocabulary topic selection mode")
-        context.user_data.pop('waiting_for_vocabulary_topic', None)
-        await handle_vocabulary_topic_input(update, context)
-        return
-    
-    # Check if user is in grammar topic selection mode  
-    if context.user_data.get('waiting_for_grammar_topic'):
-        logger.info(f"📖 User {user.id} is in grammar topic selection mode")
-        context.user_data.pop('waiting_for_grammar_topic', None)
-        await handle_grammar_topic_input(update, context)
-        return
-    
-    # Check if user is in writing topic selection mode
-    if context.user_data.get('waiting_for_writing_topic'):
-        logger.info(f"✍️ User {user.id} is in writing topic selection mode")
-        context.user_data.pop('waiting_for_writing_topic', None)
-        await handle_writing_topic_input(update, context)
-        return
-    
-    # Check if user is in writing check mode (for menu-based access)
-    if context.user_data.get('waiting_for_writing_check_task'):
-        logger.info(f"📝 User {user.id} is in writing check task mode (global)")
-        context.user_data.pop('waiting_for_writing_check_task', None)
-        await handle_writing_check_task_input(update, context)
-        return
-    
-    # Check if user is in writing check essay mode (for menu-based access)
-    if context.user_data.get('waiting_for_writing_check_essay'):
-        logger.info(f"📝 User {user.id} is in writing check essay mode (global)")
-        context.user_data.pop('waiting_for_writing_check_essay', None)
-        await handle_writing_check_essay_input(update, context)
-        return
+    logger.debug("🔍 Global text input handler called for user %s with text: %r", user.id, text[:50])
+    
+    # Route to the handler of the pending input mode, if any (first matching flag wins)
+    wait = context.user_data.get('wait', WaitState.NONE)
+    if wait & _TEXT_MODE_MASK:
+        for state, handler in _TEXT_MODE_DISPATCH:
+            if wait & state:
+                clear_waiting(context, state)
+                logger.debug("🔍 User %s text routed to %s", user.id, handler.__name__)
+                await handler(update, context)
+                return
     
     # Check if user is in writing submission mode (for conversation handler access)
     if context.user_data.get('current_writing_task_description'):
-        logger.info(f"✍️ User {user.id} is in writing submission mode (global) - task: '{context.user_data['current_writing_task_description'][:50]}...'")
-        logger.info(f"🔍 Debug: Global handler processing writing submission")
-        logger.info(f"🔍 Debug: User data keys: {list(context.user_data.keys())}")
-        logger.info(f"🔍 Debug: Processing via global handler (conversation handler may have failed)")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("✍️ User %s is in writing submission mode (global) - task: %r",
+                         user.id, context.user_data['current_writing_task_description'][:50])
+            logger.debug("🔍 Debug: User data keys: %s", list(context.user_data.keys()))
+            logger.debug("🔍 Debug: Processing via global handler (conversation handler may have failed)")
         await handle_writing_submission(update, context)
         return
     
     # Additional check: if user has writing topic but no task description, they might be in the middle of generation
     if context.user_data.get('current_writing_topic') and not context.user_data.get('current_writing_task_description'):
-        logger.info(f"🔄 User {user.id} has writing topic but no task yet - waiting for generation")
+        logger.debug("🔄 User %s has writing topic but no task yet - waiting for generation", user.id)
         await update.message.reply_text(
             "⏳ Пожалуйста, подождите, пока генерируется задание для письма...",
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("🔙 Назад к письму", callback_data="menu_writing")]
-            ])
+            reply_markup=_BACK_TO_WRITING_MARKUP
         )
         return
     
-    # Check if admin is searching for users
-    if context.user_data.get('waiting_for_admin_search'):
-        logger.info(f"🔍 Admin {user.id} is searching for users")
-        context.user_data.pop('waiting_for_admin_search', None)
-        await handle_admin_search_input(update, context)
-        return
-    
     # If not in any specific mode, check if this might be a writing submission
     # This is a safety net for when the conversation handler fails
     if len(update.message.text) > 50:  # Likely an essay submission
-        logger.info(f"🔍 User {user.id} sent long text ({len(update.message.text)} chars) - checking if it's a writing submission")
+        logger.debug("🔍 User %s sent long text (%d chars) - checking if it's a writing submission", user.id, len(update.message.text))
         
         # Check if user has any writing-related data
         if (context.user_data.get('current_writing_topic') or 
             context.user_data.get('selected_writing_task_type') or
             context.user_data.get('current_writing_task_description')):
             
-            logger.info(f"✅ Long text detected with writing context - treating as writing submission")
+            logger.debug("✅ Long text detected with writing context - treating as writing submission")
             if context.user_data.get('current_writing_task_description'):
                 await handle_writing_submission(update, context)
             else:
                 await update.message.reply_text(
                     "⏳ Задание для письма еще генерируется. Пожалуйста, подождите...",
-                    reply_markup=InlineKeyboardMarkup([
-                        [InlineKeyboardButton("🔙 Назад к письму", callback_data="menu_writing")]
-                    ])
+                    reply_markup=_BACK_TO_WRITING_MARKUP
                 )
             return
     
     # If not in any specific mode, ignore the text
     # This prevents the global handler from interfering with conversation handlers
-    logger.info(f"❌ User {user.id} not in any specific mode, ignoring text input")
+    logger.debug("❌ User %s not in any specific mode, ignoring text input", user.id)
     return
 
 # --- GLOBAL CANCEL & ERROR HANDLER ---
@@ -2415,6 +2593,7 @@ async def debug_conversation_state(update: Update, context: CallbackContext) ->
     user = update.effective_user
     logger.info(f"🔍 Debug: User {user.id} conversation state check")
     logger.info(f"🔍 Debug: User data keys: {list(context.user_data.keys())}")
+    logger.info(f"🔍 Debug: Wait state: {context.user_data.get('wait', WaitState.NONE)!r}")
     logger.info(f"🔍 Debug: Current writing topic: {context.user_data.get('current_writing_topic', 'None')}")
     logger.info(f"🔍 Debug: Current writing task: {context.user_data.get('current_writing_task_description', 'None')[:100] if context.user_data.get('current_writing_task_description') else 'None'}")
     
@@ -2438,13 +2617,10 @@ async def handle_voice_message(update: Update, context: CallbackContext) -> None
     user = update.effective_user
     
     # Check if user is expecting a voice response
-    if not context.user_data.get('waiting_for_voice_response'):
+    if not is_waiting(context, WaitState.VOICE_RESPONSE):
         await update.message.reply_text(
             "🎤 Чтобы записать голосовой ответ, сначала выберите задание по говорению в меню.",
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("🗣️ Говорение", callback_data="menu_speaking")],
-                [InlineKeyboardButton("📋 Главное меню", callback_data="back_to_main_menu")],
-            ])
+            reply_markup=_SPEAKING_START_MARKUP
         )
         return
     
@@ -2465,10 +2641,11 @@ async def handle_voice_message(update: Update, context: CallbackContext) -> None
         voice_file = await context.bot.get_file(voice.file_id)
         file_url = voice_file.file_path
         
-        logger.info(f"🎤 Processing voice message from user {user.id}. Duration: {voice.duration}s")
+        logger.debug("🎤 Processing voice message from user %s. Duration: %ss", user.id, voice.duration)
         
-        # Transcribe the voice message
-        transcription = await audio_processor.process_voice_message(file_url)
+        # Transcribe the voice message (bounded, since this handler runs non-blocking)
+        async with _transcription_semaphore:
+            transcription = await audio_processor.process_voice_message(file_url)
         
         if not transcription:
             # Check if it's due to Eleven Labs not being available
@@ -2476,18 +2653,13 @@ async def handle_voice_message(update: Update, context: CallbackContext) -> None
                 await processing_message.edit_text(
                     "❌ Функция распознавания речи недоступна.\n"
                     "Обратитесь к администратору для настройки API ключа Eleven Labs.",
-                    reply_markup=InlineKeyboardMarkup([
-                        [InlineKeyboardButton("📋 Главное меню", callback_data="back_to_main_menu")],
-                    ])
+                    reply_markup=_MAIN_MENU_ONLY_MARKUP
                 )
             else:
                 await processing_message.edit_text(
                     "❌ Не удалось распознать речь в голосовом сообщении.\n"
                     "Попробуйте записать сообщение еще раз, говоря четче.",
-                    reply_markup=InlineKeyboardMarkup([
-                        [InlineKeyboardButton("🔄 Попробовать снова", callback_data="menu_speaking")],
-                        [InlineKeyboardButton("📋 Главное меню", callback_data="back_to_main_menu")],
-                    ])
+                    reply_markup=_SPEAKING_RETRY_MARKUP
                 )
             return
         
@@ -2495,16 +2667,10 @@ async def handle_voice_message(update: Update, context: CallbackContext) -> None
         speaking_prompt = context.user_data.get('current_speaking_prompt', 'Unknown prompt')
         speaking_part = context.user_data.get('current_speaking_part', 'Part 1')
         
-        logger.info(f"🎤 Transcription successful for user {user.id}. Length: {len(transcription)} chars")
+        logger.debug("🎤 Transcription successful for user %s. Length: %d chars", user.id, len(transcription))
         
-        # Update processing message
-        await processing_message.edit_text(
-            "✅ Речь распознана успешно!\n"
-            "🤖 Анализирую ваш ответ по критериям IELTS..."
-        )
-        
-        # Evaluate the speaking response
-        evaluation = evaluate_speaking_response(speaking_prompt, transcription, speaking_part)
+        # Evaluate the speaking response (blocking Gemini call, keep it off the event loop)
+        evaluation = await asyncio.to_thread(evaluate_speaking_response, speaking_prompt, transcription, speaking_part)
         
         # Prepare final response
         final_response = (
@@ -2514,67 +2680,52 @@ async def handle_voice_message(update: Update, context: CallbackContext) -> None
         )
         
         # Create reply markup
-        reply_markup = InlineKeyboardMarkup([
-            [InlineKeyboardButton("🔄 Попробовать еще раз", callback_data="menu_speaking")],
-            [InlineKeyboardButton("📋 Главное меню", callback_data="back_to_main_menu")],
-        ])
+        reply_markup = _SPEAKING_FINAL_MARKUP
         
-        # Send the evaluation as single message (Telegram limit is 4096 chars)
+        # Turn the processing message into the evaluation (Telegram limit is 4096 chars)
         try:
-            await update.message.reply_text(
+            await processing_message.edit_text(
                 text=final_response, 
                 parse_mode='HTML', 
                 reply_markup=reply_markup
             )
         except Exception as e:
             # If message is too long, truncate the transcription and try again
-            logger.warning(f"Message too long, truncating: {e}")
+            logger.warning("Message too long, truncating: %s", e)
             truncated_transcription = transcription[:100] + "..." if len(transcription) > 100 else transcription
             final_response_short = (
                 f"🎤 <b>ВАША РЕЧЬ:</b>\n"
                 f"<i>«{truncated_transcription}»</i>\n\n"
                 f"{evaluation}"
             )
-            await update.message.reply_text(
+            await processing_message.edit_text(
                 text=final_response_short, 
                 parse_mode='HTML', 
                 reply_markup=reply_markup
             )
         
         # Clear voice response state
-        context.user_data.pop('waiting_for_voice_response', None)
+        clear_waiting(context, WaitState.VOICE_RESPONSE)
         context.user_data.pop('current_speaking_prompt', None)
         context.user_data.pop('current_speaking_part', None)
         
-        logger.info(f"✅ Voice message evaluation completed for user {user.id}")
-        
-        # Delete the processing message
-        try:
-            await processing_message.delete()
-        except:
-            pass  # Ignore if message already deleted or can't be deleted
+        logger.debug("✅ Voice message evaluation completed for user %s", user.id)
         
     except Exception as e:
-        logger.error(f"🔥 Error processing voice message for user {user.id}: {e}")
+        logger.error("🔥 Error processing voice message for user %s: %s", user.id, e)
         
         try:
             await processing_message.edit_text(
                 "❌ Произошла ошибка при обработке голосового сообщения.\n"
                 "Попробуйте еще раз позже.",
-                reply_markup=InlineKeyboardMarkup([
-                    [InlineKeyboardButton("🔄 Попробовать снова", callback_data="menu_speaking")],
-                    [InlineKeyboardButton("📋 Главное меню", callback_data="back_to_main_menu")],
-                ])
+                reply_markup=_SPEAKING_RETRY_MARKUP
             )
         except:
             # If we can't edit the processing message, send a new one
             await update.message.reply_text(
                 "❌ Произошла ошибка при обработке голосового сообщения.\n"
                 "Попробуйте еще раз позже.",
-                reply_markup=InlineKeyboardMarkup([
-                    [InlineKeyboardButton("🔄 Попробовать снова", callback_data="menu_speaking")],
-                    [InlineKeyboardButton("📋 Главное меню", callback_data="back_to_main_menu")],
-                ])
+                reply_markup=_SPEAKING_RETRY_MARKUP
             )
 
 # --- Full Speaking Simulation Functions ---
@@ -2599,7 +2750,6 @@ async def display_single_question(update: Update, context: CallbackContext) -> N
 
     # Helpers
     def pick_topic_for_question(user_id: int, part: int) -> str:
-        import random
         pool = part1_pool if part == 1 else part3_pool if part == 3 else ['general']
         recent_topics = set(db.get_recent_topics(user_id, part, window_days=30))
         candidates = [t for t in pool if t not in used_topics.get(part, set()) and t not in recent_topics]
@@ -2634,11 +2784,7 @@ async def display_single_question(update: Update, context: CallbackContext) -> N
     question_text = format_question_display(current_part, question_num, total_questions, question)
     
     # Create navigation buttons
-    keyboard = [
-        [InlineKeyboardButton("⏭ Пропустить вопрос", callback_data="skip_question")],
-        [InlineKeyboardButton("❌ Выйти из симуляции", callback_data="abandon_full_sim")]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    reply_markup = _SIM_QUESTION_MARKUP
     
     # Send question
     if update.callback_query:
@@ -2725,7 +2871,6 @@ async def move_to_next_part(update: Update, context: CallbackContext) -> int:
             await update.callback_query.edit_message_text(transition_msg, parse_mode='HTML')
         
         # Small delay for better UX
-        import asyncio
         await asyncio.sleep(1)
         
         await display_single_question(update, context)
@@ -2742,7 +2887,7 @@ def get_current_state(part_number: int) -> int:
 async def handle_skip_question(update: Update, context: CallbackContext) -> int:
     """Handle skipping current question"""
     query = update.callback_query
-    await query.answer()
+    _ack(update, context)
     
     current_part = context.user_data.get('current_part', 1)
     current_question = context.user_data.get('current_question_in_part', 1)
@@ -2756,7 +2901,6 @@ async def handle_skip_question(update: Update, context: CallbackContext) -> int:
     await query.edit_message_text("⏭ <b>Вопрос пропущен.</b>\n\nПереходим к следующему...", parse_mode='HTML')
     
     # Small delay for better UX
-    import asyncio
     await asyncio.sleep(1)
     
     return await move_to_next_question(update, context)
@@ -2764,7 +2908,7 @@ async def handle_skip_question(update: Update, context: CallbackContext) -> int:
 async def handle_retry_question(update: Update, context: CallbackContext) -> int:
     """Handle retrying current question"""
     query = update.callback_query
-    await query.answer()
+    _ack(update, context)
     
     await query.edit_message_text(
         "🔄 <b>Попробуем еще раз!</b>\n\n<i>Покажу вопрос заново...</i>", 
@@ -2772,7 +2916,6 @@ async def handle_retry_question(update: Update, context: CallbackContext) -> int
     )
     
     # Small delay for better UX
-    import asyncio
     await asyncio.sleep(1)
     
     # Redisplay current question
@@ -2805,22 +2948,20 @@ async def start_full_speaking_simulation(update: Update, context: CallbackContex
         return ConversationHandler.END
     
     query = update.callback_query
-    await query.answer()
+    _ack(update, context)
     
     try:
         # Create database session
         session_id = db.create_speaking_simulation(user.id)
+        invalidate_user(user.id)
         if not session_id:
             await query.edit_message_text(
                 "❌ Не удалось создать сессию симуляции. Попробуйте позже.",
-                reply_markup=InlineKeyboardMarkup([
-                    [InlineKeyboardButton("🔙 Назад", callback_data="menu_speaking")]
-                ])
+                reply_markup=_BACK_TO_SPEAKING_MARKUP
             )
             return ConversationHandler.END
         
         # Initialize simulation context with question-based structure
-        import time
         context.user_data.update({
             'full_simulation_mode': True,
             'simulation_session_id': session_id,
@@ -2853,7 +2994,6 @@ async def start_full_speaking_simulation(update: Update, context: CallbackContex
         await query.edit_message_text(start_message, parse_mode='HTML')
         
         # Small delay for better UX
-        import asyncio
         await asyncio.sleep(2)
         
         # Display first question
@@ -2866,9 +3006,7 @@ async def start_full_speaking_simulation(update: Update, context: CallbackContex
         logger.error(f"🔥 Error starting full simulation for user {user.id}: {e}")
         await query.edit_message_text(
             "❌ Произошла ошибка при запуске симуляции. Попробуйте позже.",
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("🔙 Назад", callback_data="menu_speaking")]
-            ])
+            reply_markup=_BACK_TO_SPEAKING_MARKUP
         )
         return ConversationHandler.END
 
@@ -2877,10 +3015,7 @@ async def handle_simulation_response(update: Update, context: CallbackContext) -
     if not update.message.voice:
         await update.message.reply_text(
             "🎤 Пожалуйста, отправьте голосовое сообщение для ответа на вопрос.",
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("⏭ Пропустить вопрос", callback_data="skip_question")],
-                [InlineKeyboardButton("❌ Выйти из симуляции", callback_data="abandon_full_sim")]
-            ])
+            reply_markup=_SIM_VOICE_REQUIRED_MARKUP
         )
         current_part = context.user_data.get('current_part', 1)
         return get_current_state(current_part)
@@ -2891,11 +3026,7 @@ async def handle_simulation_response(update: Update, context: CallbackContext) -
         if not transcription:
             await update.message.reply_text(
                 "❌ Не удалось обработать голосовое сообщение. Попробуйте еще раз.",
-                reply_markup=InlineKeyboardMarkup([
-                    [InlineKeyboardButton("🔄 Повторить", callback_data="retry_current_question")],
-                    [InlineKeyboardButton("⏭ Пропустить", callback_data="skip_question")],
-                    [InlineKeyboardButton("❌ Выйти", callback_data="abandon_full_sim")]
-                ])
+                reply_markup=_SIM_VOICE_FAILED_MARKUP
             )
             current_part = context.user_data.get('current_part', 1)
             return get_current_state(current_part)
@@ -2906,8 +3037,8 @@ async def handle_simulation_response(update: Update, context: CallbackContext) -
         question_num = context.user_data.get('current_question_in_part', 1)
         
         # Evaluate response
-        evaluation = evaluate_speaking_response_for_simulation(
-            current_question, transcription, f"Part {current_part}"
+        evaluation = await asyncio.to_thread(
+            evaluate_speaking_response_for_simulation, current_question, transcription, f"Part {current_part}"
         )
         
         # Extract scores
@@ -2929,7 +3060,6 @@ async def handle_simulation_response(update: Update, context: CallbackContext) -
         await update.message.reply_text(confirmation_msg, parse_mode='HTML')
         
         # Small delay for better UX
-        import asyncio
         await asyncio.sleep(1)
         
         # Move to next question or part
@@ -2939,10 +3069,7 @@ async def handle_simulation_response(update: Update, context: CallbackContext) -
         logger.error(f"🔥 Error handling simulation response: {e}")
         await update.message.reply_text(
             "❌ Произошла ошибка при обработке ответа. Попробуйте еще раз.",
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("🔄 Повторить", callback_data="retry_current_question")],
-                [InlineKeyboardButton("❌ Выйти", callback_data="abandon_full_sim")]
-            ])
+            reply_markup=_SIM_RESPONSE_ERROR_MARKUP
         )
         current_part = context.user_data.get('current_part', 1)
         return get_current_state(current_part)
@@ -2982,8 +3109,8 @@ async def handle_full_sim_part_response(update: Update, context: CallbackContext
         total_questions_in_part = context.user_data.get('total_questions_per_part', {}).get(part_number, 1)
         
         # Evaluate response
-        evaluation = evaluate_speaking_response_for_simulation(
-            speaking_prompt, transcription, f"Part {part_number}"
+        evaluation = await asyncio.to_thread(
+            evaluate_speaking_response_for_simulation, speaking_prompt, transcription, f"Part {part_number}"
         )
         
         # Extract scores
@@ -3019,7 +3146,6 @@ async def handle_full_sim_part_response(update: Update, context: CallbackContext
                 session_questions = context.user_data.setdefault('generated_questions', [])
                 part1_pool = ['home', 'work or studies', 'hobbies', 'travel', 'technology', 'food', 'holidays', 'friends and family', 'daily routine', 'environment']
                 part3_pool = ['education policy', 'technology and society', 'environment and sustainability', 'globalization', 'healthcare', 'culture and media', 'urbanization', 'economy and work', 'ethics and AI']
-                import random
                 pool = part1_pool if part_number == 1 else part3_pool if part_number == 3 else ['general']
                 recent_topics = set(db.get_recent_topics(user_id, part_number, window_days=30))
                 candidates = [t for t in pool if t not in used_topics.get(part_number, set()) and t not in recent_topics]
@@ -3090,14 +3216,11 @@ async def handle_full_sim_part_response(update: Update, context: CallbackContext
                     f"🏁 <b>Все части завершены!</b>\n\n"
                     f"⏳ Рассчитываю общий результат и готовлю детальный анализ по всем критериям IELTS..."
                 )
-                keyboard = [
-                    [InlineKeyboardButton("⏳ Обрабатываю...", callback_data="processing")]
-                ]
                 
                 await update.message.reply_text(
                     text=completion_msg,
                     parse_mode='HTML',
-                    reply_markup=InlineKeyboardMarkup(keyboard)
+                    reply_markup=_PROCESSING_MARKUP
                 )
                 
                 # Calculate final results and end conversation
@@ -3118,7 +3241,6 @@ async def handle_full_sim_part_response(update: Update, context: CallbackContext
                 session_questions = context.user_data.setdefault('generated_questions', [])
                 part1_pool = ['home', 'work or studies', 'hobbies', 'travel', 'technology', 'food', 'holidays', 'friends and family', 'daily routine', 'environment']
                 part3_pool = ['education policy', 'technology and society', 'environment and sustainability', 'globalization', 'healthcare', 'culture and media', 'urbanization', 'economy and work', 'ethics and AI']
-                import random
                 pool = part1_pool if next_part == 1 else part3_pool if next_part == 3 else ['general']
                 recent_topics = set(db.get_recent_topics(user_id, next_part, window_days=30))
                 candidates = [t for t in pool if t not in used_topics.get(next_part, set()) and t not in recent_topics]
@@ -3183,9 +3305,7 @@ async def process_voice_message_for_simulation(update: Update, context: Callback
         if not voice:
             await update.message.reply_text(
                 "❌ Пожалуйста, отправьте голосовое сообщение.",
-                reply_markup=InlineKeyboardMarkup([
-                    [InlineKeyboardButton("❌ Отменить", callback_data="abandon_full_sim")]
-                ])
+                reply_markup=_ABANDON_SIM_MARKUP
             )
             return None
         
@@ -3208,39 +3328,21 @@ async def process_voice_message_for_simulation(update: Update, context: Callback
             parse_mode='HTML'
         )
         
-        # Create temporary file
-        import tempfile
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.ogg') as temp_file:
-            temp_path = temp_file.name
-        
-        # Download file
-        if not await audio_processor.download_voice_file(file_url, temp_path):
+        # Download file into memory
+        audio_data = await asyncio.to_thread(audio_processor.download_voice_file, file_url)
+        if not audio_data:
             await processing_msg.edit_text(
                 "❌ <b>Ошибка обработки</b>\n\n"
                 "Не удалось загрузить голосовое сообщение.\n"
                 "Попробуйте еще раз.",
                 parse_mode='HTML',
-                reply_markup=InlineKeyboardMarkup([
-                    [InlineKeyboardButton("❌ Отменить", callback_data="abandon_full_sim")]
-                ])
+                reply_markup=_ABANDON_SIM_MARKUP
             )
             return None
         
-        # Update processing message
-        await processing_msg.edit_text(
-            "🔄 <b>Обрабатываю голосовое сообщение...</b>\n\n"
-            "✅ Аудио файл загружен\n"
-            "✅ Файл сохранен\n"
-            "🎤 Распознаю речь...",
-            parse_mode='HTML'
-        )
-        
         # Transcribe
-        transcription = audio_processor.transcribe_audio(temp_path)
-        
-        # Clean up
-        import os
-        os.unlink(temp_path)
+        async with _transcription_semaphore:
+            transcription = await asyncio.to_thread(audio_processor.transcribe_audio, audio_data)
         
         if not transcription:
             await processing_msg.edit_text(
@@ -3248,9 +3350,7 @@ async def process_voice_message_for_simulation(update: Update, context: Callback
                 "Не удалось распознать речь в сообщении.\n"
                 "Попробуйте говорить четче и громче.",
                 parse_mode='HTML',
-                reply_markup=InlineKeyboardMarkup([
-                    [InlineKeyboardButton("❌ Отменить", callback_data="abandon_full_sim")]
-                ])
+                reply_markup=_ABANDON_SIM_MARKUP
             )
             return None
         
@@ -3269,9 +3369,7 @@ async def process_voice_message_for_simulation(update: Update, context: Callback
         logger.error(f"🔥 Error processing voice message: {e}")
         await update.message.reply_text(
             "❌ Произошла ошибка при обработке голосового сообщения.",
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("❌ Отменить", callback_data="abandon_full_sim")]
-            ])
+            reply_markup=_ABANDON_SIM_MARKUP
         )
         return None
 
@@ -3340,26 +3438,22 @@ async def calculate_and_show_final_results(update: Update, context: CallbackCont
             overall_band=overall_band,
             complete_feedback=results_message
         )
+        invalidate_user(update.effective_user.id)
         
         # Show complete results with full analysis immediately
-        keyboard = [
-            [InlineKeyboardButton("🔄 Новая симуляция", callback_data="restart_full_sim")],
-            [InlineKeyboardButton("📈 Статистика", callback_data="speaking_stats")],
-            [InlineKeyboardButton("📋 Главное меню", callback_data="back_to_main_menu")]
-        ]
         
         # Handle both message and callback query contexts
         if update.message:
             await update.message.reply_text(
                 text=results_message,
                 parse_mode='HTML',
-                reply_markup=InlineKeyboardMarkup(keyboard)
+                reply_markup=_SIM_RESULTS_MARKUP
             )
         elif update.callback_query:
             await update.callback_query.edit_message_text(
                 text=results_message,
                 parse_mode='HTML',
-                reply_markup=InlineKeyboardMarkup(keyboard)
+                reply_markup=_SIM_RESULTS_MARKUP
             )
         else:
             # Fallback: send new message to user
@@ -3369,7 +3463,7 @@ async def calculate_and_show_final_results(update: Update, context: CallbackCont
                     chat_id=user_id,
                     text=results_message,
                     parse_mode='HTML',
-                    reply_markup=InlineKeyboardMarkup(keyboard)
+                    reply_markup=_SIM_RESULTS_MARKUP
                 )
         
         # Clear simulation data
@@ -3380,9 +3474,7 @@ async def calculate_and_show_final_results(update: Update, context: CallbackCont
         
         # Handle error message based on context
         error_message = "❌ Произошла ошибка при расчете результатов. Обратитесь к администратору."
-        error_keyboard = InlineKeyboardMarkup([
-            [InlineKeyboardButton("📋 Главное меню", callback_data="back_to_main_menu")]
-        ])
+        error_keyboard = _MAIN_MENU_ONLY_MARKUP
         
         if update.message:
             await update.message.reply_text(
@@ -3407,7 +3499,7 @@ async def calculate_and_show_final_results(update: Update, context: CallbackCont
 async def skip_full_sim_part(update: Update, context: CallbackContext) -> int:
     """Skip a part in full simulation"""
     query = update.callback_query
-    await query.answer()
+    _ack(update, context)
     
     part_number = int(query.data.split('_')[-1])
     next_state = part_number + 1
@@ -3450,13 +3542,14 @@ async def skip_full_sim_part(update: Update, context: CallbackContext) -> int:
 async def abandon_full_simulation(update: Update, context: CallbackContext) -> int:
     """Abandon full simulation"""
     query = update.callback_query
-    await query.answer()
+    _ack(update, context)
     
     try:
         # Mark simulation as abandoned in database
         session_id = context.user_data.get('simulation_session_id')
         if session_id:
             db.abandon_simulation(session_id)
+            invalidate_user(update.effective_user.id)
         
         # Clear context
         context.user_data.clear()
@@ -3464,10 +3557,7 @@ async def abandon_full_simulation(update: Update, context: CallbackContext) -> i
         await query.edit_message_text(
             "❌ <b>Симуляция отменена</b>\n\n"
             "Вы можете начать новую симуляцию в любое время.",
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("🔄 Новая симуляция", callback_data="full_speaking_sim")],
-                [InlineKeyboardButton("📋 Главное меню", callback_data="back_to_main_menu")]
-            ]),
+            reply_markup=_SIM_ABANDONED_MARKUP,
             parse_mode='HTML'
         )
         
@@ -3477,16 +3567,13 @@ async def abandon_full_simulation(update: Update, context: CallbackContext) -> i
         logger.error(f"🔥 Error abandoning simulation: {e}")
         await query.edit_message_text(
             "❌ Произошла ошибка при отмене симуляции.",
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("📋 Главное меню", callback_data="back_to_main_menu")]
-            ])
+            reply_markup=_MAIN_MENU_ONLY_MARKUP
         )
         return ConversationHandler.END
 
 async def restart_full_simulation(update: Update, context: CallbackContext) -> int:
     """Restart full simulation"""
-    query = update.callback_query
-    await query.answer()
+    _ack(update, context)
     
     # Clear previous simulation data
     context.user_data.clear()
@@ -3515,11 +3602,11 @@ async def handle_speaking_stats(update: Update, context: CallbackContext) -> Non
     """Show user's speaking statistics"""
     user = update.effective_user
     query = update.callback_query
-    await query.answer()
+    _ack(update, context)
     
     try:
         # Get user's speaking statistics
-        stats = db.get_user_speaking_stats(user.id)
+        stats = cached_user_speaking_stats(user.id)
         
         stats_text = "📈 <b>Ваша статистика IELTS Speaking</b>\n\n"
         stats_text += f"🎯 <b>Всего симуляций:</b> {stats['total_simulations']}\n"
@@ -3531,25 +3618,17 @@ async def handle_speaking_stats(update: Update, context: CallbackContext) -> Non
             last_date = stats['last_simulation_date'].split()[0] if isinstance(stats['last_simulation_date'], str) else str(stats['last_simulation_date']).split()[0]
             stats_text += f"📅 <b>Последняя симуляция:</b> {last_date}\n"
         
-        keyboard = [
-            [InlineKeyboardButton("🎯 Новая симуляция", callback_data="full_speaking_sim")],
-            [InlineKeyboardButton("🔙 Назад к профилю", callback_data="menu_profile")],
-            [InlineKeyboardButton("🔙 Назад к говорению", callback_data="menu_speaking")]
-        ]
-        
         await query.edit_message_text(
             text=stats_text,
             parse_mode='HTML',
-            reply_markup=InlineKeyboardMarkup(keyboard)
+            reply_markup=_SPEAKING_STATS_MARKUP
         )
         
     except Exception as e:
         logger.error(f"🔥 Error showing speaking stats for user {user.id}: {e}")
         await query.edit_message_text(
             "❌ Произошла ошибка при загрузке статистики. Попробуйте позже.",
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("🔙 Назад", callback_data="menu_speaking")]
-            ])
+            reply_markup=_BACK_TO_SPEAKING_MARKUP
         )
 
 @require_access
@@ -3557,11 +3636,11 @@ async def handle_writing_stats(update: Update, context: CallbackContext) -> None
     """Show user's writing statistics"""
     user = update.effective_user
     query = update.callback_query
-    await query.answer()
+    _ack(update, context)
     
     try:
         # Get user's writing statistics
-        stats = db.get_user_writing_stats(user.id)
+        stats = cached_user_writing_stats(user.id)
         
         stats_text = "✍️ <b>Ваша статистика IELTS Writing</b>\n\n"
         
@@ -3588,40 +3667,48 @@ async def handle_writing_stats(update: Update, context: CallbackContext) -> None
             stats_text += "• Пока нет данных о проверках письма\n"
             stats_text += "• Начните проверку письма для получения статистики\n"
         
-        keyboard = [
-            [InlineKeyboardButton("📝 Проверить письмо", callback_data="writing_check")],
-            [InlineKeyboardButton("🔙 Назад к профилю", callback_data="menu_profile")],
-            [InlineKeyboardButton("🔙 Назад к письму", callback_data="menu_writing")]
-        ]
-        
         await query.edit_message_text(
             text=stats_text,
             parse_mode='HTML',
-            reply_markup=InlineKeyboardMarkup(keyboard)
+            reply_markup=_WRITING_STATS_MARKUP
         )
         
     except Exception as e:
         logger.error(f"🔥 Error showing writing stats for user {user.id}: {e}")
         await query.edit_message_text(
             "❌ Произошла ошибка при загрузке статистики письма. Попробуйте позже.",
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("🔙 Назад", callback_data="menu_writing")]
-            ])
+            reply_markup=_WRITING_STATS_ERROR_MARKUP
         )
 
+# --- Callback patterns (compiled once; callback_data is always ASCII) ---
+_PAT_WRITING_TYPE = re.compile(r'^writing_task_type_\d$', re.ASCII)
+_PAT_WRITING_CHECK = re.compile(r'^writing_check$', re.ASCII)
+_PAT_BACK_TO_MAIN_MENU = re.compile(r'^back_to_main_menu$', re.ASCII)
+_PAT_CUSTOM_WORD_ADD = re.compile(r'^custom_word_add$', re.ASCII)
+_PAT_AI_CUSTOM_WORD = re.compile(r'^ai_enhanced_custom_word$', re.ASCII)
+_PAT_VOCABULARY_CHOICE = re.compile(r'^vocabulary_(random|topic|custom|ai_enhanced)$', re.ASCII)
+_PAT_MENU_VOCABULARY = re.compile(r'^menu_vocabulary$', re.ASCII)
+_PAT_FULL_SPEAKING_SIM = re.compile(r'^full_speaking_sim$', re.ASCII)
+_PAT_SKIP_QUESTION = re.compile(r'^skip_question$', re.ASCII)
+_PAT_RETRY_QUESTION = re.compile(r'^retry_current_question$', re.ASCII)
+_PAT_ABANDON_FULL_SIM = re.compile(r'^abandon_full_sim$', re.ASCII)
+_PAT_SKIP_PART_1 = re.compile(r'^skip_part_1$', re.ASCII)
+_PAT_SKIP_PART_2 = re.compile(r'^skip_part_2$', re.ASCII)
+_PAT_SKIP_PART_3 = re.compile(r'^skip_part_3$', re.ASCII)
+
 # --- Conversation Handlers Setup (for main.py) ---
 writing_conversation_handler = ConversationHandler(
     entry_points=[CommandHandler("writing", start_writing_task, filters=filters.ChatType.PRIVATE)],
     states={
         GET_WRITING_TOPIC: [
-            CallbackQueryHandler(handle_writing_task_type_callback, pattern=r'^writing_task_type_\d$'),
-            CallbackQueryHandler(handle_writing_check_callback, pattern=r'^writing_check$'),
-            CallbackQueryHandler(menu_button_callback, pattern=r'^back_to_main_menu$'),
+            CallbackQueryHandler(handle_writing_task_type_callback, pattern=_PAT_WRITING_TYPE),
+            CallbackQueryHandler(handle_writing_check_callback, pattern=_PAT_WRITING_CHECK),
+            CallbackQueryHandler(menu_button_callback, pattern=_PAT_BACK_TO_MAIN_MENU),
             MessageHandler(filters.ChatType.PRIVATE & (filters.TEXT & ~filters.COMMAND), handle_writing_topic_input)
         ],
         GET_WRITING_SUBMISSION: [
             MessageHandler(filters.ChatType.PRIVATE & (filters.TEXT & ~filters.COMMAND), handle_writing_submission),
-            CallbackQueryHandler(menu_button_callback, pattern=r'^back_to_main_menu$'),
+            CallbackQueryHandler(menu_button_callback, pattern=_PAT_BACK_TO_MAIN_MENU),
         ],
         GET_WRITING_CHECK_TASK: [
             MessageHandler(filters.ChatType.PRIVATE & (filters.TEXT & ~filters.COMMAND), handle_writing_check_task_input),
@@ -3657,44 +3744,44 @@ vocabulary_conversation_handler = ConversationHandler(
         CommandHandler("vocabulary", start_vocabulary_selection, filters=filters.ChatType.PRIVATE),
         CommandHandler("customword", custom_word_command, filters=filters.ChatType.PRIVATE),
         CommandHandler("aicustomword", ai_custom_word_command, filters=filters.ChatType.PRIVATE),
-        CallbackQueryHandler(start_custom_word_input, pattern=r'^custom_word_add$'),
-        CallbackQueryHandler(handle_ai_enhanced_custom_word, pattern=r'^ai_enhanced_custom_word$')
+        CallbackQueryHandler(start_custom_word_input, pattern=_PAT_CUSTOM_WORD_ADD),
+        CallbackQueryHandler(handle_ai_enhanced_custom_word, pattern=_PAT_AI_CUSTOM_WORD)
     ],
     states={
         GET_VOCABULARY_TOPIC: [
-            CallbackQueryHandler(handle_vocabulary_choice_callback, pattern=r'^vocabulary_(random|topic|custom|ai_enhanced)$'),
-            CallbackQueryHandler(menu_button_callback, pattern=r'^back_to_main_menu$'),
+            CallbackQueryHandler(handle_vocabulary_choice_callback, pattern=_PAT_VOCABULARY_CHOICE),
+            CallbackQueryHandler(menu_button_callback, pattern=_PAT_BACK_TO_MAIN_MENU),
             MessageHandler(filters.ChatType.PRIVATE & (filters.TEXT & ~filters.COMMAND), get_topic_and_generate_vocabulary)
         ],
         GET_CUSTOM_WORD: [
             MessageHandler(filters.ChatType.PRIVATE & (filters.TEXT & ~filters.COMMAND), handle_custom_word_input),
-            CallbackQueryHandler(menu_button_callback, pattern=r'^menu_vocabulary$'),
-            CallbackQueryHandler(menu_button_callback, pattern=r'^back_to_main_menu$')
+            CallbackQueryHandler(menu_button_callback, pattern=_PAT_MENU_VOCABULARY),
+            CallbackQueryHandler(menu_button_callback, pattern=_PAT_BACK_TO_MAIN_MENU)
         ],
         GET_CUSTOM_WORD_DEFINITION: [
             MessageHandler(filters.ChatType.PRIVATE & (filters.TEXT & ~filters.COMMAND), handle_custom_word_definition),
-            CallbackQueryHandler(menu_button_callback, pattern=r'^menu_vocabulary$'),
-            CallbackQueryHandler(menu_button_callback, pattern=r'^back_to_main_menu$')
+            CallbackQueryHandler(menu_button_callback, pattern=_PAT_MENU_VOCABULARY),
+            CallbackQueryHandler(menu_button_callback, pattern=_PAT_BACK_TO_MAIN_MENU)
         ],
         GET_CUSTOM_WORD_TRANSLATION: [
             MessageHandler(filters.ChatType.PRIVATE & (filters.TEXT & ~filters.COMMAND), handle_custom_word_translation),
-            CallbackQueryHandler(menu_button_callback, pattern=r'^menu_vocabulary$'),
-            CallbackQueryHandler(menu_button_callback, pattern=r'^back_to_main_menu$')
+            CallbackQueryHandler(menu_button_callback, pattern=_PAT_MENU_VOCABULARY),
+            CallbackQueryHandler(menu_button_callback, pattern=_PAT_BACK_TO_MAIN_MENU)
         ],
         GET_CUSTOM_WORD_EXAMPLE: [
             MessageHandler(filters.ChatType.PRIVATE & (filters.TEXT & ~filters.COMMAND), handle_custom_word_example),
-            CallbackQueryHandler(menu_button_callback, pattern=r'^menu_vocabulary$'),
-            CallbackQueryHandler(menu_button_callback, pattern=r'^back_to_main_menu$')
+            CallbackQueryHandler(menu_button_callback, pattern=_PAT_MENU_VOCABULARY),
+            CallbackQueryHandler(menu_button_callback, pattern=_PAT_BACK_TO_MAIN_MENU)
         ],
         GET_CUSTOM_WORD_TOPIC: [
             MessageHandler(filters.ChatType.PRIVATE & (filters.TEXT & ~filters.COMMAND), handle_custom_word_topic),
-            CallbackQueryHandler(menu_button_callback, pattern=r'^menu_vocabulary$'),
-            CallbackQueryHandler(menu_button_callback, pattern=r'^back_to_main_menu$')
+            CallbackQueryHandler(menu_button_callback, pattern=_PAT_MENU_VOCABULARY),
+            CallbackQueryHandler(menu_button_callback, pattern=_PAT_BACK_TO_MAIN_MENU)
         ],
     },
     fallbacks=[
-        CallbackQueryHandler(menu_button_callback, pattern=r'^menu_vocabulary$'),
-        CallbackQueryHandler(menu_button_callback, pattern=r'^back_to_main_menu$'),
+        CallbackQueryHandler(menu_button_callback, pattern=_PAT_MENU_VOCABULARY),
+        CallbackQueryHandler(menu_button_callback, pattern=_PAT_BACK_TO_MAIN_MENU),
         CommandHandler("cancel", cancel, filters=filters.ChatType.PRIVATE)
     ],
     name="vocabulary_conversation",
@@ -3709,36 +3796,36 @@ vocabulary_conversation_handler = ConversationHandler(
 # Full speaking simulation conversation handler
 full_speaking_simulation_handler = ConversationHandler(
     entry_points=[
-        CallbackQueryHandler(start_full_speaking_simulation, pattern=r'^full_speaking_sim$')
+        CallbackQueryHandler(start_full_speaking_simulation, pattern=_PAT_FULL_SPEAKING_SIM)
     ],
     states={
         FULL_SIM_PART_1: [
             MessageHandler(filters.ChatType.PRIVATE & filters.VOICE, handle_simulation_response),
-            CallbackQueryHandler(handle_skip_question, pattern=r'^skip_question$'),
-            CallbackQueryHandler(handle_retry_question, pattern=r'^retry_current_question$'),
-            CallbackQueryHandler(abandon_full_simulation, pattern=r'^abandon_full_sim$'),
+            CallbackQueryHandler(handle_skip_question, pattern=_PAT_SKIP_QUESTION),
+            CallbackQueryHandler(handle_retry_question, pattern=_PAT_RETRY_QUESTION),
+            CallbackQueryHandler(abandon_full_simulation, pattern=_PAT_ABANDON_FULL_SIM),
             # Keep old patterns for backward compatibility
-            CallbackQueryHandler(skip_full_sim_part, pattern=r'^skip_part_1$')
+            CallbackQueryHandler(skip_full_sim_part, pattern=_PAT_SKIP_PART_1)
         ],
         FULL_SIM_PART_2: [
             MessageHandler(filters.ChatType.PRIVATE & filters.VOICE, handle_simulation_response),
-            CallbackQueryHandler(handle_skip_question, pattern=r'^skip_question$'),
-            CallbackQueryHandler(handle_retry_question, pattern=r'^retry_current_question$'),
-            CallbackQueryHandler(abandon_full_simulation, pattern=r'^abandon_full_sim$'),
+            CallbackQueryHandler(handle_skip_question, pattern=_PAT_SKIP_QUESTION),
+            CallbackQueryHandler(handle_retry_question, pattern=_PAT_RETRY_QUESTION),
+            CallbackQueryHandler(abandon_full_simulation, pattern=_PAT_ABANDON_FULL_SIM),
             # Keep old patterns for backward compatibility
-            CallbackQueryHandler(skip_full_sim_part, pattern=r'^skip_part_2$')
+            CallbackQueryHandler(skip_full_sim_part, pattern=_PAT_SKIP_PART_2)
         ],
         FULL_SIM_PART_3: [
             MessageHandler(filters.ChatType.PRIVATE & filters.VOICE, handle_simulation_response),
-            CallbackQueryHandler(handle_skip_question, pattern=r'^skip_question$'),
-            CallbackQueryHandler(handle_retry_question, pattern=r'^retry_current_question$'),
-            CallbackQueryHandler(abandon_full_simulation, pattern=r'^abandon_full_sim$'),
+            CallbackQueryHandler(handle_skip_question, pattern=_PAT_SKIP_QUESTION),
+            CallbackQueryHandler(handle_retry_question, pattern=_PAT_RETRY_QUESTION),
+            CallbackQueryHandler(abandon_full_simulation, pattern=_PAT_ABANDON_FULL_SIM),
             # Keep old patterns for backward compatibility
-            CallbackQueryHandler(skip_full_sim_part, pattern=r'^skip_part_3$')
+            CallbackQueryHandler(skip_full_sim_part, pattern=_PAT_SKIP_PART_3)
         ]
     },
     fallbacks=[
-        CallbackQueryHandler(abandon_full_simulation, pattern=r'^abandon_full_sim$'),
+        CallbackQueryHandler(abandon_full_simulation, pattern=_PAT_ABANDON_FULL_SIM),
         CommandHandler("cancel", cancel_full_simulation, filters=filters.ChatType.PRIVATE)
     ],
     name="full_speaking_simulation",
@@ -3765,11 +3852,8 @@ async def handle_group_word_command(update: Update, context: CallbackContext) ->
         # Add group to database if not exists
         db.add_group_chat(group_info['group_id'], group_info['group_title'], group_info['group_type'])
         
-        # Show typing action
-        await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
-        
-        # Generate unique word for this group
-        word_details = get_random_word_for_group(group_info['group_id'])
+        # Generate unique word for this group while showing typing action
+        word_details = await run_with_typing(context, update.effective_chat.id, get_random_word_for_group, group_info['group_id'])
         
         # Extract word components
         word, definition, translation, example = extract_word_components(word_details)
@@ -3984,7 +4068,6 @@ async def handle_group_autosend_command(update: Update, context: CallbackContext
 # --- AUTO-SEND FUNCTIONALITY ---
 async def auto_send_words_to_groups(context: CallbackContext) -> None:
     """Send words automatically to groups with auto-send enabled"""
-    from datetime import datetime, timedelta
     
     try:
         # Get all groups with auto-send enabled
@@ -4047,7 +4130,6 @@ async def auto_send_words_to_groups(context: CallbackContext) -> None:
 
 def should_send_word_to_group(last_auto_send: str, send_interval_hours: int) -> bool:
     """Check if it's time to send a word to a group"""
-    from datetime import datetime, timedelta
     
     if not last_auto_send:
         # Never sent before, send now
@@ -4071,15 +4153,12 @@ async def handle_writing_task_type_global(update: Update, context: CallbackConte
     user = update.effective_user
     
     query = update.callback_query
-    await query.answer()
+    _ack(update, context)
     task_type_choice = query.data.split('_')[-1]
     context.user_data['selected_writing_task_type'] = f"Task {task_type_choice}"
-    context.user_data['waiting_for_writing_topic'] = True
+    set_waiting(context, WaitState.WRITING_TOPIC)
     logger.info(f"🎯 User {update.effective_user.id} selected writing task type: {context.user_data['selected_writing_task_type']} (global)")
-    keyboard = [
-        [InlineKeyboardButton("🔙 Назад к письму", callback_data="menu_writing")],
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    reply_markup = _BACK_TO_WRITING_MARKUP
     await query.edit_message_text(
         f"✅ Вы выбрали {context.user_data['selected_writing_task_type']}. Теперь, пожалуйста, расскажите мне тему для вашего письменного задания.",
         reply_markup=reply_markup
@@ -4090,121 +4169,183 @@ async def handle_save_word_to_vocabulary(update: Update, context: CallbackContex
     """Handle saving word to user's personal vocabulary"""
     user = update.effective_user
     query = update.callback_query
-    await query.answer()
-    
-    word_details = context.user_data.get('last_random_word', '')
-    if not word_details:
-        await query.edit_message_text("❌ Нет слова для сохранения. Попробуйте получить новое случайное слово.")
-        return
-    
-    # Parse word details
-    parsed_word = parse_word_details(word_details)
     
-    # Check if word already exists
-    if db.word_exists_in_user_vocabulary(user.id, parsed_word['word']):
-        await query.edit_message_text(
-            f"⚠️ Слово '{parsed_word['word']}' уже есть в вашем словаре!\n\n"
-            f"📖 Перейти в мой словарь или выбрать новое слово?",
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("📖 Мой словарь", callback_data="profile_vocabulary")],
-                [InlineKeyboardButton("🎲 Новое слово", callback_data="vocabulary_random")],
-                [InlineKeyboardButton("🔙 Назад в меню", callback_data="back_to_main_menu")],
-            ])
-        )
+    lock = _user_locks[user.id]
+    if lock.locked():
+        await query.answer(_VOCAB_BUSY_TOAST)
         return
+    _ack(update, context)
     
-    # Save word to database
-    success = db.save_word_to_user_vocabulary(
-        user_id=user.id,
-        word=parsed_word['word'],
-        definition=parsed_word['definition'],
-        translation=parsed_word['translation'],
-        example=parsed_word['example'],
-        topic="random"
-    )
+    try:
+        async with lock:
+            word_details = context.user_data.get('last_random_word', '')
+            if not word_details:
+                await query.edit_message_text("❌ Нет слова для сохранения. Попробуйте получить новое случайное слово.")
+                return
+    
+            # Parse word details
+            parsed_word = parse_word_details(word_details)
+    
+            # Check if word already exists
+            if await asyncio.to_thread(cached_word_exists, user.id, parsed_word['word']):
+                await query.edit_message_text(
+                    f"⚠️ Слово '{parsed_word['word']}' уже есть в вашем словаре!\n\n"
+                    f"📖 Перейти в мой словарь или выбрать новое слово?",
+                    reply_markup=_WORD_SAVED_MARKUP
+                )
+                return
+    
+            # Save word to database
+            vocabulary_count = await asyncio.to_thread(
+                db.save_word_and_get_count,
+                user_id=user.id,
+                word=parsed_word['word'],
+                definition=parsed_word['definition'],
+                translation=parsed_word['translation'],
+                example=parsed_word['example'],
+                topic="random"
+            )
+            invalidate_user(user.id)
     
-    if success:
-        vocabulary_count = db.get_user_vocabulary_count(user.id)
-        await query.edit_message_text(
-            f"✅ Слово '{parsed_word['word']}' успешно добавлено в ваш словарь!\n\n"
-            f"📚 Всего слов в словаре: {vocabulary_count}",
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("📖 Мой словарь", callback_data="profile_vocabulary")],
-                [InlineKeyboardButton("🎲 Новое слово", callback_data="vocabulary_random")],
-                [InlineKeyboardButton("🔙 Назад в меню", callback_data="back_to_main_menu")],
-            ])
-        )
-    else:
-        await query.edit_message_text(
-            "❌ Произошла ошибка при сохранении слова. Попробуйте позже.",
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("🔙 Назад в меню", callback_data="back_to_main_menu")],
-            ])
-        )
+            if vocabulary_count is not None:
+                await query.edit_message_text(
+                    f"✅ Слово '{parsed_word['word']}' успешно добавлено в ваш словарь!\n\n"
+                    f"📚 Всего слов в словаре: {vocabulary_count}",
+                    reply_markup=_WORD_SAVED_MARKUP
+                )
+            else:
+                await query.edit_message_text(
+                    "❌ Произошла ошибка при сохранении слова. Попробуйте позже.",
+                    reply_markup=_BACK_TO_MENU_MARKUP
+                )
+    finally:
+        if not lock.locked():
+            _user_locks.pop(user.id, None)
 
 @require_access
 async def handle_profile_vocabulary(update: Update, context: CallbackContext) -> None:
     """Handle viewing user's personal vocabulary"""
+    _ack(update, context)
+    await show_vocabulary_page(update, context)
+
+def _vocab_field(text: str) -> str:
+    """HTML-escape a stored vocabulary field, clipping overly long user input"""
+    if len(text) > _VOCAB_FIELD_MAX_CHARS:
+        text = text[:_VOCAB_FIELD_MAX_CHARS - 1] + "…"
+    return html.escape(text, quote=False)
+
+async def show_vocabulary_page(update: Update, context: CallbackContext,
+                               before: tuple = None, after: tuple = None) -> None:
+    """Show one page of the user's vocabulary using (saved_at, id) cursors"""
     user = update.effective_user
     query = update.callback_query
-    await query.answer()
     
-    words = db.get_user_vocabulary(user.id, limit=20)  # Show last 20 words
-    vocabulary_count = db.get_user_vocabulary_count(user.id)
+    # Fetch one extra row to know whether another page exists in that direction
+    words = await asyncio.to_thread(
+        db.get_user_vocabulary, user.id, limit=VOCAB_PAGE_SIZE + 1, before=before, after=after
+    )
     
-    if not words:
+    if not words and before is None and after is None:
         await query.edit_message_text(
             "📖 <b>Мой словарь</b>\n\n"
             "📝 Ваш словарь пока пуст.\n"
             "Добавьте слова, используя функцию 'Случайное слово'!",
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("🎲 Случайное слово", callback_data="vocabulary_random")],
-                [InlineKeyboardButton("🔙 Назад к профилю", callback_data="menu_profile")],
-            ]),
+            reply_markup=_VOCAB_EMPTY_MARKUP,
             parse_mode='HTML'
         )
         return
     
-    # Format vocabulary list
-    vocabulary_text = f"📖 <b>Мой словарь</b> ({vocabulary_count} слов)\n\n"
+    has_more = len(words) > VOCAB_PAGE_SIZE
+    if after is not None:
+        words = words[1:] if has_more else words
+        has_newer, has_older = has_more, True
+    else:
+        words = words[:VOCAB_PAGE_SIZE]
+        has_newer, has_older = before is not None, has_more
+    
+    vocabulary_count = await asyncio.to_thread(cached_user_vocabulary_count, user.id)
     
-    for i, (word, definition, translation, example, topic, saved_at) in enumerate(words, 1):
-        vocabulary_text += f"<b>{i}. {word.upper()}</b>\n"
+    # Format vocabulary list; words that don't fit move to the next page
+    parts = [f"📖 <b>Мой словарь</b> ({vocabulary_count} слов)\n\n"]
+    length = len(parts[0])
+    shown = 0
+    for word, definition, translation, example, topic, saved_at, word_id in words:
+        entry = [f"<b>• {_vocab_field(word.upper())}</b>\n"]
         if definition:
-            vocabulary_text += f"📖 {definition}\n"
+            entry.append(f"📖 {_vocab_field(definition)}\n")
         if translation:
-            vocabulary_text += f"🇷🇺 {translation}\n"
+            entry.append(f"🇷🇺 {_vocab_field(translation)}\n")
         if example:
-            vocabulary_text += f"💡 {example}\n"
-        vocabulary_text += f"📅 {saved_at[:10]}\n\n"
+            entry.append(f"💡 {_vocab_field(example)}\n")
+        entry.append(f"📅 {saved_at[:10]}\n\n")
+        entry_text = "".join(entry)
+        if shown and length + len(entry_text) > _VOCAB_PAGE_MAX_CHARS:
+            has_older = True
+            break
+        parts.append(entry_text)
+        length += len(entry_text)
+        shown += 1
+    words = words[:shown]
+    vocabulary_text = "".join(parts)
+    
+    # Build pagination buttons
+    keyboard = []
+    pagination_row = []
     
-    if vocabulary_count > 20:
-        vocabulary_text += f"<i>... и еще {vocabulary_count - 20} слов</i>\n"
+    if words and has_newer:
+        newest = words[0]
+        pagination_row.append(InlineKeyboardButton("⬅️ Назад", callback_data=f"vocab_page_after_{newest[5]}_{newest[6]}"))
     
-    keyboard = [
-        [InlineKeyboardButton("🗑️ Очистить словарь", callback_data="clear_vocabulary")],
-        [InlineKeyboardButton("🔙 Назад к профилю", callback_data="menu_profile")],
-    ]
+    if words and has_older:
+        oldest = words[-1]
+        pagination_row.append(InlineKeyboardButton("➡️ Далее", callback_data=f"vocab_page_before_{oldest[5]}_{oldest[6]}"))
+    
+    if pagination_row:
+        keyboard.append(pagination_row)
+    
+    keyboard.extend(_VOCAB_LIST_MARKUP.inline_keyboard)
     reply_markup = InlineKeyboardMarkup(keyboard)
     
-    # Split long message if needed
-    await send_long_message(update, context, vocabulary_text, reply_markup, parse_mode='HTML')
+    try:
+        await query.edit_message_text(vocabulary_text, reply_markup=reply_markup, parse_mode='HTML')
+    except Exception as e:
+        logger.warning(f"HTML parsing failed for vocabulary page, falling back to plain text: {e}")
+        plain_text = html.unescape(_HTML_TAG_RE.sub('', vocabulary_text))
+        await query.edit_message_text(plain_text, reply_markup=reply_markup)
+
+@require_access
+async def handle_vocabulary_pagination(update: Update, context: CallbackContext) -> None:
+    """Handle pagination for the personal vocabulary"""
+    query = update.callback_query
+    _ack(update, context)
+    
+    # Extract direction and (saved_at, id) cursor from callback data
+    match = _VOCAB_PAGE_RE.match(query.data)
+    if not match:
+        # Buttons from before the id was part of the cursor: start from the newest page
+        await show_vocabulary_page(update, context)
+        return
+    direction, saved_at, word_id = match.groups()
+    cursor = (saved_at, int(word_id))
+    
+    if direction == "before":
+        await show_vocabulary_page(update, context, before=cursor)
+    else:
+        await show_vocabulary_page(update, context, after=cursor)
 
 @require_access
 async def handle_clear_vocabulary(update: Update, context: CallbackContext) -> None:
     """Handle clearing user's vocabulary with confirmation"""
     user = update.effective_user
     query = update.callback_query
-    await query.answer()
+    _ack(update, context)
     
-    vocabulary_count = db.get_user_vocabulary_count(user.id)
+    vocabulary_count = await asyncio.to_thread(cached_user_vocabulary_count, user.id)
     
     if vocabulary_count == 0:
         await query.edit_message_text(
             "📖 Ваш словарь уже пуст!",
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("🔙 Назад к профилю", callback_data="menu_profile")],
-            ])
+            reply_markup=_PROFILE_BACK_MARKUP
         )
         return
     
@@ -4212,10 +4353,7 @@ async def handle_clear_vocabulary(update: Update, context: CallbackContext) -> N
         f"⚠️ <b>Подтверждение</b>\n\n"
         f"Вы уверены, что хотите удалить все {vocabulary_count} слов из вашего словаря?\n\n"
         f"<i>Это действие нельзя отменить!</i>",
-        reply_markup=InlineKeyboardMarkup([
-            [InlineKeyboardButton("✅ Да, очистить", callback_data="confirm_clear_vocabulary")],
-            [InlineKeyboardButton("❌ Отмена", callback_data="profile_vocabulary")],
-        ]),
+        reply_markup=_CLEAR_CONFIRM_MARKUP,
         parse_mode='HTML'
     )
 
@@ -4224,33 +4362,37 @@ async def handle_confirm_clear_vocabulary(update: Update, context: CallbackConte
     """Handle confirmed vocabulary clearing"""
     user = update.effective_user
     query = update.callback_query
-    await query.answer()
+    
+    # Double taps on the confirm button would run the DELETE twice; a pending save also holds the lock
+    lock = _user_locks[user.id]
+    if lock.locked():
+        await query.answer(_VOCAB_BUSY_TOAST)
+        return
+    _ack(update, context)
     
     try:
-        with sqlite3.connect(db.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute('DELETE FROM user_words WHERE user_id = ?', (user.id,))
-            deleted_count = cursor.rowcount
-            conn.commit()
-            
-        await query.edit_message_text(
-            f"✅ Словарь очищен!\n\n"
-            f"Удалено слов: {deleted_count}",
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("🎲 Добавить новые слова", callback_data="vocabulary_random")],
-                [InlineKeyboardButton("🔙 Назад к профилю", callback_data="menu_profile")],
-            ])
-        )
-        logger.info(f"✅ User {user.id} cleared their vocabulary ({deleted_count} words)")
+        async with lock:
+            deleted_count = await asyncio.to_thread(db.clear_user_vocabulary, user.id)
+            if deleted_count is None:
+                raise RuntimeError("vocabulary DELETE failed")
+            invalidate_user(user.id)
+                
+            await query.edit_message_text(
+                f"✅ Словарь очищен!\n\n"
+                f"Удалено слов: {deleted_count}",
+                reply_markup=_VOCAB_CLEARED_MARKUP
+            )
+            logger.info("✅ User %s cleared their vocabulary (%d words)", user.id, deleted_count)
         
     except Exception as e:
-        logger.error(f"🔥 Failed to clear vocabulary for user {user.id}: {e}")
+        logger.error("🔥 Failed to clear vocabulary for user %s: %s", user.id, e)
         await query.edit_message_text(
             "❌ Произошла ошибка при очистке словаря.",
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("🔙 Назад к профилю", callback_data="menu_profile")],
-            ])
+            reply_markup=_PROFILE_BACK_MARKUP
         )
+    finally:
+        if not lock.locked():
+            _user_locks.pop(user.id, None)
 
 # === ADMIN FUNCTIONS ===
 
@@ -4264,7 +4406,6 @@ def add_user_to_permanent_whitelist(user_id: int) -> bool:
             content = file.read()
         
         # Find the AUTHORIZED_USER_IDS section
-        import re
         pattern = r'(AUTHORIZED_USER_IDS\s*=\s*\[)(.*?)(\])'
         match = re.search(pattern, content, re.DOTALL)
         
@@ -4291,6 +4432,8 @@ def add_user_to_permanent_whitelist(user_id: int) -> bool:
             # Update runtime config
             try:
                 config.AUTHORIZED_USER_IDS.append(user_id)
+                _authorized_ids.add(user_id)
+                _whitelist_changed()
             except Exception:
                 pass
             
@@ -4311,7 +4454,6 @@ def remove_user_from_permanent_whitelist(user_id: int) -> bool:
             content = file.read()
         
         # Find and remove the user_id
-        import re
         pattern = rf'\s*{user_id},?\s*\n?'
         new_content = re.sub(pattern, '', content)
         
@@ -4321,8 +4463,10 @@ def remove_user_from_permanent_whitelist(user_id: int) -> bool:
         
         # Update runtime config
         try:
-            if user_id in config.AUTHORIZED_USER_IDS:
+            if user_id in _authorized_ids:
                 config.AUTHORIZED_USER_IDS.remove(user_id)
+                _authorized_ids.discard(user_id)
+                _whitelist_changed()
         except Exception:
             pass
         
@@ -4342,7 +4486,6 @@ def add_username_to_permanent_whitelist(username: str) -> bool:
             content = file.read()
         
         # Find the AUTHORIZED_USERNAMES section
-        import re
         pattern = r'(AUTHORIZED_USERNAMES\s*=\s*\[)(.*?)(\])'
         match = re.search(pattern, content, re.DOTALL)
         
@@ -4367,7 +4510,10 @@ def add_username_to_permanent_whitelist(username: str) -> bool:
             
             # Update runtime config
             try:
-                config.AUTHORIZED_USERNAMES.append(username)
+                if username.lower() not in _authorized_usernames:
+                    config.AUTHORIZED_USERNAMES.append(username)
+                    _authorized_usernames[username.lower()] = username
+                    _whitelist_changed()
             except Exception:
                 pass
             
@@ -4386,30 +4532,7 @@ async def admin_command(update: Update, context: CallbackContext) -> None:
 @require_admin
 async def admin_help_command(update: Update, context: CallbackContext) -> None:
     """Handle /adminhelp command - show full admin instructions"""
-    help_text = """📖 <b>БЫСТРАЯ СПРАВКА ДЛЯ АДМИНИСТРАТОРА</b>
-
-🚀 <b>Основные команды:</b>
-• <code>/admin</code> - Админ-панель
-• <code>/adminhelp</code> - Эта справка
-• <code>/testdb</code> - Проверка БД
-• <code>/whitelist</code> - Статус whitelist
-
-👥 <b>Управление пользователями:</b>
-• <code>/block_ID</code> - Заблокировать
-• <code>/unblock_ID</code> - Разблокировать  
-• <code>/delete_ID</code> - Удалить (необратимо!)
-
-🔐 <b>Управление доступом:</b>
-• <code>/adduser_ID</code> - Добавить по ID
-• <code>/addusername_name</code> - Добавить по username
-• <code>/removeuser_ID</code> - Удалить по ID
-• <code>/removeusername_name</code> - Удалить по username
-
-💡 <b>Полная инструкция:</b> /admin → "📖 Инструкция для админа"
-
-⚠️ <b>Помните:</b> Команды удаления необратимы! Используйте блокировку вместо удаления когда это возможно."""
-
-    await update.message.reply_text(help_text, parse_mode='HTML')
+    await update.message.reply_text(_ADMIN_QUICK_HELP_TEXT, parse_mode='HTML')
 
 async def test_db_command(update: Update, context: CallbackContext) -> None:
     """Test database functionality - for debugging"""
@@ -4435,7 +4558,7 @@ async def test_db_command(update: Update, context: CallbackContext) -> None:
         
         # Test 3: Database connection
         try:
-            with sqlite3.connect(db.db_path) as conn:
+            with db.connect() as conn:
                 cursor = conn.cursor()
                 cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
                 tables = cursor.fetchall()
@@ -4452,27 +4575,22 @@ async def test_db_command(update: Update, context: CallbackContext) -> None:
 async def show_admin_panel(update: Update, context: CallbackContext) -> None:
     """Show the main admin panel"""
     user = update.effective_user
-    stats = db.get_user_stats()
-    
-    admin_text = f"⚙️ <b>Админ-панель</b>\n\n"
-    admin_text += f"👤 Администратор: {user.first_name}\n"
-    admin_text += f"🆔 ID: {user.id}\n\n"
-    admin_text += f"📊 <b>Статистика:</b>\n"
-    admin_text += f"• Всего пользователей: {stats.get('total_users', 0)}\n"
-    admin_text += f"• Активных: {stats.get('active_users', 0)}\n"
-    admin_text += f"• Заблокированных: {stats.get('blocked_users', 0)}\n"
-    admin_text += f"• С сохраненными словами: {stats.get('users_with_words', 0)}\n"
-    admin_text += f"• Всего слов в базе: {stats.get('total_words', 0)}\n"
-    admin_text += f"• Новых за сегодня: {stats.get('new_users_today', 0)}\n"
-    
-    keyboard = [
-        [InlineKeyboardButton("👥 Управление пользователями", callback_data="admin_users")],
-        [InlineKeyboardButton("🔍 Поиск пользователя", callback_data="admin_search")],
-        [InlineKeyboardButton("📊 Подробная статистика", callback_data="admin_stats")],
-        [InlineKeyboardButton("📖 Инструкция для админа", callback_data="admin_help")],
-        [InlineKeyboardButton("🔙 Назад в меню", callback_data="back_to_main_menu")],
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    stats = cached_user_stats()
+    
+    admin_text = "".join((
+        f"⚙️ <b>Админ-панель</b>\n\n",
+        f"👤 Администратор: {user.first_name}\n",
+        f"🆔 ID: {user.id}\n\n",
+        f"📊 <b>Статистика:</b>\n",
+        f"• Всего пользователей: {stats.get('total_users', 0)}\n",
+        f"• Активных: {stats.get('active_users', 0)}\n",
+        f"• Заблокированных: {stats.get('blocked_users', 0)}\n",
+        f"• С сохраненными словами: {stats.get('users_with_words', 0)}\n",
+        f"• Всего слов в базе: {stats.get('total_words', 0)}\n",
+        f"• Новых за сегодня: {stats.get('new_users_today', 0)}\n",
+    ))
+    
+    reply_markup = _ADMIN_PANEL_MARKUP
     
     if update.callback_query:
         await update.callback_query.edit_message_text(admin_text, reply_markup=reply_markup, parse_mode='HTML')
@@ -4482,7 +4600,7 @@ async def show_admin_panel(update: Update, context: CallbackContext) -> None:
 async def handle_admin_panel_callback(update: Update, context: CallbackContext) -> None:
     """Handle admin panel button clicks"""
     query = update.callback_query
-    await query.answer()
+    _ack(update, context)
     
     if not is_admin(update.effective_user.id):
         await query.edit_message_text("🚫 Доступ запрещен.")
@@ -4492,8 +4610,7 @@ async def handle_admin_panel_callback(update: Update, context: CallbackContext)
 
 async def handle_admin_users(update: Update, context: CallbackContext) -> None:
     """Show user management panel"""
-    query = update.callback_query
-    await query.answer()
+    _ack(update, context)
     
     # Reset pagination when first accessing users panel
     context.user_data['admin_users_offset'] = 0
@@ -4503,13 +4620,15 @@ async def show_admin_users_page(update: Update, context: CallbackContext, offset
     """Show users page with pagination"""
     limit = 10
     users = db.get_all_users(limit=limit, offset=offset)
-    total_users = db.get_user_stats().get('total_users', 0)
+    total_users = cached_user_stats().get('total_users', 0)
     
-    users_text = f"👥 <b>Управление пользователями</b>\n\n"
-    users_text += f"📊 Показано: {offset + 1}-{min(offset + limit, total_users)} из {total_users}\n\n"
+    parts = [
+        f"👥 <b>Управление пользователями</b>\n\n",
+        f"📊 Показано: {offset + 1}-{min(offset + limit, total_users)} из {total_users}\n\n",
+    ]
     
     if not users:
-        users_text += "📝 Пользователи не найдены.\n"
+        parts.append("📝 Пользователи не найдены.\n")
     else:
         for user_id, username, first_name, last_name, is_active, is_blocked, created_at, last_activity in users:
             status_emoji = "🚫" if is_blocked else "✅"
@@ -4518,9 +4637,10 @@ async def show_admin_users_page(update: Update, context: CallbackContext, offset
                 name += f" {last_name}"
             username_text = f"@{username}" if username else "Без username"
             
-            users_text += f"{status_emoji} <b>{name}</b>\n"
-            users_text += f"🆔 {user_id} | {username_text}\n"
-            users_text += f"📅 Регистрация: {created_at[:10]}\n\n"
+            parts.append(f"{status_emoji} <b>{name}</b>\n")
+            parts.append(f"🆔 {user_id} | {username_text}\n")
+            parts.append(f"📅 Регистрация: {created_at[:10]}\n\n")
+    users_text = "".join(parts)
     
     # Build pagination buttons
     keyboard = []
@@ -4538,10 +4658,7 @@ async def show_admin_users_page(update: Update, context: CallbackContext, offset
         keyboard.append(pagination_row)
     
     # Action buttons
-    keyboard.extend([
-        [InlineKeyboardButton("🔍 Поиск пользователя", callback_data="admin_search")],
-        [InlineKeyboardButton("🔙 Назад к админ-панели", callback_data="admin_panel")],
-    ])
+    keyboard.extend(_ADMIN_USERS_ACTION_ROWS)
     
     reply_markup = InlineKeyboardMarkup(keyboard)
     
@@ -4553,9 +4670,9 @@ async def show_admin_users_page(update: Update, context: CallbackContext, offset
 async def handle_admin_search(update: Update, context: CallbackContext) -> None:
     """Handle admin search request"""
     query = update.callback_query
-    await query.answer()
+    _ack(update, context)
     
-    context.user_data['waiting_for_admin_search'] = True
+    set_waiting(context, WaitState.ADMIN_SEARCH)
     
     search_text = "🔍 <b>Поиск пользователя</b>\n\n"
     search_text += "Введите один из параметров для поиска:\n"
@@ -4563,17 +4680,14 @@ async def handle_admin_search(update: Update, context: CallbackContext) -> None:
     search_text += "• Username (например: @username или username)\n"
     search_text += "• Имя пользователя\n"
     
-    keyboard = [
-        [InlineKeyboardButton("❌ Отмена", callback_data="admin_users")],
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    reply_markup = _ADMIN_SEARCH_CANCEL_MARKUP
     
     await query.edit_message_text(search_text, reply_markup=reply_markup, parse_mode='HTML')
 
 async def handle_admin_users_pagination(update: Update, context: CallbackContext) -> None:
     """Handle pagination for admin users"""
     query = update.callback_query
-    await query.answer()
+    _ack(update, context)
     
     # Extract offset from callback data
     callback_data = query.data
@@ -4581,224 +4695,70 @@ async def handle_admin_users_pagination(update: Update, context: CallbackContext
     
     await show_admin_users_page(update, context, offset=offset)
 
-async def handle_admin_detailed_stats(update: Update, context: CallbackContext) -> None:
-    """Handle detailed statistics panel"""
-    query = update.callback_query
-    await query.answer()
-    
-    # Get basic stats
-    stats = db.get_user_stats()
-    
-    # Get additional detailed statistics
-    try:
-        with sqlite3.connect(db.db_path) as conn:
-            cursor = conn.cursor()
-            
-            # Most active users by vocabulary count
-            cursor.execute('''
-                SELECT u.first_name, u.username, u.user_id, COUNT(uw.word) as word_count
-                FROM users u
-                LEFT JOIN user_words uw ON u.user_id = uw.user_id
-                WHERE u.is_active = 1 AND u.is_blocked = 0
-                GROUP BY u.user_id
-                ORDER BY word_count DESC
-                LIMIT 5
-            ''')
-            top_users = cursor.fetchall()
-            
-
-            
-            # Most popular saved words
-            cursor.execute('''
-                SELECT word, COUNT(*) as save_count
-                FROM user_words
-                GROUP BY word
-                ORDER BY save_count DESC
-                LIMIT 5
-            ''')
-            popular_words = cursor.fetchall()
-            
-            # Users by activity (last activity)
-            cursor.execute('''
-                SELECT 
-                    SUM(CASE WHEN last_activity >= datetime('now', '-1 day') THEN 1 ELSE 0 END) as last_24h,
-                    SUM(CASE WHEN last_activity >= datetime('now', '-7 days') THEN 1 ELSE 0 END) as last_7d,
-                    SUM(CASE WHEN last_activity >= datetime('now', '-30 days') THEN 1 ELSE 0 END) as last_30d
-                FROM users
-                WHERE is_active = 1 AND is_blocked = 0
-            ''')
-            activity_stats = cursor.fetchone()
-            
-    except Exception as e:
-        logger.error(f"🔥 Failed to get detailed stats: {e}")
-        top_users = []
-        popular_words = []
-        activity_stats = (0, 0, 0)
-    
-    # Build detailed statistics text
-    stats_text = f"📊 <b>Подробная статистика</b>\n\n"
+def render_detailed_stats(stats: dict, top_users, popular_words, activity_stats) -> str:
+    """Build the admin detailed statistics text"""
+    parts = [f"📊 <b>Подробная статистика</b>\n\n"]
     
     # Basic stats
-    stats_text += f"👥 <b>Общая статистика:</b>\n"
-    stats_text += f"• Всего пользователей: {stats.get('total_users', 0)}\n"
-    stats_text += f"• Активных: {stats.get('active_users', 0)}\n"
-    stats_text += f"• Заблокированных: {stats.get('blocked_users', 0)}\n"
-    stats_text += f"• С сохраненными словами: {stats.get('users_with_words', 0)}\n"
-    stats_text += f"• Всего слов в базе: {stats.get('total_words', 0)}\n\n"
+    parts.append(f"👥 <b>Общая статистика:</b>\n")
+    parts.append(f"• Всего пользователей: {stats.get('total_users', 0)}\n")
+    parts.append(f"• Активных: {stats.get('active_users', 0)}\n")
+    parts.append(f"• Заблокированных: {stats.get('blocked_users', 0)}\n")
+    parts.append(f"• С сохраненными словами: {stats.get('users_with_words', 0)}\n")
+    parts.append(f"• Всего слов в базе: {stats.get('total_words', 0)}\n\n")
     
     # Activity stats
     if activity_stats:
-        stats_text += f"📈 <b>Активность пользователей:</b>\n"
-        stats_text += f"• За 24 часа: {activity_stats[0]}\n"
-        stats_text += f"• За 7 дней: {activity_stats[1]}\n"
-        stats_text += f"• За 30 дней: {activity_stats[2]}\n\n"
+        parts.append(f"📈 <b>Активность пользователей:</b>\n")
+        parts.append(f"• За 24 часа: {activity_stats[0]}\n")
+        parts.append(f"• За 7 дней: {activity_stats[1]}\n")
+        parts.append(f"• За 30 дней: {activity_stats[2]}\n\n")
     
     # Top users by vocabulary
     if top_users:
-        stats_text += f"🏆 <b>Топ пользователей по словарю:</b>\n"
-        for i, (name, username, user_id, word_count) in enumerate(top_users, 1):
-            name_display = name or "Без имени"
-            username_display = f"@{username}" if username else f"ID:{user_id}"
-            stats_text += f"{i}. {name_display} ({username_display}): {word_count} слов\n"
-        stats_text += "\n"
+        parts.append(f"🏆 <b>Топ пользователей по словарю:</b>\n")
+        parts.extend(row[0] for row in top_users)
+        parts.append("\n")
     
     # Popular words
     if popular_words:
-        stats_text += f"📚 <b>Популярные слова:</b>\n"
+        parts.append(f"📚 <b>Популярные слова:</b>\n")
         for word, count in popular_words:
-            stats_text += f"• {word}: {count} сохранений\n"
+            parts.append(f"• {word}: {count} сохранений\n")
+    return "".join(parts)
+
+@cached(ttl=ADMIN_STATS_CACHE_TTL, maxsize=1)
+def render_detailed_stats_cached() -> str:
+    """Rendered detailed stats; failed fetches raise and are not cached"""
+    detailed_stats = db.get_detailed_stats()
+    if detailed_stats is None:
+        raise RuntimeError("detailed stats query failed")
+    return render_detailed_stats(cached_user_stats(), *detailed_stats)
+
+async def handle_admin_detailed_stats(update: Update, context: CallbackContext) -> None:
+    """Handle detailed statistics panel"""
+    _ack(update, context)
     
-    keyboard = [
-        [InlineKeyboardButton("🔄 Обновить", callback_data="admin_stats")],
-        [InlineKeyboardButton("🔙 Назад к админ-панели", callback_data="admin_panel")],
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    try:
+        stats_text = await asyncio.to_thread(render_detailed_stats_cached)
+    except Exception as e:
+        logger.error("🔥 Failed to get detailed stats: %s", e)
+        stats_text = render_detailed_stats(cached_user_stats(), [], [], (0, 0, 0))
     
-    await send_long_message(update, context, stats_text, reply_markup, parse_mode='HTML')
+    await send_long_message(update, context, stats_text, _ADMIN_STATS_MARKUP, parse_mode='HTML')
 
 async def handle_admin_help(update: Update, context: CallbackContext) -> None:
     """Show comprehensive admin instructions"""
     query = update.callback_query
-    await query.answer()
-    
-    help_text = """📖 <b>ПОЛНАЯ ИНСТРУКЦИЯ ДЛЯ АДМИНИСТРАТОРА</b>
-
-══════════════════════════
-🚀 <b>ОСНОВНЫЕ КОМАНДЫ</b>
-══════════════════════════
-
-<b>🔧 Панель управления:</b>
-• <code>/admin</code> - Открыть админ-панель
-• <code>/testdb</code> - Проверить подключение к базе данных
-• <code>/whitelist</code> - Показать статус whitelist
-
-══════════════════════════
-👥 <b>УПРАВЛЕНИЕ ПОЛЬЗОВАТЕЛЯМИ</b>
-══════════════════════════
-
-<b>🔍 Поиск пользователей:</b>
-• В админ-панели → "🔍 Поиск пользователя"
-• Поиск по: ID, username, имени
-• Пример: <code>@username</code>, <code>John</code>, <code>123456789</code>
-
-<b>🚫 Блокировка/разблокировка:</b>
-• <code>/block_123456</code> - Заблокировать пользователя по ID
-• <code>/unblock_123456</code> - Разблокировать пользователя по ID
-
-<b>🗑️ Удаление пользователей:</b>
-• <code>/delete_123456</code> - Удалить пользователя и все его данные
-• ⚠️ <b>Осторожно!</b> Действие необратимо!
-
-══════════════════════════
-🔐 <b>УПРАВЛЕНИЕ WHITELIST</b>
-══════════════════════════
-
-<b>➕ Добавление доступа:</b>
-• <code>/adduser_123456</code> - Добавить пользователя по Telegram ID
-• <code>/addusername_username</code> - Добавить пользователя по username (без @)
-
-<b>➖ Удаление доступа:</b>
-• <code>/removeuser_123456</code> - Удалить пользователя по ID
-• <code>/removeusername_username</code> - Удалить пользователя по username
-
-<b>📋 Примеры:</b>
-• <code>/adduser_546321644</code>
-• <code>/addusername_johnsmith</code>
-• <code>/removeuser_546321644</code>
-• <code>/removeusername_johnsmith</code>
-
-══════════════════════════
-📊 <b>МОНИТОРИНГ И СТАТИСТИКА</b>
-══════════════════════════
-
-<b>📈 Доступная статистика:</b>
-• Общее количество пользователей
-• Активные/заблокированные пользователи
-• Пользователи с сохраненными словами
-• Активность за 24ч/7д/30д
-• Топ пользователей по словарному запасу
-• Популярные сохраненные слова
-
-<b>🔄 Обновление данных:</b>
-• Все статистики обновляются в реальном времени
-• Кнопка "Обновить" для принудительного обновления
-
-══════════════════════════
-🛡️ <b>БЕЗОПАСНОСТЬ И ЛУЧШИЕ ПРАКТИКИ</b>
-══════════════════════════
-
-<b>⚠️ Важные правила:</b>
-• Никогда не удаляйте пользователей без крайней необходимости
-• Блокировка - более безопасная альтернатива удалению
-• Регулярно проверяйте статистику на подозрительную активность
-• Осторожно с командами удаления - они необратимы
-
-<b>🔍 Поиск проблемных пользователей:</b>
-• Используйте поиск для быстрого доступа к конкретным пользователям
-• Проверяйте дату регистрации и последней активности
-• Обращайте внимание на пользователей без имени
-
-<b>📝 Логирование:</b>
-• Все административные действия логируются
-• Проверяйте логи для отслеживания изменений
-• Время блокировки и ID администратора сохраняются
-
-"""
-
-    keyboard = [
-        [InlineKeyboardButton("🔙 Назад к админ-панели", callback_data="admin_panel")],
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    _ack(update, context)
     
     # Send as single message (admin instructions should fit in one message)
     try:
-        await query.edit_message_text(help_text, reply_markup=reply_markup, parse_mode='HTML')
+        await query.edit_message_text(_ADMIN_HELP_TEXT, reply_markup=_BACK_TO_ADMIN_PANEL_MARKUP, parse_mode='HTML')
     except Exception as e:
         # If edit fails (message too long), send truncated version
-        logger.warning(f"Admin help message too long, truncating: {e}")
-        short_help = """📖 <b>ИНСТРУКЦИЯ АДМИНИСТРАТОРА</b>
-
-🚀 <b>Основные команды:</b>
-• <code>/admin</code> - Админ-панель
-• <code>/adminhelp</code> - Быстрая справка
-
-👥 <b>Управление пользователями:</b>
-• <code>/block_ID</code> - Блокировка
-• <code>/unblock_ID</code> - Разблокировка
-• <code>/delete_ID</code> - Удаление (необратимо!)
-
-🔐 <b>Управление доступом:</b>
-• <code>/adduser_ID</code> - Добавить по ID
-• <code>/addusername_name</code> - Добавить по username
-• <code>/removeuser_ID</code> - Удалить по ID
-• <code>/removeusername_name</code> - Удалить по username
-
-🔍 <b>Поиск:</b> Админ-панель → "Поиск пользователя"
-📊 <b>Статистика:</b> Админ-панель → "Подробная статистика"
-
-⚠️ <b>Важно:</b> Удаление пользователей необратимо!"""
-        
-        await query.edit_message_text(short_help, reply_markup=reply_markup, parse_mode='HTML')
+        logger.warning("Admin help message too long, truncating: %s", e)
+        await query.edit_message_text(_ADMIN_HELP_SHORT_TEXT, reply_markup=_BACK_TO_ADMIN_PANEL_MARKUP, parse_mode='HTML')
 
 async def handle_admin_search_input(update: Update, context: CallbackContext) -> None:
     """Handle admin search input"""
@@ -4808,53 +4768,45 @@ async def handle_admin_search_input(update: Update, context: CallbackContext) ->
         return
     
     query = update.message.text.strip()
-    context.user_data.pop('waiting_for_admin_search', None)
+    clear_waiting(context, WaitState.ADMIN_SEARCH)
     
     # Clean username query
     if query.startswith('@'):
         query = query[1:]
     
-    users = db.search_users(query)
+    users = db.search_users_with_counts(query, limit=ADMIN_SEARCH_LIMIT)
     
-    search_text = f"🔍 <b>Результаты поиска: '{query}'</b>\n\n"
+    parts = [f"🔍 <b>Результаты поиска: '{query}'</b>\n\n"]
     
     if not users:
-        search_text += "📝 Пользователи не найдены.\n"
-        keyboard = [
-            [InlineKeyboardButton("🔍 Новый поиск", callback_data="admin_search")],
-            [InlineKeyboardButton("🔙 Назад", callback_data="admin_users")],
-        ]
+        parts.append("📝 Пользователи не найдены.\n")
     else:
-        for user_id, username, first_name, last_name, is_active, is_blocked, created_at, last_activity in users:
+        for user_id, username, first_name, last_name, is_active, is_blocked, created_at, last_activity, vocab_count in users:
             status_emoji = "🚫" if is_blocked else "✅"
             name = first_name or "Без имени"
             if last_name:
-                name += f" {last_name}"
+                name = f"{name} {last_name}"
             username_text = f"@{username}" if username else "Без username"
             
-            search_text += f"{status_emoji} <b>{name}</b>\n"
-            search_text += f"🆔 {user_id} | {username_text}\n"
-            search_text += f"📅 {created_at[:10]} | 🕒 {last_activity[:10]}\n"
-            
-            # Add management buttons for each user
-            vocab_count = db.get_user_vocabulary_count(user_id)
-            search_text += f"📚 Словарь: {vocab_count} слов\n"
-            search_text += f"Действия: /block_{user_id} | /unblock_{user_id} | /delete_{user_id}\n\n"
-        
-        keyboard = [
-            [InlineKeyboardButton("🔍 Новый поиск", callback_data="admin_search")],
-            [InlineKeyboardButton("🔙 Назад", callback_data="admin_users")],
-        ]
+            parts.append(
+                f"{status_emoji} <b>{name}</b>\n"
+                f"🆔 {user_id} | {username_text}\n"
+                f"📅 {created_at[:10]} | 🕒 {last_activity[:10]}\n"
+                f"📚 Словарь: {vocab_count} слов\n"
+                f"Действия: /block_{user_id} | /unblock_{user_id} | /delete_{user_id}\n\n"
+            )
+    if len(users) == ADMIN_SEARCH_LIMIT:
+        parts.append(f"⚠️ Показаны первые {ADMIN_SEARCH_LIMIT} результатов. Уточните запрос.\n")
+    search_text = "".join(parts)
     
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await send_long_message(update, context, search_text, reply_markup, parse_mode='HTML')
+    await send_long_message(update, context, search_text, _ADMIN_SEARCH_RESULTS_MARKUP, parse_mode='HTML')
 
 @require_admin
 async def admin_block_user_command(update: Update, context: CallbackContext) -> None:
     """Handle /block_<user_id> command"""
     command_text = update.message.text
     try:
-        target_user_id = int(command_text.split('_')[1])
+        target_user_id = int(command_text.removeprefix('/block_'))
         admin_id = update.effective_user.id
         
         if target_user_id == admin_id:
@@ -4866,6 +4818,8 @@ async def admin_block_user_command(update: Update, context: CallbackContext) ->
             return
         
         success = db.block_user(target_user_id, admin_id)
+        invalidate_user(target_user_id)
+        render_detailed_stats_cached.cache_clear()
         
         if success:
             await update.message.reply_text(f"✅ Пользователь {target_user_id} заблокирован.")
@@ -4880,9 +4834,11 @@ async def admin_unblock_user_command(update: Update, context: CallbackContext) -
     """Handle /unblock_<user_id> command"""
     command_text = update.message.text
     try:
-        target_user_id = int(command_text.split('_')[1])
+        target_user_id = int(command_text.removeprefix('/unblock_'))
         
         success = db.unblock_user(target_user_id)
+        invalidate_user(target_user_id)
+        render_detailed_stats_cached.cache_clear()
         
         if success:
             await update.message.reply_text(f"✅ Пользователь {target_user_id} разблокирован.")
@@ -4897,7 +4853,7 @@ async def admin_delete_user_command(update: Update, context: CallbackContext) ->
     """Handle /delete_<user_id> command"""
     command_text = update.message.text
     try:
-        target_user_id = int(command_text.split('_')[1])
+        target_user_id = int(command_text.removeprefix('/delete_'))
         admin_id = update.effective_user.id
         
         if target_user_id == admin_id:
@@ -4909,13 +4865,15 @@ async def admin_delete_user_command(update: Update, context: CallbackContext) ->
             return
         
         # Get user info before deletion
-        user_info = db.get_user_info(target_user_id)
+        user_info = cached_user_info(target_user_id)
         if not user_info:
             await update.message.reply_text(f"❌ Пользователь {target_user_id} не найден.")
             return
         
-        vocab_count = db.get_user_vocabulary_count(target_user_id)
+        vocab_count = cached_user_vocabulary_count(target_user_id)
         success = db.delete_user(target_user_id)
+        invalidate_user(target_user_id)
+        render_detailed_stats_cached.cache_clear()
         
         if success:
             name = user_info[2] or "Без имени"
@@ -4936,10 +4894,10 @@ async def admin_add_user_command(update: Update, context: CallbackContext) -> No
     """Add user to whitelist permanently (admin only)"""
     command_text = update.message.text
     try:
-        target_user_id = int(command_text.split('_')[1])
+        target_user_id = int(command_text.removeprefix('/adduser_'))
 
         # Check if user already has access
-        if target_user_id in config.AUTHORIZED_USER_IDS:
+        if target_user_id in _authorized_ids:
             await update.message.reply_text(f"ℹ️ User {target_user_id} already has permanent access.")
             return
 
@@ -4969,7 +4927,7 @@ async def admin_remove_user_command(update: Update, context: CallbackContext) ->
     """Remove user from whitelist permanently (admin only)"""
     command_text = update.message.text
     try:
-        target_user_id = int(command_text.split('_')[1])
+        target_user_id = int(command_text.removeprefix('/removeuser_'))
 
         if target_user_id == update.effective_user.id:
             await update.message.reply_text("❌ You cannot remove yourself from the whitelist!")
@@ -4992,27 +4950,32 @@ async def admin_remove_user_command(update: Update, context: CallbackContext) ->
 @require_admin
 async def admin_whitelist_status_command(update: Update, context: CallbackContext) -> None:
     """Handle /whitelist command - show whitelist status"""
-    status_text = f"🔐 <b>Статус Whitelist</b>\n\n"
-    status_text += f"📊 Состояние: {'🟢 Включен' if config.ENABLE_WHITELIST else '🔴 Выключен'}\n"
-    status_text += f"👥 Авторизованных пользователей: {len(config.AUTHORIZED_USER_IDS)}\n"
-    status_text += f"🏷️ Авторизованных usernames: {len(config.AUTHORIZED_USERNAMES)}\n\n"
-    
-    if config.AUTHORIZED_USER_IDS:
-        status_text += f"📋 <b>ID пользователей:</b>\n"
-        for user_id in config.AUTHORIZED_USER_IDS:
-            admin_mark = " (Админ)" if is_admin(user_id) else ""
-            status_text += f"• {user_id}{admin_mark}\n"
-    
-    if config.AUTHORIZED_USERNAMES:
-        status_text += f"\n📋 <b>Usernames:</b>\n"
-        for username in config.AUTHORIZED_USERNAMES:
-            status_text += f"• @{username}\n"
-    
-    status_text += f"\n💡 <b>Управление:</b>\n"
-    status_text += f"• /adduser_123456 - Добавить по ID\n"
-    status_text += f"• /removeuser_123456 - Удалить по ID\n"
-    status_text += f"• /addusername_username - Добавить по username\n"
-    status_text += f"• /removeusername_username - Удалить по username\n"
+    global _whitelist_status_cache
+    version, status_text = _whitelist_status_cache
+    if version != _whitelist_version:
+        parts = [
+            f"🔐 <b>Статус Whitelist</b>\n\n"
+            f"📊 Состояние: {'🟢 Включен' if config.ENABLE_WHITELIST else '🔴 Выключен'}\n"
+            f"👥 Авторизованных пользователей: {len(config.AUTHORIZED_USER_IDS)}\n"
+            f"🏷️ Авторизованных usernames: {len(config.AUTHORIZED_USERNAMES)}\n\n"
+        ]
+    
+        if config.AUTHORIZED_USER_IDS:
+            # Same rule as is_admin, resolved once for the whole list
+            admin_set = _ADMIN_IDS if config.ENABLE_ADMIN_PANEL else frozenset()
+            parts.append("📋 <b>ID пользователей:</b>\n")
+            parts.extend(
+                f"• {user_id}{' (Админ)' if user_id in admin_set else ''}\n"
+                for user_id in config.AUTHORIZED_USER_IDS
+            )
+    
+        if config.AUTHORIZED_USERNAMES:
+            parts.append("\n📋 <b>Usernames:</b>\n")
+            parts.extend(f"• @{username}\n" for username in config.AUTHORIZED_USERNAMES)
+    
+        parts.append(_WHITELIST_HELP_TEXT)
+        status_text = "".join(parts)
+        _whitelist_status_cache = (_whitelist_version, status_text)
     
     await update.message.reply_text(status_text, parse_mode='HTML')
 
@@ -5021,16 +4984,16 @@ async def admin_add_username_command(update: Update, context: CallbackContext) -
     """Handle /addusername_<username> command"""
     command_text = update.message.text
     try:
-        parts = command_text.split('_', 1)
-        if len(parts) != 2:
+        target_username = command_text.removeprefix('/addusername_').lstrip('@').lower()  # Remove @ if present
+        if not target_username:
             await update.message.reply_text("❌ Неверный формат команды. Используйте: /addusername_username")
             return
-            
-        target_username = parts[1].lower().replace('@', '')  # Remove @ if present
         
         # Add to username whitelist programmatically (for session only)
-        if target_username not in [u.lower() for u in config.AUTHORIZED_USERNAMES]:
+        if target_username not in _authorized_usernames:
             config.AUTHORIZED_USERNAMES.append(target_username)
+            _authorized_usernames[target_username] = target_username
+            _whitelist_changed()
             await update.message.reply_text(
                 f"✅ Username @{target_username} добавлен в whitelist!\n"
                 f"⚠️ Чтобы сохранить навсегда, добавьте username в config.py"
@@ -5046,21 +5009,16 @@ async def admin_remove_username_command(update: Update, context: CallbackContext
     """Handle /removeusername_<username> command"""
     command_text = update.message.text
     try:
-        parts = command_text.split('_', 1)
-        if len(parts) != 2:
+        target_username = command_text.removeprefix('/removeusername_').lstrip('@').lower()  # Remove @ if present
+        if not target_username:
             await update.message.reply_text("❌ Неверный формат команды. Используйте: /removeusername_username")
             return
-            
-        target_username = parts[1].lower().replace('@', '')  # Remove @ if present
         
         # Remove from username whitelist programmatically (for session only)
-        usernames_lower = [u.lower() for u in config.AUTHORIZED_USERNAMES]
-        if target_username in usernames_lower:
-            # Find and remove the original case username
-            for username in config.AUTHORIZED_USERNAMES:
-                if username.lower() == target_username:
-                    config.AUTHORIZED_USERNAMES.remove(username)
-                    break
+        if target_username in _authorized_usernames:
+            # Remove the username as it was spelled in config
+            config.AUTHORIZED_USERNAMES.remove(_authorized_usernames.pop(target_username))
+            _whitelist_changed()
             await update.message.reply_text(
                 f"✅ Username @{target_username} удален из whitelist!\n"
                 f"⚠️ Чтобы сохранить навсегда, удалите username из config.py"
@@ -5077,26 +5035,32 @@ async def handle_writing_check_global(update: Update, context: CallbackContext)
     user = update.effective_user
     
     query = update.callback_query
-    await query.answer()
+    _ack(update, context)
     
     # End any existing conversation
-    if context.user_data.get('waiting_for_writing_topic'):
-        context.user_data.pop('waiting_for_writing_topic', None)
+    clear_waiting(context, WaitState.WRITING_TOPIC)
     if context.user_data.get('selected_writing_task_type'):
         context.user_data.pop('selected_writing_task_type', None)
     if context.user_data.get('current_writing_topic'):
         context.user_data.pop('current_writing_topic', None)
     
     # Set the user in writing check task mode
-    context.user_data['waiting_for_writing_check_task'] = True
+    set_waiting(context, WaitState.WRITING_CHECK_TASK)
     
-    keyboard = [
-        [InlineKeyboardButton("🔙 Назад к письму", callback_data="menu_writing")],
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    reply_markup = _BACK_TO_WRITING_MARKUP
     await query.edit_message_text(
-        "📝 Для проверки вашего письма мне нужна информация о задании.\n\n"
-        "Пожалуйста, опишите задание IELTS Writing Task, которое вы выполняли.\n"
-        "Например: 'Напишите эссе о преимуществах и недостатках социальных сетей'",
+        _WRITING_CHECK_PROMPT,
         reply_markup=reply_markup
     )
+
+# --- Global text input dispatch (defined last so every handler exists) ---
+_TEXT_MODE_DISPATCH = (
+    (WaitState.VOCAB_TOPIC, handle_vocabulary_topic_input),
+    (WaitState.GRAMMAR_TOPIC, handle_grammar_topic_input),
+    (WaitState.WRITING_TOPIC, handle_writing_topic_input),
+    (WaitState.WRITING_CHECK_TASK, handle_writing_check_task_input),
+    (WaitState.WRITING_CHECK_ESSAY, handle_writing_check_essay_input),
+    (WaitState.ADMIN_SEARCH, handle_admin_search_input),
+)
+_TEXT_MODE_MASK = (WaitState.VOCAB_TOPIC | WaitState.GRAMMAR_TOPIC | WaitState.WRITING_TOPIC |
+                   WaitState.WRITING_CHECK_TASK | WaitState.WRITING_CHECK_ESSAY | WaitState.ADMIN_SEARCH)
@@ -1,23 +1,76 @@
 # database.py
 import sqlite3
 import logging
-from datetime import datetime
-from typing import List, Tuple, Optional
+import queue
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, List, Tuple, Optional, Set
 import os
 
 logger = logging.getLogger(__name__)
 
+class ConnectionPool:
+    """Keeps up to `size` idle SQLite connections open for reuse across calls"""
+    def __init__(self, factory, size: int = 8):
+        self._factory = factory
+        self._idle = queue.LifoQueue(maxsize=size)
+    
+    @contextmanager
+    def connection(self):
+        """Borrow a connection; commits on success, rolls back on error, then returns it to the pool"""
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            # Pool exhausted (burst or nested call): open an extra connection rather than wait
+            conn = self._factory()
+        try:
+            with conn:
+                yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            try:
+                self._idle.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+    
+    def close_all(self) -> None:
+        """Close every idle connection"""
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
 class DatabaseManager:
-    def __init__(self, db_path: str = "ace_bot.db"):
+    def __init__(self, db_path: str = "ace_bot.db", pool_size: int = 8):
         self.db_path = db_path
+        self.pool = ConnectionPool(self._open_connection, pool_size)
         self.init_database()
     
+    def _open_connection(self) -> sqlite3.Connection:
+        """Open a connection with per-connection performance pragmas applied"""
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        conn.execute('PRAGMA mmap_size=268435456')
+        conn.execute('PRAGMA cache_size=-20000')
+        return conn
+    
+    def connect(self):
+        """Borrow a pooled connection for the duration of a `with` block"""
+        return self.pool.connection()
+    
     def init_database(self):
         """Initialize the database with required tables"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.connect() as conn:
                 cursor = conn.cursor()
                 
+                # WAL is persistent in the database file: readers no longer block on writers
+                cursor.execute('PRAGMA journal_mode=WAL')
+                
                 # Create users table
                 cursor.execute('''
                     CREATE TABLE IF NOT EXISTS users (
@@ -304,6 +357,11 @@ class DatabaseManager:
                 cursor.execute('CREATE INDEX IF NOT EXISTS idx_group_sent_words ON group_sent_words (group_id, sent_at)')
                 cursor.execute('CREATE INDEX IF NOT EXISTS idx_group_activity ON group_chats (last_activity)')
                 
+                # Vocabulary indexes: per-user pages ordered by saved_at, popular-words GROUP BY
+                cursor.execute('CREATE INDEX IF NOT EXISTS idx_user_words_user_saved ON user_words (user_id, saved_at DESC)')
+                cursor.execute('CREATE INDEX IF NOT EXISTS idx_user_words_word ON user_words (word)')
+                cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_active_activity ON users (is_active, is_blocked, last_activity)')
+                
                 # Flashcard system indexes
                 cursor.execute('CREATE INDEX IF NOT EXISTS idx_flashcards_deck ON flashcards (deck_id)')
                 cursor.execute('CREATE INDEX IF NOT EXISTS idx_user_progress_due ON user_card_progress (user_id, due_date)')
@@ -314,6 +372,9 @@ class DatabaseManager:
                 cursor.execute('CREATE INDEX IF NOT EXISTS idx_deck_creator ON flashcard_decks (creator_user_id)')
                 
                 conn.commit()
+                
+                # Refresh planner statistics so the indexes above are picked up
+                cursor.execute('ANALYZE')
                 logger.info("✅ Database initialized successfully")
                 
         except Exception as e:
@@ -444,7 +505,7 @@ class DatabaseManager:
     def add_user(self, user_id: int, username: str = None, first_name: str = None, last_name: str = None) -> bool:
         """Add or update user information"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.connect() as conn:
                 cursor = conn.cursor()
                 cursor.execute('''
                     INSERT OR REPLACE INTO users 
@@ -461,7 +522,7 @@ class DatabaseManager:
     def update_user_activity(self, user_id: int):
         """Update user's last activity timestamp"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.connect() as conn:
                 cursor = conn.cursor()
                 cursor.execute('''
                     UPDATE users SET last_activity = CURRENT_TIMESTAMP WHERE user_id = ?
@@ -470,17 +531,49 @@ class DatabaseManager:
         except Exception as e:
             logger.error(f"🔥 Failed to update activity for user {user_id}: {e}")
     
+    def add_users(self, rows: List[Tuple]) -> bool:
+        """Add or update several users at once; rows are (user_id, username, first_name, last_name)"""
+        try:
+            with self.connect() as conn:
+                conn.executemany('''
+                    INSERT OR REPLACE INTO users 
+                    (user_id, username, first_name, last_name, last_activity)
+                    VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+                ''', rows)
+                conn.commit()
+                logger.info(f"✅ {len(rows)} user(s) added/updated in database")
+                return True
+        except Exception as e:
+            logger.error(f"🔥 Failed to add {len(rows)} user(s): {e}")
+            return False
+    
+    def update_users_activity(self, user_ids: Iterable[int]):
+        """Update last activity timestamps for several users at once"""
+        try:
+            with self.connect() as conn:
+                conn.executemany('''
+                    UPDATE users SET last_activity = CURRENT_TIMESTAMP WHERE user_id = ?
+                ''', [(user_id,) for user_id in user_ids])
+                conn.commit()
+        except Exception as e:
+            logger.error(f"🔥 Failed to update activity for users: {e}")
+    
+    def _insert_user_word(self, cursor, user_id: int, word: str, definition: str,
+                          translation: str, example: str, topic: str):
+        """Insert or replace a vocabulary word (stored lowercased and stripped); caller commits"""
+        cursor.execute('''
+            INSERT OR REPLACE INTO user_words 
+            (user_id, word, definition, translation, example, topic, saved_at)
+            VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+        ''', (user_id, word.lower().strip(), definition, translation, example, topic))
+    
     def save_word_to_user_vocabulary(self, user_id: int, word: str, definition: str = None, 
                                    translation: str = None, example: str = None, topic: str = None) -> bool:
         """Save a word to user's personal vocabulary"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.connect() as conn:
                 cursor = conn.cursor()
-                cursor.execute('''
-                    INSERT OR REPLACE INTO user_words 
-                    (user_id, word, definition, translation, example, topic, saved_at)
-                    VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
-                ''', (user_id, word.lower().strip(), definition, translation, example, topic))
+                self._insert_user_word(cursor, user_id, word, definition, translation, example, topic)
                 conn.commit()
                 logger.info(f"✅ Word '{word}' saved to user {user_id}'s vocabulary")
                 return True
@@ -488,19 +581,62 @@ class DatabaseManager:
             logger.error(f"🔥 Failed to save word '{word}' for user {user_id}: {e}")
             return False
     
-    def get_user_vocabulary(self, user_id: int, limit: int = 50) -> List[Tuple]:
-        """Get user's saved vocabulary words"""
+    def save_word_and_get_count(self, user_id: int, word: str, definition: str = None,
+                                translation: str = None, example: str = None, topic: str = None) -> Optional[int]:
+        """Save a word to user's vocabulary and return the new vocabulary size (None on failure)"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.connect() as conn:
                 cursor = conn.cursor()
-                cursor.execute('''
-                    SELECT word, definition, translation, example, topic, saved_at
-                    FROM user_words 
-                    WHERE user_id = ? 
-                    ORDER BY saved_at DESC 
-                    LIMIT ?
-                ''', (user_id, limit))
-                words = cursor.fetchall()
+                self._insert_user_word(cursor, user_id, word, definition, translation, example, topic)
+                cursor.execute('SELECT COUNT(*) FROM user_words WHERE user_id = ?', (user_id,))
+                count = cursor.fetchone()[0]
+                conn.commit()
+                logger.info(f"✅ Word '{word}' saved to user {user_id}'s vocabulary")
+                return int(count)
+        except Exception as e:
+            logger.error(f"🔥 Failed to save word '{word}' for user {user_id}: {e}")
+            return None
+    
+    def get_user_vocabulary(self, user_id: int, limit: int = 50,
+                            before: Optional[Tuple[str, int]] = None,
+                            after: Optional[Tuple[str, int]] = None) -> List[Tuple]:
+        """Get user's saved vocabulary words, newest first.
+
+        ``before``/``after`` are ``(saved_at, id)`` cursors for keyset pagination;
+        saved_at only has one-second resolution, so the id breaks ties. Each row
+        ends with the word's id.
+        """
+        try:
+            with self.connect() as conn:
+                cursor = conn.cursor()
+                if after is not None:
+                    # Walk towards newer words, then restore newest-first order
+                    cursor.execute('''
+                        SELECT word, definition, translation, example, topic, saved_at, id
+                        FROM user_words 
+                        WHERE user_id = ? AND (saved_at, id) > (?, ?)
+                        ORDER BY saved_at ASC, id ASC 
+                        LIMIT ?
+                    ''', (user_id, *after, limit))
+                    words = cursor.fetchall()[::-1]
+                elif before is not None:
+                    cursor.execute('''
+                        SELECT word, definition, translation, example, topic, saved_at, id
+                        FROM user_words 
+                        WHERE user_id = ? AND (saved_at, id) < (?, ?)
+                        ORDER BY saved_at DESC, id DESC 
+                        LIMIT ?
+                    ''', (user_id, *before, limit))
+                    words = cursor.fetchall()
+                else:
+                    cursor.execute('''
+                        SELECT word, definition, translation, example, topic, saved_at, id
+                        FROM user_words 
+                        WHERE user_id = ? 
+                        ORDER BY saved_at DESC, id DESC 
+                        LIMIT ?
+                    ''', (user_id, limit))
+                    words = cursor.fetchall()
                 logger.info(f"✅ Retrieved {len(words)} words for user {user_id}")
                 return words
         except Exception as e:
@@ -510,7 +646,7 @@ class DatabaseManager:
     def remove_word_from_user_vocabulary(self, user_id: int, word: str) -> bool:
         """Remove a word from user's vocabulary"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.connect() as conn:
                 cursor = conn.cursor()
                 cursor.execute('''
                     DELETE FROM user_words 
@@ -527,10 +663,22 @@ class DatabaseManager:
             logger.error(f"🔥 Failed to remove word '{word}' for user {user_id}: {e}")
             return False
     
+    def clear_user_vocabulary(self, user_id: int) -> Optional[int]:
+        """Delete every word in user's vocabulary; returns the number removed (None on failure)"""
+        try:
+            with self.connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute('DELETE FROM user_words WHERE user_id = ?', (user_id,))
+                conn.commit()
+                return cursor.rowcount
+        except Exception as e:
+            logger.error(f"🔥 Failed to clear vocabulary for user {user_id}: {e}")
+            return None
+    
     def get_user_vocabulary_count(self, user_id: int) -> int:
         """Get the count of words in user's vocabulary"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.connect() as conn:
                 cursor = conn.cursor()
                 cursor.execute('SELECT COUNT(*) FROM user_words WHERE user_id = ?', (user_id,))
                 result = cursor.fetchone()
@@ -550,7 +698,7 @@ class DatabaseManager:
     def word_exists_in_user_vocabulary(self, user_id: int, word: str) -> bool:
         """Check if a word already exists in user's vocabulary"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.connect() as conn:
                 cursor = conn.cursor()
                 cursor.execute('''
                     SELECT 1 FROM user_words 
@@ -561,10 +709,21 @@ class DatabaseManager:
             logger.error(f"🔥 Failed to check word existence for user {user_id}: {e}")
             return False
 
+    def get_user_words(self, user_id: int) -> Set[str]:
+        """Get the set of words in a user's vocabulary (stored lowercased and stripped)"""
+        try:
+            with self.connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute('SELECT word FROM user_words WHERE user_id = ?', (user_id,))
+                return {row[0] for row in cursor.fetchall()}
+        except Exception as e:
+            logger.error(f"🔥 Failed to get word set for user {user_id}: {e}")
+            return set()
+
     def get_user_info(self, user_id: int) -> Optional[Tuple]:
         """Get user information"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.connect() as conn:
                 cursor = conn.cursor()
                 cursor.execute('''
                     SELECT user_id, username, first_name, last_name, is_active, is_blocked, 
@@ -587,7 +746,7 @@ class DatabaseManager:
     def save_question_history(self, user_id: int, part_number: int, question_text: str, topic: str = None) -> bool:
         """Persist generated question to history for deduplication."""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.connect() as conn:
                 cursor = conn.cursor()
                 cursor.execute('''
                     INSERT INTO speaking_question_history (user_id, part_number, question_text, topic)
@@ -602,7 +761,7 @@ class DatabaseManager:
     def get_recent_questions(self, user_id: int, part_number: int, limit: int = 200) -> List[str]:
         """Fetch recent generated questions for a user and part."""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.connect() as conn:
                 cursor = conn.cursor()
                 cursor.execute('''
                     SELECT question_text FROM speaking_question_history
@@ -619,7 +778,7 @@ class DatabaseManager:
     def get_recent_topics(self, user_id: int, part_number: int, window_days: int = 30) -> List[str]:
         """Fetch distinct topics used recently to avoid repeats across sessions."""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.connect() as conn:
                 cursor = conn.cursor()
                 cursor.execute('''
                     SELECT DISTINCT COALESCE(topic, '') FROM speaking_question_history
@@ -637,7 +796,7 @@ class DatabaseManager:
     def get_all_users(self, limit: int = 100, offset: int = 0) -> List[Tuple]:
         """Get all users with pagination (admin only)"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.connect() as conn:
                 cursor = conn.cursor()
                 cursor.execute('''
                     SELECT user_id, username, first_name, last_name, is_active, is_blocked,
@@ -656,7 +815,7 @@ class DatabaseManager:
     def get_user_stats(self) -> dict:
         """Get user statistics (admin only)"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.connect() as conn:
                 cursor = conn.cursor()
                 
                 # Total users
@@ -698,10 +857,58 @@ class DatabaseManager:
             logger.error(f"🔥 Failed to get user stats: {e}")
             return {}
     
+    def get_detailed_stats(self) -> Optional[Tuple]:
+        """Top users, popular words and activity counts for the admin stats panel (None on failure)"""
+        try:
+            with self.connect() as conn:
+                # Top users come back pre-formatted as display lines, numbered by rank
+                top_users = conn.execute('''
+                    SELECT printf('%d. %s (%s): %d слов', rn, name_display, username_display, word_count) || char(10)
+                    FROM (
+                        SELECT COALESCE(NULLIF(u.first_name, ''), 'Без имени') as name_display,
+                               CASE WHEN u.username IS NOT NULL AND u.username != '' THEN '@' || u.username
+                                    ELSE 'ID:' || u.user_id END as username_display,
+                               COUNT(uw.word) as word_count,
+                               row_number() OVER (ORDER BY COUNT(uw.word) DESC) as rn
+                        FROM users u
+                        LEFT JOIN user_words uw ON u.user_id = uw.user_id
+                        WHERE u.is_active = 1 AND u.is_blocked = 0
+                        GROUP BY u.user_id
+                        ORDER BY word_count DESC
+                        LIMIT 5
+                    )
+                    ORDER BY rn
+                ''').fetchall()
+                
+                popular_words = conn.execute('''
+                    SELECT word, COUNT(*) as save_count
+                    FROM user_words
+                    GROUP BY word
+                    ORDER BY save_count DESC
+                    LIMIT 5
+                ''').fetchall()
+                
+                # Thresholds are bound as 'YYYY-MM-DD HH:MM:SS' UTC strings (same format as CURRENT_TIMESTAMP)
+                now = datetime.now(timezone.utc)
+                d1, d7, d30 = ((now - timedelta(days=days)).strftime('%Y-%m-%d %H:%M:%S') for days in (1, 7, 30))
+                activity_stats = conn.execute('''
+                    SELECT 
+                        COALESCE(SUM(CASE WHEN last_activity >= ? THEN 1 ELSE 0 END), 0) as last_24h,
+                        COALESCE(SUM(CASE WHEN last_activity >= ? THEN 1 ELSE 0 END), 0) as last_7d,
+                        COUNT(*) as last_30d
+                    FROM users
+                    WHERE is_active = 1 AND is_blocked = 0 AND last_activity >= ?
+                ''', (d1, d7, d30)).fetchone()
+                
+                return top_users, popular_words, activity_stats
+        except Exception as e:
+            logger.error(f"🔥 Failed to get detailed stats: {e}")
+            return None
+    
     def block_user(self, user_id: int, admin_id: int) -> bool:
         """Block a user (admin only)"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.connect() as conn:
                 cursor = conn.cursor()
                 cursor.execute('''
                     UPDATE users 
@@ -723,7 +930,7 @@ class DatabaseManager:
     def unblock_user(self, user_id: int) -> bool:
         """Unblock a user (admin only)"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.connect() as conn:
                 cursor = conn.cursor()
                 cursor.execute('''
                     UPDATE users 
@@ -745,7 +952,7 @@ class DatabaseManager:
     def delete_user(self, user_id: int) -> bool:
         """Delete a user and all their data (admin only)"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.connect() as conn:
                 cursor = conn.cursor()
                 
                 # Delete user's words first
@@ -771,7 +978,7 @@ class DatabaseManager:
     def is_user_blocked(self, user_id: int) -> bool:
         """Check if a user is blocked"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.connect() as conn:
                 cursor = conn.cursor()
                 cursor.execute('SELECT is_blocked FROM users WHERE user_id = ?', (user_id,))
                 result = cursor.fetchone()
@@ -780,10 +987,10 @@ class DatabaseManager:
             logger.error(f"🔥 Failed to check if user {user_id} is blocked: {e}")
             return False
     
-    def search_users(self, query: str) -> List[Tuple]:
+    def search_users(self, query: str, limit: int = 50) -> List[Tuple]:
         """Search users by username, first_name, or user_id (admin only)"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.connect() as conn:
                 cursor = conn.cursor()
                 
                 # Try to search by user_id if query is numeric
@@ -793,16 +1000,49 @@ class DatabaseManager:
                                created_at, last_activity
                         FROM users 
                         WHERE user_id = ? OR username LIKE ? OR first_name LIKE ?
-                        ORDER BY created_at DESC
-                    ''', (int(query), f'%{query}%', f'%{query}%'))
+                        ORDER BY last_activity DESC
+                        LIMIT ?
+                    ''', (int(query), f'%{query}%', f'%{query}%', limit))
                 else:
                     cursor.execute('''
                         SELECT user_id, username, first_name, last_name, is_active, is_blocked,
                                created_at, last_activity
                         FROM users 
                         WHERE username LIKE ? OR first_name LIKE ? OR last_name LIKE ?
-                        ORDER BY created_at DESC
-                    ''', (f'%{query}%', f'%{query}%', f'%{query}%'))
+                        ORDER BY last_activity DESC
+                        LIMIT ?
+                    ''', (f'%{query}%', f'%{query}%', f'%{query}%', limit))
+                
+                users = cursor.fetchall()
+                logger.info(f"✅ Found {len(users)} users matching '{query}'")
+                return users
+        except Exception as e:
+            logger.error(f"🔥 Failed to search users with query '{query}': {e}")
+            return []
+    
+    def search_users_with_counts(self, query: str, limit: int = 50) -> List[Tuple]:
+        """Search users like search_users, with each user's vocabulary size as the last column"""
+        try:
+            with self.connect() as conn:
+                cursor = conn.cursor()
+                
+                if query.isdigit():
+                    where = 'u.user_id = ? OR u.username LIKE ? OR u.first_name LIKE ?'
+                    params = (int(query), f'%{query}%', f'%{query}%')
+                else:
+                    where = 'u.username LIKE ? OR u.first_name LIKE ? OR u.last_name LIKE ?'
+                    params = (f'%{query}%', f'%{query}%', f'%{query}%')
+                
+                cursor.execute(f'''
+                    SELECT u.user_id, u.username, u.first_name, u.last_name, u.is_active, u.is_blocked,
+                           u.created_at, u.last_activity, COUNT(uw.id) as vocab_count
+                    FROM users u
+                    LEFT JOIN user_words uw ON uw.user_id = u.user_id
+                    WHERE {where}
+                    GROUP BY u.user_id
+                    ORDER BY u.last_activity DESC
+                    LIMIT ?
+                ''', (*params, limit))
                 
                 users = cursor.fetchall()
                 logger.info(f"✅ Found {len(users)} users matching '{query}'")
@@ -814,9 +1054,8 @@ class DatabaseManager:
     def create_speaking_simulation(self, user_id: int) -> str:
         """Create new speaking simulation session"""
         try:
-            import time
             session_id = f"sim_{user_id}_{int(time.time())}"
-            with sqlite3.connect(self.db_path) as conn:
+            with self.connect() as conn:
                 cursor = conn.cursor()
                 cursor.execute('''
                     INSERT INTO speaking_simulations (user_id, session_id, started_at)
@@ -833,7 +1072,7 @@ class DatabaseManager:
                           prompt: str, transcription: str, scores: dict, evaluation: str) -> bool:
         """Save individual part response with detailed scores"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.connect() as conn:
                 cursor = conn.cursor()
                 cursor.execute('''
                     INSERT OR REPLACE INTO speaking_part_responses 
@@ -856,7 +1095,7 @@ class DatabaseManager:
                            complete_feedback: str = None) -> bool:
         """Mark simulation as completed with final scores and save complete feedback"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.connect() as conn:
                 cursor = conn.cursor()
                 cursor.execute('''
                     UPDATE speaking_simulations 
@@ -923,7 +1162,7 @@ class DatabaseManager:
     def get_simulation_details(self, session_id: str) -> dict:
         """Get detailed information about a specific simulation"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.connect() as conn:
                 cursor = conn.cursor()
                 # Get simulation info
                 cursor.execute('''
@@ -958,7 +1197,7 @@ class DatabaseManager:
     def abandon_simulation(self, session_id: str) -> bool:
         """Mark simulation as abandoned"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.connect() as conn:
                 cursor = conn.cursor()
                 cursor.execute('''
                     UPDATE speaking_simulations 
@@ -975,7 +1214,7 @@ class DatabaseManager:
     def get_user_speaking_stats(self, user_id: int) -> dict:
         """Get user's speaking statistics"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.connect() as conn:
                 cursor = conn.cursor()
                 cursor.execute('''
                     SELECT total_simulations, completed_simulations, average_overall_score,
@@ -1036,7 +1275,7 @@ class DatabaseManager:
     def recalculate_speaking_stats(self, user_id: int) -> bool:
         """Recalculate speaking statistics for a user based on their existing simulations"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.connect() as conn:
                 cursor = conn.cursor()
                 
                 # Get all completed speaking simulations for the user
@@ -1086,7 +1325,7 @@ class DatabaseManager:
                                grammatical_range_score: float = None, evaluation_feedback: str = "") -> bool:
         """Save a writing evaluation to the database"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.connect() as conn:
                 cursor = conn.cursor()
                 
                 # Execute the INSERT statement with exact column specification
@@ -1154,7 +1393,7 @@ class DatabaseManager:
     def get_user_writing_stats(self, user_id: int) -> dict:
         """Get user's writing statistics"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.connect() as conn:
                 cursor = conn.cursor()
                 cursor.execute('''
                     SELECT total_evaluations, average_overall_score, best_overall_score,
@@ -1222,10 +1461,68 @@ class DatabaseManager:
                 'last_evaluation_date': None
             }
 
+    def get_user_profile_bundle(self, user_id: int) -> dict:
+        """Get vocabulary count, speaking stats and writing stats for the profile screen in one query"""
+        try:
+            with self.connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    SELECT (SELECT COUNT(*) FROM user_words WHERE user_id = u.user_id),
+                           s.total_simulations, s.completed_simulations, s.average_overall_score,
+                           s.best_overall_score, s.total_practice_time_minutes, s.last_simulation_date,
+                           w.total_evaluations, w.average_overall_score, w.best_overall_score,
+                           w.average_task_response_score, w.average_coherence_cohesion_score,
+                           w.average_lexical_resource_score, w.average_grammatical_range_score,
+                           w.last_evaluation_date
+                    FROM (SELECT ? AS user_id) u
+                    LEFT JOIN user_speaking_stats s ON s.user_id = u.user_id
+                    LEFT JOIN user_writing_stats w ON w.user_id = u.user_id
+                ''', (user_id,))
+                result = cursor.fetchone()
+        except Exception as e:
+            logger.error(f"🔥 Failed to get profile bundle for user {user_id}: {e}")
+            result = None
+        
+        if result is None:
+            return {
+                'vocabulary_count': self.get_user_vocabulary_count(user_id),
+                'speaking': self.get_user_speaking_stats(user_id),
+                'writing': self.get_user_writing_stats(user_id)
+            }
+        
+        # Missing or empty stats rows go through the single-section getters, which repair stale stats
+        if result[1]:
+            speaking = {
+                'total_simulations': result[1],
+                'completed_simulations': result[2],
+                'average_overall_score': result[3],
+                'best_overall_score': result[4],
+                'total_practice_time_minutes': result[5],
+                'last_simulation_date': result[6]
+            }
+        else:
+            speaking = self.get_user_speaking_stats(user_id)
+        
+        if result[7]:
+            writing = {
+                'total_evaluations': result[7],
+                'average_overall_score': result[8],
+                'best_overall_score': result[9],
+                'average_task_response_score': result[10],
+                'average_coherence_cohesion_score': result[11],
+                'average_lexical_resource_score': result[12],
+                'average_grammatical_range_score': result[13],
+                'last_evaluation_date': result[14]
+            }
+        else:
+            writing = self.get_user_writing_stats(user_id)
+        
+        return {'vocabulary_count': int(result[0] or 0), 'speaking': speaking, 'writing': writing}
+    
     def get_recent_writing_evaluations(self, user_id: int, limit: int = 5) -> List[Tuple]:
         """Get recent writing evaluations for a user"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.connect() as conn:
                 cursor = conn.cursor()
                 cursor.execute('''
                     SELECT task_description, overall_score, evaluated_at
@@ -1244,7 +1541,7 @@ class DatabaseManager:
     def recalculate_writing_stats(self, user_id: int) -> bool:
         """Recalculate writing statistics for a user based on their existing evaluations"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.connect() as conn:
                 cursor = conn.cursor()
                 
                 # Get all writing evaluations for the user
@@ -1302,7 +1599,7 @@ class DatabaseManager:
     def add_group_chat(self, group_id: int, group_title: str, group_type: str) -> bool:
         """Add or update group chat information"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.connect() as conn:
                 cursor = conn.cursor()
                 cursor.execute('''
                     INSERT OR REPLACE INTO group_chats 
@@ -1319,7 +1616,7 @@ class DatabaseManager:
     def get_group_sent_words(self, group_id: int, limit: int = 100) -> List[Tuple]:
         """Get words sent to a specific group"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.connect() as conn:
                 cursor = conn.cursor()
                 cursor.execute('''
                     SELECT word, definition, translation, example, sent_at, sent_by_user_id
@@ -1338,7 +1635,7 @@ class DatabaseManager:
     def is_word_sent_to_group(self, group_id: int, word: str) -> bool:
         """Check if a word has already been sent to a specific group"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.connect() as conn:
                 cursor = conn.cursor()
                 cursor.execute('''
                     SELECT 1 FROM group_sent_words 
@@ -1349,11 +1646,22 @@ class DatabaseManager:
             logger.error(f"🔥 Failed to check word existence for group {group_id}: {e}")
             return False
     
+    def get_sent_words_for_group(self, group_id: int) -> Set[str]:
+        """Get the lowercased set of every word already sent to a group"""
+        try:
+            with self.connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute('SELECT word FROM group_sent_words WHERE group_id = ?', (group_id,))
+                return {row[0].strip().lower() for row in cursor.fetchall() if row[0]}
+        except Exception as e:
+            logger.error(f"🔥 Failed to get sent word set for group {group_id}: {e}")
+            return set()
+    
     def save_word_to_group(self, group_id: int, word: str, definition: str, 
                           translation: str, example: str, sent_by_user_id: int) -> bool:
         """Save a word as sent to a specific group"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.connect() as conn:
                 cursor = conn.cursor()
                 cursor.execute('''
                     INSERT OR REPLACE INTO group_sent_words 
@@ -1378,7 +1686,7 @@ class DatabaseManager:
     def get_group_settings(self, group_id: int) -> dict:
         """Get settings for a specific group"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.connect() as conn:
                 cursor = conn.cursor()
                 cursor.execute('''
                     SELECT auto_send_enabled, send_interval_hours, word_difficulty, last_auto_send
@@ -1409,7 +1717,7 @@ class DatabaseManager:
     def update_group_settings(self, group_id: int, **settings) -> bool:
         """Update settings for a specific group"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.connect() as conn:
                 cursor = conn.cursor()
                 
                 # Insert or update settings
@@ -1435,7 +1743,7 @@ class DatabaseManager:
     def get_group_stats(self, group_id: int = None) -> dict:
         """Get statistics for groups"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.connect() as conn:
                 cursor = conn.cursor()
                 
                 if group_id:
@@ -1480,7 +1788,7 @@ class DatabaseManager:
     def get_all_groups(self, limit: int = 50) -> List[Tuple]:
         """Get all groups (admin only)"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.connect() as conn:
                 cursor = conn.cursor()
                 cursor.execute('''
                     SELECT gc.group_id, gc.group_title, gc.group_type, gc.added_at, gc.last_activity,
@@ -1502,7 +1810,7 @@ class DatabaseManager:
     def clear_group_words(self, group_id: int) -> bool:
         """Clear all words sent to a specific group (admin only)"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.connect() as conn:
                 cursor = conn.cursor()
                 cursor.execute('DELETE FROM group_sent_words WHERE group_id = ?', (group_id,))
                 deleted_count = cursor.rowcount
@@ -1521,7 +1829,7 @@ class DatabaseManager:
     def get_groups_with_auto_send(self) -> List[Tuple]:
         """Get all groups with auto-send enabled"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.connect() as conn:
                 cursor = conn.cursor()
                 cursor.execute('''
                     SELECT gc.group_id, gc.group_title, gs.last_auto_send, gs.send_interval_hours
@@ -1542,7 +1850,7 @@ class DatabaseManager:
     def create_deck(self, user_id: int, name: str, description: str = "", category: str = "General", is_public: bool = False) -> int:
         """Create a new flashcard deck"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.connect() as conn:
                 cursor = conn.cursor()
                 cursor.execute('''
                     INSERT INTO flashcard_decks (name, description, creator_user_id, category, is_public)
@@ -1559,7 +1867,7 @@ class DatabaseManager:
     def create_flashcard(self, deck_id: int, front_text: str, back_text: str, tags: str = "", difficulty: int = 1) -> int:
         """Create a new flashcard"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.connect() as conn:
                 cursor = conn.cursor()
                 cursor.execute('''
                     INSERT INTO flashcards (deck_id, front_text, back_text, tags, difficulty)
@@ -1584,7 +1892,7 @@ class DatabaseManager:
     def get_user_decks(self, user_id: int) -> List[Tuple]:
         """Get all decks for a user (created + subscribed)"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.connect() as conn:
                 cursor = conn.cursor()
                 cursor.execute('''
                     SELECT DISTINCT d.id, d.name, d.description, d.category, d.card_count, 
@@ -1605,7 +1913,7 @@ class DatabaseManager:
     def get_due_cards(self, user_id: int, limit: int = 20) -> List[Tuple]:
         """Get cards due for review using spaced repetition"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.connect() as conn:
                 cursor = conn.cursor()
                 cursor.execute('''
                     SELECT c.id, c.deck_id, c.front_text, c.back_text, c.tags, c.difficulty,
@@ -1628,7 +1936,7 @@ class DatabaseManager:
     def get_new_cards(self, user_id: int, limit: int = 10) -> List[Tuple]:
         """Get new cards that haven't been studied yet"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.connect() as conn:
                 cursor = conn.cursor()
                 cursor.execute('''
                     SELECT c.id, c.deck_id, c.front_text, c.back_text, c.tags, c.difficulty,
@@ -1656,7 +1964,6 @@ class DatabaseManager:
         Rating: 1=Again, 2=Hard, 3=Good, 4=Easy
         Returns: (new_ease_factor, new_interval)
         """
-        from datetime import timedelta
         
         if rating < 3:  # Again or Hard
             new_interval = 1
@@ -1678,7 +1985,7 @@ class DatabaseManager:
     def review_card(self, user_id: int, card_id: int, rating: int, time_spent: int = 0) -> bool:
         """Record card review and update spaced repetition data"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.connect() as conn:
                 cursor = conn.cursor()
                 
                 # Get current progress or create new
@@ -1705,7 +2012,6 @@ class DatabaseManager:
                 else:
                     new_streak = 0
                 
-                from datetime import datetime, timedelta
                 due_date = (datetime.now() + timedelta(days=new_interval)).date()
                 
                 # Insert or update progress
@@ -1730,7 +2036,7 @@ class DatabaseManager:
     def get_study_stats(self, user_id: int) -> dict:
         """Get comprehensive study statistics for user"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.connect() as conn:
                 cursor = conn.cursor()
                 
                 # Get or create user stats
@@ -0,0 +1,103 @@
+import logging
+import time
+import threading
+from collections import OrderedDict
+from functools import wraps
+
+from database import db
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+def cached(ttl: float = 60, maxsize: int = 5000):
+    """Process-local TTL + LRU cache for database read helpers, keyed by positional args."""
+    def decorator(func):
+        entries = OrderedDict()  # key -> (expires_at, value)
+        lock = threading.Lock()
+
+        @wraps(func)
+        def wrapper(*args):
+            now = time.monotonic()
+            with lock:
+                entry = entries.get(args, _MISSING)
+                if entry is not _MISSING and entry[0] > now:
+                    entries.move_to_end(args)
+                    return entry[1]
+            value = func(*args)
+            with lock:
+                entries[args] = (now + ttl, value)
+                entries.move_to_end(args)
+                while len(entries) > maxsize:
+                    entries.popitem(last=False)
+            return value
+
+        def cache_evict(*args) -> None:
+            with lock:
+                entries.pop(args, None)
+
+        def cache_clear() -> None:
+            with lock:
+                entries.clear()
+
+        wrapper.cache_evict = cache_evict
+        wrapper.cache_clear = cache_clear
+        return wrapper
+    return decorator
+
+# --- Cached database reads ---
+@cached(ttl=60, maxsize=5000)
+def cached_user_info(user_id: int):
+    """Cached db.get_user_info"""
+    return db.get_user_info(user_id)
+
+@cached(ttl=60, maxsize=5000)
+def cached_user_vocabulary_count(user_id: int) -> int:
+    """Cached db.get_user_vocabulary_count"""
+    return db.get_user_vocabulary_count(user_id)
+
+@cached(ttl=60, maxsize=1000)
+def cached_user_words(user_id: int) -> frozenset:
+    """Cached db.get_user_words"""
+    return frozenset(db.get_user_words(user_id))
+
+def cached_word_exists(user_id: int, word: str) -> bool:
+    """db.word_exists_in_user_vocabulary answered from the cached word set"""
+    return word.lower().strip() in cached_user_words(user_id)
+
+@cached(ttl=60, maxsize=5000)
+def cached_user_blocked(user_id: int) -> bool:
+    """Cached db.is_user_blocked (checked on every update by require_access)"""
+    return db.is_user_blocked(user_id)
+
+@cached(ttl=30, maxsize=5000)
+def cached_user_speaking_stats(user_id: int) -> dict:
+    """Cached db.get_user_speaking_stats"""
+    return db.get_user_speaking_stats(user_id)
+
+@cached(ttl=30, maxsize=5000)
+def cached_user_writing_stats(user_id: int) -> dict:
+    """Cached db.get_user_writing_stats"""
+    return db.get_user_writing_stats(user_id)
+
+@cached(ttl=30, maxsize=5000)
+def cached_user_profile(user_id: int) -> dict:
+    """Cached db.get_user_profile_bundle"""
+    return db.get_user_profile_bundle(user_id)
+
+@cached(ttl=60, maxsize=1)
+def cached_user_stats() -> dict:
+    """Cached db.get_user_stats"""
+    return db.get_user_stats()
+
+def invalidate_user(user_id: int) -> None:
+    """Drop cached data for a user after a write that affects them"""
+    cached_user_info.cache_evict(user_id)
+    cached_user_vocabulary_count.cache_evict(user_id)
+    cached_user_words.cache_evict(user_id)
+    cached_user_blocked.cache_evict(user_id)
+    cached_user_speaking_stats.cache_evict(user_id)
+    cached_user_writing_stats.cache_evict(user_id)
+    cached_user_profile.cache_evict(user_id)
+    cached_user_stats.cache_clear()
+    logger.debug(f"🔍 Cache invalidated for user {user_id}")
@@ -4,6 +4,7 @@ from telegram.ext import CallbackContext, ConversationHandler, CommandHandler, M
 import logging
 from datetime import datetime
 from database import db
+from db_cache import cached_user_vocabulary_count, invalidate_user
 from bot_handlers import require_access
 
 logger = logging.getLogger(__name__)
@@ -58,7 +59,7 @@ async def handle_flashcard_menu(update: Update, context: CallbackContext) -> Non
     
     # Get user vocabulary stats
     user_vocabulary = db.get_user_vocabulary(user.id, limit=50)
-    vocabulary_count = db.get_user_vocabulary_count(user.id)
+    vocabulary_count = cached_user_vocabulary_count(user.id)
     
     text = (
         f"🎓 <b>СИСТЕМА FLASHCARDS</b>\n\n"
@@ -108,7 +109,7 @@ async def handle_flashcard_study(update: Update, context: CallbackContext) -> No
     
     # Convert user vocabulary to flashcard format
     vocabulary_cards = []
-    for word, definition, translation, example, topic, saved_at in user_vocabulary:
+    for word, definition, translation, example, topic, saved_at, _word_id in user_vocabulary:
         vocabulary_cards.append({
             'id': f"vocab_{hash(word + str(user.id))}",  # Create unique ID
             'type': 'vocabulary',
@@ -516,6 +517,7 @@ async def handle_add_random_words(update: Update, context: CallbackContext) -> N
                         example=parsed['example'],
                         topic="random"
                     )
+                    invalidate_user(user.id)
                     
                     if success:
                         words_added += 1
@@ -3,6 +3,8 @@ import vertexai
 from vertexai.generative_models import GenerativeModel, GenerationConfig
 import time
 import hashlib
+import re
+from functools import lru_cache
 import random
 import os
 
@@ -639,7 +641,13 @@ python main.py
 
 def extract_scores_from_evaluation(evaluation_text: str) -> dict:
     """Extract numerical scores from evaluation text"""
-    import re
+    # Each answer's evaluation is parsed when recorded and again for the final report;
+    # hand out a copy so callers can't mutate the cached result
+    return dict(_extract_scores_cached(evaluation_text))
+
+@lru_cache(maxsize=256)
+def _extract_scores_cached(evaluation_text: str) -> dict:
+    """Parse evaluation text once per distinct string"""
     
     scores = {
         'overall': 0.0,
@@ -685,7 +693,6 @@ def extract_scores_from_evaluation(evaluation_text: str) -> dict:
 
 def extract_writing_scores_from_evaluation(evaluation_text: str) -> dict:
     """Extract numerical scores from writing evaluation text"""
-    import re
     
     scores = {
         'overall': 0.0,
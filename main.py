@@ -1,30 +1,58 @@
 # main.py
 from telegram import Update
-from telegram.ext import Application, CommandHandler, CallbackQueryHandler, MessageHandler, filters
+from telegram.ext import AIORateLimiter, Application, CommandHandler, CallbackQueryHandler, MessageHandler, filters
 import logging
 import config
 import bot_handlers
 import flashcard_handlers
 from gemini_api import initialize_gemini
+from audio_processor import audio_processor
 
 # Configure logging
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
+    level=getattr(logging, str(getattr(config, 'LOG_LEVEL', 'INFO')).upper(), logging.INFO)
 )
 logger = logging.getLogger(__name__)
 
 def main():
     """Sets up and runs the bot."""
     initialize_gemini()
-    application = Application.builder().token(config.TELEGRAM_BOT_TOKEN).build()
+    # Throttle outgoing API calls below Telegram's flood limits instead of hitting RetryAfter
+    rate_limiter = AIORateLimiter(
+        overall_max_rate=25, overall_time_period=1,
+        group_max_rate=18, group_time_period=60,
+    )
+    # One long-lived HTTP/2 connection pool for all Bot API calls, so multi-part sends and
+    # concurrent handlers reuse keep-alive TCP+TLS connections; polling keeps its own small pool
+    application = (
+        Application.builder()
+        .token(config.TELEGRAM_BOT_TOKEN)
+        .rate_limiter(rate_limiter)
+        .connection_pool_size(256)
+        .http_version("2")
+        .get_updates_connection_pool_size(2)
+        .build()
+    )
 
     # --- Setup Bot Menu Button ---
     async def post_init(application: Application) -> None:
         await bot_handlers.setup_bot_menu_button(application)
+        # Batched background writer for add_user/update_user_activity
+        bot_handlers.start_user_writer()
+        # Warm the info/grammar cache and the random word pool without delaying startup
+        application.create_task(bot_handlers.warm_content_cache())
+        bot_handlers.refill_word_pool(application)
     
     application.post_init = post_init
 
+    # --- Release pooled HTTP connections on shutdown ---
+    async def post_shutdown(application: Application) -> None:
+        await bot_handlers.stop_user_writer()
+        audio_processor.close()
+
+    application.post_shutdown = post_shutdown
+
     # --- Conversation Handlers (for multi-step interactions) ---
     application.add_handler(bot_handlers.writing_conversation_handler)
     application.add_handler(bot_handlers.grammar_conversation_handler)
@@ -74,7 +102,8 @@ def main():
     application.add_handler(MessageHandler(filters.ChatType.PRIVATE & (filters.TEXT & ~filters.COMMAND), bot_handlers.handle_global_text_input))
 
     # --- Voice Message Handler (PRIVATE ONLY) ---
-    application.add_handler(MessageHandler(filters.ChatType.PRIVATE & filters.VOICE, bot_handlers.handle_voice_message))
+    # Slow handlers use block=False so the update loop moves on while they run
+    application.add_handler(MessageHandler(filters.ChatType.PRIVATE & filters.VOICE, bot_handlers.handle_voice_message, block=False))
     
     logger.info("✅ Global text input and voice message handlers registered.")
 
@@ -92,8 +121,9 @@ def main():
     # Add handlers for personalization features
     application.add_handler(CallbackQueryHandler(bot_handlers.handle_save_word_to_vocabulary, pattern=r'^save_word_to_vocabulary$'))
     application.add_handler(CallbackQueryHandler(bot_handlers.handle_profile_vocabulary, pattern=r'^profile_vocabulary$'))
+    application.add_handler(CallbackQueryHandler(bot_handlers.handle_vocabulary_pagination, pattern=r'^vocab_page_(before|after)_'))
     application.add_handler(CallbackQueryHandler(bot_handlers.handle_clear_vocabulary, pattern=r'^clear_vocabulary$'))
-    application.add_handler(CallbackQueryHandler(bot_handlers.handle_confirm_clear_vocabulary, pattern=r'^confirm_clear_vocabulary$'))
+    application.add_handler(CallbackQueryHandler(bot_handlers.handle_confirm_clear_vocabulary, pattern=r'^confirm_clear_vocabulary$', block=False))
     application.add_handler(CallbackQueryHandler(bot_handlers.handle_custom_word_add_callback, pattern=r'^custom_word_add$'))
     application.add_handler(CallbackQueryHandler(bot_handlers.handle_custom_word_add_from_menu, pattern=r'^custom_word_add_from_menu$'))
     application.add_handler(CallbackQueryHandler(bot_handlers.handle_ai_enhanced_custom_word, pattern=r'^ai_enhanced_custom_word$'))
@@ -102,7 +132,7 @@ def main():
     application.add_handler(CallbackQueryHandler(bot_handlers.handle_admin_panel_callback, pattern=r'^admin_panel$'))
     application.add_handler(CallbackQueryHandler(bot_handlers.handle_admin_users, pattern=r'^admin_users$'))
     application.add_handler(CallbackQueryHandler(bot_handlers.handle_admin_search, pattern=r'^admin_search$'))
-    application.add_handler(CallbackQueryHandler(bot_handlers.handle_admin_detailed_stats, pattern=r'^admin_stats$'))
+    application.add_handler(CallbackQueryHandler(bot_handlers.handle_admin_detailed_stats, pattern=r'^admin_stats$', block=False))
     application.add_handler(CallbackQueryHandler(bot_handlers.handle_admin_help, pattern=r'^admin_help$'))
     application.add_handler(CallbackQueryHandler(bot_handlers.handle_admin_users_pagination, pattern=r'^admin_users_page_\d+$'))
     
@@ -169,9 +199,22 @@ def main():
         ignore_group_messages
     ))
 
-    # Run the bot
-    logger.info("Bot started polling...")
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    # Run the bot (webhook in production, long polling for local development)
+    if getattr(config, 'TELEGRAM_MODE', 'polling') == 'webhook':
+        webhook_path = getattr(config, 'WEBHOOK_PATH', config.TELEGRAM_BOT_TOKEN)
+        logger.info(f"Bot started in webhook mode on port {config.WEBHOOK_PORT}...")
+        application.run_webhook(
+            listen=getattr(config, 'WEBHOOK_LISTEN', '0.0.0.0'),
+            port=config.WEBHOOK_PORT,
+            url_path=webhook_path,
+            webhook_url=f"{config.WEBHOOK_URL.rstrip('/')}/{webhook_path}",
+            secret_token=getattr(config, 'WEBHOOK_SECRET_TOKEN', None),
+            max_connections=getattr(config, 'WEBHOOK_MAX_CONNECTIONS', 40),
+            allowed_updates=Update.ALL_TYPES
+        )
+    else:
+        logger.info("Bot started polling...")
+        application.run_polling(allowed_updates=Update.ALL_TYPES)
 
 
 if __name__ == "__main__":